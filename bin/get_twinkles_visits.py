@@ -8,7 +8,7 @@ import os
 import argparse
 import pandas as pd
 #from desc.twinkles import get_twinkles_visits
-from desc.twinkles import OpSimOrdering
+from desc.twinkles import OpSimOrdering, schedule_visits, write_visit_list
 from lsst.utils import getPackageDir
 
 parser = argparse.ArgumentParser(description="Write an ascii file of visits derived from an OpSim db file given a fieldID")
@@ -24,7 +24,16 @@ parser.add_argument('--maxPredTime', type=float, default=100.0,
                     help='max predicted phosim run time for the opsim record'
                     ' in hours beyond which the record index obsHistID will '
                     'not be included, defaults to 100.')
+parser.add_argument('--nSlots', type=int, default=None,
+                    help='number of batch slots; if given, the visits of '
+                    'Twinkles 3.1 to 3.3 are ordered in each section to '
+                    'minimize its makespan in that many slots')
+parser.add_argument('--wallClockLimit', type=float, default=None,
+                    help='wall-clock limit of a phoSim job in hours; with '
+                    '--nSlots, visits predicted to take longer are left out')
 args = parser.parse_args()
+if args.wallClockLimit is not None and args.nSlots is None:
+    parser.error('--wallClockLimit needs --nSlots')
 
 # output filename is common
 if args.outfile is None:
@@ -41,18 +50,27 @@ if args.orderObsHistID:
     ops = OpSimOrdering(opSimDBPath=args.opsimDB,
                         randomForestPickle=randomForestPickle,
                         timeMax=args.maxPredTime)
-    with open(args.outfile, 'w') as output:
-        output.write('# Begin Section Twinkles 3.1\n')
-    ops.Twinkles_3p1.obsHistID.to_csv(args.outfile, index=False, mode='a')
-    with open(args.outfile, 'a') as output:
-        output.write('# Begin Section Twinkles 3.1b\n')
-    ops.Twinkles_3p1b.obsHistID.to_csv(args.outfile, index=False, mode='a')
-    with open(args.outfile, 'a') as output:
-        output.write('# Begin Section Twinkles 3.2\n')
-    ops.Twinkles_3p2.obsHistID.to_csv(args.outfile, index=False, mode='a')
-    with open(args.outfile, 'a') as output:
-        output.write('# Begin Section Twinkles 3.3\n')
-    ops.Twinkles_3p3.obsHistID.to_csv(args.outfile, index=False, mode='a')
+    subsets = ops.materialize_all()
+    sections = [('Twinkles 3.1', subsets['Twinkles_3p1']),
+                ('Twinkles 3.1b', subsets['Twinkles_3p1b']),
+                ('Twinkles 3.2', subsets['Twinkles_3p2']),
+                ('Twinkles 3.3', subsets['Twinkles_3p3'])]
+    if args.nSlots is None:
+        for i_section, (title, visits) in enumerate(sections):
+            with open(args.outfile, 'a' if i_section > 0 else 'w') as output:
+                output.write('# Begin Section %s\n' % title)
+            visits.obsHistID.to_csv(args.outfile, index=False, mode='a')
+    else:
+        # bin-pack each section into the batch slots
+        plans = [(title, schedule_visits(visits.obsHistID.values,
+                                         visits.predictedPhoSimTimes.values,
+                                         args.nSlots, args.wallClockLimit))
+                 for title, visits in sections]
+        write_visit_list(args.outfile, plans)
+        for title, plan in plans:
+            print("{0}: {1[visits]} visits, makespan {1[makespan]:.1f} hours, "
+                  "slot utilization {1[utilization]:.3f}, {1[too_long]} visits "
+                  "over the wall-clock limit".format(title, plan.summary()))
 
     Obs_3p4a, Obs_3p4b = ops.Twinkles_3p4
     with open(args.outfile, 'a') as output:
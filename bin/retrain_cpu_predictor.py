@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Command line tool to report the errors of the phoSim CPU time predictions
+against the run times measured by a phoSim task, and to retrain the
+predictor on the Run 1 metadata together with those run times.
+"""
+from __future__ import absolute_import, print_function
+import os
+import json
+import argparse
+import pandas as pd
+from desc.twinkles import (CpuPred, harvest_phosim_runtimes, visit_runtimes,
+                           runtime_training_set, prediction_error_history,
+                           fit_cpu_forest, density_feature)
+from lsst.utils import getPackageDir
+
+parser = argparse.ArgumentParser(description="Compare the predicted phoSim CPU times with those measured by a phoSim task and retrain the predictor")
+parser.add_argument('workRoot', help='phoSim work area of the task (TW_WORK)')
+parser.add_argument('opsimDB', help='OpSim database sqlite file of the visits')
+parser.add_argument('--fieldID', type=int, default=1427,
+                    help='ID number of the field, defaults to 1427')
+parser.add_argument('--RF_file', type=str, default=None,
+                    help='current predictor, defaults to Twinkles/data/RF_forest.npz, or '
+                    'RF_pickle.p if there is none')
+parser.add_argument('--run1Metadata', type=str, default=None,
+                    help='Run 1 CPU times, defaults to Twinkles/data/run1_metadata_v6.csv')
+parser.add_argument('--hostScale', type=str, default=None,
+                    help='JSON dict of the factors converting the CPU time of '
+                    'each host class to a fell host, e.g. \'{"hequ": 1.2}\'')
+parser.add_argument('--period', type=str, default='1D',
+                    help='pandas frequency of the error report, defaults to 1D')
+parser.add_argument('--outfile', type=str, default=None,
+                    help='write the retrained predictor to this .npz file; '
+                    'without it only the errors are reported')
+parser.add_argument('--nEstimators', type=int, default=64,
+                    help='number of trees of the retrained forest, defaults to 64')
+parser.add_argument('--useObjectCounts', action='store_true',
+                    help='also fit to the number of objects in the instance '
+                    'catalogs; the Run 1 metadata have none, so only the '
+                    'harvested visits are used')
+args = parser.parse_args()
+
+twinklesDir = getPackageDir('Twinkles')
+if args.RF_file is None:
+    args.RF_file = os.path.join(twinklesDir, 'data', 'RF_forest.npz')
+    if not os.path.exists(args.RF_file):
+        args.RF_file = os.path.join(twinklesDir, 'data', 'RF_pickle.p')
+if args.run1Metadata is None:
+    args.run1Metadata = os.path.join(twinklesDir, 'data', 'run1_metadata_v6.csv')
+hostScale = None
+if args.hostScale is not None:
+    hostScale = json.loads(args.hostScale)
+
+cpuPred = CpuPred(rf_pickle_file=args.RF_file, opsim_db_file=args.opsimDB,
+                  fieldID=args.fieldID)
+visits = visit_runtimes(harvest_phosim_runtimes(args.workRoot, host_scale=hostScale))
+trainingSet = runtime_training_set(visits, cpuPred)
+print("Harvested {0} visits, {1} of them completed".format(len(visits),
+                                                           len(trainingSet)))
+print("Errors of the predictions of {0}, log10(predicted/actual):".format(args.RF_file))
+print(prediction_error_history(trainingSet, period=args.period))
+
+if args.outfile is not None:
+    if args.useObjectCounts:
+        forest = fit_cpu_forest(trainingSet.dropna(subset=[density_feature]),
+                                n_estimators=args.nEstimators, use_n_objects=True)
+    else:
+        run1meta = pd.read_csv(args.run1Metadata,
+                               usecols=['filter', 'moonalt', 'moonphase', 'cputime_fell'])
+        forest = fit_cpu_forest(pd.concat([run1meta, trainingSet[run1meta.columns]],
+                                          ignore_index=True),
+                                n_estimators=args.nEstimators)
+    forest.write(args.outfile)
+    cpuPred.RFbest = forest
+    if args.useObjectCounts:
+        visits = visits.dropna(subset=[density_feature])
+    print("Errors of the predictions of {0} (visits in the training set):".format(args.outfile))
+    print(prediction_error_history(runtime_training_set(visits, cpuPred),
+                                   period=args.period))
@@ -18,6 +18,7 @@ from sklearn.cross_validation import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.grid_search import GridSearchCV
 from sklearn.metrics import mean_squared_error
+from desc.twinkles import ForestModel
 
 # Define the seed for the Random Forest regressor, train_test_split
 seed = 999
@@ -89,3 +90,10 @@ print(RFbest.feature_importances_)
 
 print('Writing pickle file with the RF best estimator...')
 pickle.dump(RFbest, open('RF_pickle.p', 'wb' ))
+
+# The same forest as flat arrays, which CpuPred can read without pickle
+# or sklearn
+print('Writing npz file with the RF best estimator...')
+forest = ForestModel.from_forest(RFbest)
+np.testing.assert_allclose(forest.predict(X_test), RFbest.predict(X_test))
+forest.write('RF_forest.npz')
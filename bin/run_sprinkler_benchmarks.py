@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Command line tool to time the sprinkler and the galaxy cache
+CatalogDBObject on synthetic inputs and write the results to JSON, and
+to compare the results of two runs.
+"""
+from __future__ import absolute_import, print_function
+import sys
+import argparse
+import tempfile
+from desc.twinkles.benchmarks import (run_benchmarks, write_results,
+                                      read_results, compare_results)
+
+parser = argparse.ArgumentParser(description="Time the sprinkler on synthetic galaxy catalogs")
+parser.add_argument('--outfile', type=str, default='sprinkler_benchmarks.json',
+                    help='JSON file the results are written to, defaults to '
+                    'sprinkler_benchmarks.json')
+parser.add_argument('--work_dir', type=str, default=None,
+                    help='directory for the synthetic inputs and the SN SEDs, '
+                    'defaults to a new temporary directory')
+parser.add_argument('--scenarios', type=str, nargs='+',
+                    default=['sprinkler_init', 'sprinkle', 'create_sn_sed', 'final_pass'],
+                    help='scenarios to run, defaults to all of them')
+parser.add_argument('--rows', type=float, nargs='+', default=[1e4, 1e5, 1e6, 1e7],
+                    help='catalog sizes of the sprinkle and final_pass scenarios, '
+                    'defaults to 1e4 1e5 1e6 1e7')
+parser.add_argument('--chunk_size', type=int, default=100000,
+                    help='rows passed to the sprinkler at once, defaults to 100000')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='number of times each scenario is timed, defaults to 3')
+parser.add_argument('--per_row', default=False, action='store_true',
+                    help='also time the per-row sprinkler (batch_mode=False)')
+parser.add_argument('--no_sn_sed', default=False, action='store_true',
+                    help='do not write the SN SEDs to disk')
+parser.add_argument('--seed', type=int, default=11,
+                    help='seed of the synthetic inputs, defaults to 11')
+parser.add_argument('--compare', type=str, default=None,
+                    help='JSON file of a previous run to compare the results to')
+parser.add_argument('--threshold', type=float, default=0.1,
+                    help='relative slowdown reported as a regression, defaults to 0.1')
+args = parser.parse_args()
+
+work_dir = args.work_dir
+if work_dir is None:
+    work_dir = tempfile.mkdtemp(prefix='sprinkler_benchmarks_')
+
+batch_modes = (True, False) if args.per_row else (True,)
+results = run_benchmarks(work_dir, scenarios=args.scenarios,
+                         n_rows=[int(rows) for rows in args.rows],
+                         chunk_size=args.chunk_size, repeat=args.repeat,
+                         batch_modes=batch_modes,
+                         write_sn_sed=not args.no_sn_sed, seed=args.seed)
+write_results(results, args.outfile)
+print('wrote %s' % args.outfile)
+
+if args.compare is not None:
+    n_regressions = 0
+    for record in compare_results(read_results(args.compare), results,
+                                  threshold=args.threshold):
+        flag = 'REGRESSION' if record['regression'] else ''
+        print('%s %s: %.3f s -> %.3f s (x%.2f) %s' %
+              (record['scenario'], record['params'], record['baseline'],
+               record['current'], record['ratio'], flag))
+        n_regressions += record['regression']
+    if n_regressions > 0:
+        sys.exit(1)
@@ -3,12 +3,25 @@ import warnings
 with warnings.catch_warnings():
     warnings.filterwarnings('ignore', 'Duplicate object type id', UserWarning)
     warnings.filterwarnings('ignore', 'duplicate object identifie', UserWarning)
+    from .agn_drw import *
+    from .agn_light_curve_store import *
+    from .agn_truth import *
     from .analyseICat import *
     from .calc_snr import *
     from .cleanupspectra import *
+    from .forest_model import *
+    from .lens_candidates import *
+    from .magnorm_cache import *
     from .phosim_cpu_pred import *
+    from .phosim_runtimes import *
     from .registry_tools import *
+    from .sed_cache import *
+    from .sharded_sprinkler import *
+    from .sn_sed_writer import *
+    from .sn_system_sed import *
     from .sprinkler import *
+    from .sprinkler_profile import *
+    from .sprinkling_plan import *
     from .sqlite_tools import *
     from .twinklesCatalogDefs import *
     from .twinklesGalaxyCache import *
@@ -16,6 +29,8 @@ with warnings.catch_warnings():
     from .twinklesVariabilityMixins import *
     from .twinkles_io import *
     from .twinkles_sky import *
+    from .visit_scheduler import *
+    from .var_params import *
     from .obsHistIDOrdering import *
     from .validation import *
     try:
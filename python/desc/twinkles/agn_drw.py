@@ -0,0 +1,451 @@
+"""
+Damped random walk light curves of the time-delayed AGN images, as used
+by TimeDelayVariability.applyAgnTimeDelay.
+
+Each object's walk starts at agn_drw_start_date and is stepped in its rest
+frame with steps of tau/100, driven by the normal draws of
+numpy.random.RandomState(seed).  The walks of all the objects are stepped
+together, one time step for every object at once, with the operations of
+the scalar recursion in the same order, so the dMags are identical to
+those of stepping each object in turn.  A walk is only stepped as far as
+the latest time at which it is evaluated.
+
+The images of a lensed AGN share the seed, tau, redshift and structure
+functions of their host and only differ by their time delays, so they
+share a walk: the objects are grouped by (seed, tau, redshift, sfu) and
+each walk is stepped once and evaluated at the delayed times of all the
+objects of its group.
+
+agn_ou_dmags() is an alternative to the grid: it samples the
+Ornstein-Uhlenbeck process the walk approximates, exactly, at the
+requested (delayed, time-dilated) epochs only.  The process is drawn at
+a fixed horizon past any epoch and bridged from the start and the horizon
+to each epoch by repeated halving of the interval around it, with draws
+keyed by the seed and the position of each point.  Its cost is a fixed
+number of halvings per epoch, whatever the baseline, and the value at an
+epoch is a function of the seed and the epoch alone: a light curve
+requested one visit at a time is the one requested all at once.
+"""
+from __future__ import absolute_import, division
+import numbers
+import numpy as np
+
+__all__ = ['agn_drw_start_date', 'agn_drw_time_dexes', 'agn_drw_groups',
+           'agn_drw_extend_walks', 'agn_drw_dmags', 'agn_ou_dmags']
+
+# MJD at which the walks start
+agn_drw_start_date = 58580.0
+
+# number of (time step, object) normal draws held in memory at once
+_block_elements = 2**20
+
+# rest-frame days after the start date at which agn_ou_dmags() draws the
+# process first, and number of halvings of that interval on the way to
+# each epoch (down to about a second)
+_ou_horizon = 2.**16
+_ou_bridge_levels = 32
+
+
+def agn_drw_time_dexes(tau, redshift, t_delay, expmjd,
+                       start_date=agn_drw_start_date):
+    """
+    Return the number of steps of the walk of each object, as set by the
+    latest of the times expmjd, and the index of the step at which each
+    object is evaluated at each of expmjd.
+
+    Parameters
+    ----------
+    tau, redshift, t_delay : `numpy.ndarray`
+        damping time scale in days, redshift and time delay in days of
+        each object
+    expmjd : `numpy.ndarray`
+        MJDs of the visits
+
+    Returns
+    -------
+    nbins : `numpy.ndarray`
+        number of steps of each walk
+    time_dexes : `numpy.ndarray`
+        (object, time) steps at which the walks are evaluated
+    """
+    tau = np.asarray(tau, dtype=float)
+    time_dilation = 1.0 + np.asarray(redshift, dtype=float)
+    t_delay = np.asarray(t_delay, dtype=float)
+    expmjd_arr = np.asarray(expmjd, dtype=float)
+    dt = tau/100.
+    duration_observer_frame = expmjd_arr.max() - start_date
+    duration_rest_frame = duration_observer_frame/time_dilation
+    nbins = np.ceil(duration_rest_frame/dt).astype(int) + 1
+    time_dexes = np.round((expmjd_arr[None, :] - start_date - t_delay[:, None]) /
+                          (time_dilation*dt)[:, None]).astype(int)
+    return nbins, time_dexes
+
+
+def agn_drw_groups(seed, tau, redshift, sfu):
+    """
+    Group the objects sharing a damped random walk.
+
+    Parameters
+    ----------
+    seed, tau, redshift, sfu : `numpy.ndarray`
+        seed of the random draws, damping time scale, redshift and u-band
+        structure function of each object
+
+    Returns
+    -------
+    first : `numpy.ndarray`
+        index of the first object of each group
+    group : `numpy.ndarray`
+        group of each object
+    """
+    keys = np.empty(len(seed), dtype=[('seed', np.int64), ('tau', float),
+                                      ('redshift', float), ('sfu', float)])
+    keys['seed'] = np.asarray(seed).astype(np.int64)
+    keys['tau'] = tau
+    keys['redshift'] = redshift
+    keys['sfu'] = sfu
+    _, first, group = np.unique(keys, return_index=True, return_inverse=True)
+    return first, group.ravel()
+
+
+def agn_drw_extend_walks(seed, tau, sfu, n_steps, last_values=None,
+                         rng_states=None):
+    """
+    Step damped random walks, from their start or from where an earlier
+    call left them, and return the values of the new steps.
+
+    Parameters
+    ----------
+    seed, tau, sfu : `numpy.ndarray`
+        seed of the random draws, damping time scale and u-band structure
+        function of each walk
+    n_steps : `numpy.ndarray`
+        number of new steps of each walk
+    last_values : `numpy.ndarray`, optional
+        value of each walk at its last step taken so far; defaults to the
+        start of the walks
+    rng_states : list, optional
+        state (as returned by numpy.random.RandomState.get_state()) of the
+        random draws of each walk after its last step, or None for the
+        walks that have not been stepped yet
+
+    Returns
+    -------
+    values : list of `numpy.ndarray`
+        the values of the walks at their new steps
+    rng_states : list
+        the states of the random draws of the walks after the new steps
+    """
+    tau = np.asarray(tau, dtype=float)
+    sfu = np.asarray(sfu, dtype=float)
+    n_steps = np.asarray(n_steps, dtype=int)
+    n_walks = len(n_steps)
+    if rng_states is None:
+        rng_states = [None]*n_walks
+    total_steps = n_steps.max() if n_walks > 0 else 0
+    dt = tau/100.
+    dt_over_tau = dt/tau
+    neg_dt_over_tau = -dt_over_tau
+    sqrt_dt_over_tau = np.sqrt(dt_over_tau)
+
+    terms = np.zeros((total_steps, n_walks))
+    new_states = []
+    rng = np.random.RandomState()
+    for i_walk in range(n_walks):
+        if rng_states[i_walk] is None:
+            rng.seed(seed[i_walk])
+        else:
+            rng.set_state(rng_states[i_walk])
+        terms[:n_steps[i_walk], i_walk] = (rng.normal(0., 1., n_steps[i_walk]) *
+                                           sqrt_dt_over_tau[i_walk])
+        new_states.append(rng.get_state())
+    terms *= sfu
+
+    values = np.empty((total_steps, n_walks))
+    dx1 = np.zeros(n_walks)
+    if last_values is None:
+        dx2 = np.zeros(n_walks)
+    else:
+        dx2 = np.array(last_values, dtype=float)
+    for i_time in range(total_steps):
+        dx1, dx2 = dx2, dx1
+        np.multiply(dx1, neg_dt_over_tau, out=dx2)
+        dx2 += terms[i_time]
+        dx2 += dx1
+        values[i_time] = dx2
+    return ([values[:n_steps[i_walk], i_walk] for i_walk in range(n_walks)],
+            new_states)
+
+
+def _drw_interpolate(expmjd, scalar, start_date, t_delay, time_dilation,
+                     d1, d2, xa, xb):
+    """
+    dMags of objects at expmjd, between steps of their walks with values
+    d1, d2 at rest-frame times xa, xb
+    """
+    if scalar:
+        return ((expmjd-start_date-t_delay)*(d1-d2)/time_dilation +
+                d2*xa-d1*xb)/(xa-xb)
+    local_end = (expmjd-start_date-t_delay)/time_dilation
+    return (local_end*(d1-d2)+d2*xa-d1*xb)/(xa-xb)
+
+
+def agn_drw_dmags(seed, tau, redshift, t_delay, sfu, expmjd,
+                  start_date=agn_drw_start_date, store=None):
+    """
+    Return the u-band dMags of the damped random walks of the objects.
+
+    Parameters
+    ----------
+    seed : `numpy.ndarray`
+        seed of the random draws of each object
+    tau, redshift, t_delay : `numpy.ndarray`
+        damping time scale in days, redshift and time delay in days of
+        each object
+    sfu : `numpy.ndarray`
+        u-band structure function of each object
+    expmjd : float or `numpy.ndarray`
+        MJD(s) of the visits
+    start_date : float
+        MJD at which the walks start
+    store : `desc.twinkles.AgnLightCurveStore`, optional
+        persistent store of the walks; the walks are read from it, and
+        only the steps it does not hold yet are taken (and stored)
+
+    Returns
+    -------
+    `numpy.ndarray` of the dMags of each object, with shape (object,) if
+    expmjd is a number and (object, time) otherwise.  Objects whose walk
+    stops before a time get a dMag of zero at that time.
+    """
+    scalar = isinstance(expmjd, numbers.Number)
+    expmjd_arr = np.atleast_1d(np.asarray(expmjd, dtype=float))
+    seed = np.asarray(seed)
+    tau = np.asarray(tau, dtype=float)
+    redshift = np.asarray(redshift, dtype=float)
+    time_dilation = 1.0 + redshift
+    t_delay = np.asarray(t_delay, dtype=float)
+    sfu = np.asarray(sfu, dtype=float)
+    n_obj = len(seed)
+    dmags = np.zeros((n_obj, len(expmjd_arr)))
+    if n_obj == 0:
+        return dmags[:, 0] if scalar else dmags
+
+    nbins, time_dexes = agn_drw_time_dexes(tau, redshift, t_delay,
+                                           expmjd_arr, start_date=start_date)
+    assert time_dexes.min() >= 0
+
+    # the (object, time) pairs to evaluate, ordered by the step at which
+    # they are evaluated
+    cap_obj, cap_time = np.where(time_dexes < nbins[:, None])
+    cap_step = time_dexes[cap_obj, cap_time]
+    order = np.argsort(cap_step, kind='mergesort')
+    cap_obj, cap_time, cap_step = cap_obj[order], cap_time[order], cap_step[order]
+    steps, cap_start = np.unique(cap_step, return_index=True)
+    cap_end = np.append(cap_start[1:], len(cap_step))
+
+    # one walk per group, stepped as far as any of its objects needs
+    first, group = agn_drw_groups(seed, tau, redshift, sfu)
+    n_walks = len(first)
+    cap_walk = group[cap_obj]
+    n_steps = np.zeros(n_walks, dtype=int)
+    np.maximum.at(n_steps, cap_walk, cap_step + 1)
+    total_steps = n_steps.max() if len(n_steps) > 0 else 0
+
+    if store is not None:
+        walks = store.walks(seed[first], tau[first], redshift[first], sfu[first],
+                            start_date, n_steps)
+        order = np.argsort(cap_walk, kind='mergesort')
+        bounds = np.searchsorted(cap_walk[order], np.arange(n_walks + 1))
+        for i_walk in np.where(n_steps > 0)[0]:
+            caps = order[bounds[i_walk]:bounds[i_walk+1]]
+            obj = cap_obj[caps]
+            step = cap_step[caps]
+            walk = walks[i_walk]
+            # the rest-frame time after each step, summed as the walk does
+            x_walk = np.cumsum(np.full(n_steps[i_walk], tau[first[i_walk]]/100.))
+            previous = np.maximum(step - 1, 0)
+            d1 = np.where(step > 0, walk[previous], 0.0)
+            xa = np.where(step > 0, x_walk[previous], 0.0)
+            dmags[obj, cap_time[caps]] = _drw_interpolate(expmjd if scalar else expmjd_arr[cap_time[caps]],
+                                                          scalar, start_date, t_delay[obj],
+                                                          time_dilation[obj], d1, walk[step],
+                                                          xa, x_walk[step])
+        return dmags[:, 0] if scalar else dmags
+
+    dt = tau[first]/100.
+    dt_over_tau = dt/tau[first]
+    neg_dt_over_tau = -dt_over_tau
+    sqrt_dt_over_tau = np.sqrt(dt_over_tau)
+    walk_sfu = sfu[first]
+    walk_seed = seed[first]
+    block_len = max(1, _block_elements//n_walks)
+    if total_steps <= block_len:
+        # the draws of every walk are made at once, and reseeding a single
+        # generator is much cheaper than constructing one per walk
+        rngs = None
+        shared_rng = np.random.RandomState()
+    else:
+        rngs = [np.random.RandomState(obj_seed) for obj_seed in walk_seed]
+
+    dx1 = np.zeros(n_walks)
+    dx2 = np.zeros(n_walks)
+    x1 = np.zeros(n_walks)
+    x2 = np.zeros(n_walks)
+    i_cap = 0
+    for block_start in range(0, total_steps, block_len):
+        block_end = min(block_start + block_len, total_steps)
+        # each walk's draws continue its own stream, so they are the
+        # draws of a single call of the length of the walk
+        terms = np.zeros((block_end - block_start, n_walks))
+        for i_walk in np.where(n_steps > block_start)[0]:
+            n_draws = min(block_end, n_steps[i_walk]) - block_start
+            if rngs is None:
+                shared_rng.seed(walk_seed[i_walk])
+                rng = shared_rng
+            else:
+                rng = rngs[i_walk]
+            terms[:n_draws, i_walk] = (rng.normal(0., 1., n_draws) *
+                                       sqrt_dt_over_tau[i_walk])
+        terms *= walk_sfu
+
+        for i_time in range(block_start, block_end):
+            #The second term differs from Zeljko's equation by sqrt(2.)
+            #because he assumes stdev = sfint/sqrt(2)
+            dx1, dx2 = dx2, dx1
+            np.multiply(dx1, neg_dt_over_tau, out=dx2)
+            dx2 += terms[i_time - block_start]
+            dx2 += dx1
+            x1, x2 = x2, x1
+            np.add(x1, dt, out=x2)
+
+            if i_cap < len(steps) and steps[i_cap] == i_time:
+                caps = slice(cap_start[i_cap], cap_end[i_cap])
+                obj = cap_obj[caps]
+                walk = cap_walk[caps]
+                dmags[obj, cap_time[caps]] = _drw_interpolate(expmjd if scalar else expmjd_arr[cap_time[caps]],
+                                                              scalar, start_date, t_delay[obj],
+                                                              time_dilation[obj], dx1[walk], dx2[walk],
+                                                              x1[walk], x2[walk])
+                i_cap += 1
+
+    return dmags[:, 0] if scalar else dmags
+
+
+def _splitmix64(x):
+    "The splitmix64 hash of the uint64 array x"
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _keyed_normals(*keys):
+    """
+    Standard normal draws that are a function of the integer arrays keys
+    alone, made with the Box-Muller transform of two hashes of the keys
+    """
+    keys = np.broadcast_arrays(*[np.atleast_1d(key) for key in keys])
+    with np.errstate(over='ignore'):
+        hashed = np.zeros(keys[0].shape, dtype=np.uint64)
+        for key in keys:
+            hashed = _splitmix64(hashed ^ key.astype(np.int64).view(np.uint64))
+        u1 = ((_splitmix64(hashed ^ np.uint64(1)) >> np.uint64(11)).astype(float) + 0.5)/2.**53
+        u2 = (_splitmix64(hashed ^ np.uint64(2)) >> np.uint64(11)).astype(float)/2.**53
+    return np.sqrt(-2.0*np.log(u1))*np.cos(2.0*np.pi*u2)
+
+
+def _ou_bridge(x_lo, x_hi, dt_lo, dt_hi, tau, sfu, draws):
+    """
+    Sample the OU process at a time dt_lo after a point with value x_lo and
+    dt_hi before one with value x_hi, given those values
+    """
+    dt_lo = np.maximum(dt_lo, 0.0)
+    dt_hi = np.maximum(dt_hi, 0.0)
+    phi_lo = np.exp(-dt_lo/tau)
+    phi_hi = np.exp(-dt_hi/tau)
+    # 1 - phi**2, accurate for intervals much shorter than tau
+    decay_lo = -np.expm1(-2.0*dt_lo/tau)
+    decay_hi = -np.expm1(-2.0*dt_hi/tau)
+    norm = -np.expm1(-2.0*(dt_lo + dt_hi)/tau)
+    mean = (x_lo*phi_lo*decay_hi + x_hi*phi_hi*decay_lo)/norm
+    var = 0.5*sfu**2*decay_lo*decay_hi/norm
+    return mean + np.sqrt(var)*draws
+
+
+def agn_ou_dmags(seed, tau, redshift, t_delay, sfu, expmjd,
+                 start_date=agn_drw_start_date):
+    """
+    Return the u-band dMags of the objects, sampled exactly from the
+    Ornstein-Uhlenbeck process with damping time scale tau and asymptotic
+    structure function sfu that starts at zero at start_date, i.e. the
+    continuous limit of the walks of agn_drw_dmags().
+
+    Objects grouped by agn_drw_groups() share a realization.  It is drawn
+    at the horizon, _ou_horizon rest-frame days after the start, given its
+    value of zero at the start; each epoch is then reached by halving the
+    interval around it _ou_bridge_levels times, drawing the process at
+    each midpoint given the two ends, and a last bridge to the epoch
+    itself.  The draws are keyed by the seed and the position of each
+    point, so the dMags at an epoch do not depend on the other epochs of
+    the call, and the cost is _ou_bridge_levels bridges per distinct epoch
+    of each group, whatever the baseline.
+
+    The parameters and returned array are those of agn_drw_dmags().
+    """
+    scalar = isinstance(expmjd, numbers.Number)
+    expmjd_arr = np.atleast_1d(np.asarray(expmjd, dtype=float))
+    seed = np.asarray(seed)
+    tau = np.asarray(tau, dtype=float)
+    redshift = np.asarray(redshift, dtype=float)
+    t_delay = np.asarray(t_delay, dtype=float)
+    sfu = np.asarray(sfu, dtype=float)
+    n_obj = len(seed)
+    if n_obj == 0:
+        dmags = np.zeros((0, len(expmjd_arr)))
+        return dmags[:, 0] if scalar else dmags
+
+    # rest-frame time since the start of each (object, time) pair
+    rest_time = ((expmjd_arr[None, :] - start_date - t_delay[:, None]) /
+                 (1.0 + redshift)[:, None])
+    assert rest_time.min() >= 0
+    if rest_time.max() >= _ou_horizon:
+        raise ValueError('epochs more than %g rest-frame days after the start date '
+                         'are past the horizon of agn_ou_dmags' % _ou_horizon)
+
+    first, group = agn_drw_groups(seed, tau, redshift, sfu)
+    pair_group = np.repeat(group, len(expmjd_arr))
+
+    # the distinct epochs of each group
+    epochs = np.empty(rest_time.size, dtype=[('group', int), ('time', float)])
+    epochs['group'] = pair_group
+    epochs['time'] = rest_time.ravel()
+    epochs, pair_epoch = np.unique(epochs, return_inverse=True)
+    epoch_group = epochs['group']
+    epoch_time = np.ascontiguousarray(epochs['time'])
+    epoch_seed = seed[first][epoch_group].astype(np.int64)
+    epoch_tau = tau[first][epoch_group]
+    epoch_sfu = sfu[first][epoch_group]
+
+    t_lo = np.zeros(len(epochs))
+    x_lo = np.zeros(len(epochs))
+    t_hi = np.full(len(epochs), _ou_horizon)
+    x_hi = _ou_bridge(x_lo, 0.0, t_hi, np.inf, epoch_tau, epoch_sfu,
+                      _keyed_normals(epoch_seed, 0, 0))
+    # the midpoints are numbered as the nodes of a binary heap
+    node = np.ones(len(epochs), dtype=np.int64)
+    for _ in range(_ou_bridge_levels):
+        t_mid = 0.5*(t_lo + t_hi)
+        x_mid = _ou_bridge(x_lo, x_hi, t_mid - t_lo, t_hi - t_mid, epoch_tau, epoch_sfu,
+                           _keyed_normals(epoch_seed, 0, node))
+        upper = epoch_time >= t_mid
+        t_lo = np.where(upper, t_mid, t_lo)
+        x_lo = np.where(upper, x_mid, x_lo)
+        t_hi = np.where(upper, t_hi, t_mid)
+        x_hi = np.where(upper, x_hi, x_mid)
+        node = 2*node + upper
+    values = _ou_bridge(x_lo, x_hi, epoch_time - t_lo, t_hi - epoch_time, epoch_tau, epoch_sfu,
+                        _keyed_normals(epoch_seed, 1, epoch_time.view(np.int64)))
+
+    dmags = values[pair_epoch.ravel()].reshape(n_obj, len(expmjd_arr))
+    return dmags[:, 0] if scalar else dmags
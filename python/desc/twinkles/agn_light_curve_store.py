@@ -0,0 +1,340 @@
+"""
+Persistent store of the damped random walks of the time-delayed AGN.
+
+applyAgnTimeDelay steps the walk of an AGN from agn_drw_start_date up to
+the latest MJD it is asked for, so every visit of a run steps the same
+walks again from the start.  AgnLightCurveStore keeps each walk in its own
+file, together with the state of its random draws, so a later call (in
+this process or another one) memory-maps the steps already taken and only
+takes the steps past them.  The walks are those of agn_drw_dmags, bit for
+bit.
+
+A walk is extended by appending its new steps to its file and then
+rewriting the header, which records the number of steps at both of its
+ends, under an exclusive lock of the file.  A reader trusts a header only
+if both of its counts agree and the file holds at least the steps they
+count, so it never maps steps still being written, and the steps it has
+mapped are never rewritten.  A new walk is written to a temporary file
+renamed over its file, and a reader which has mapped a file keeps a valid
+map if the file is replaced or evicted meanwhile.  Each walk is a function
+of its key only, so two processes extending the same walk write the same
+steps.  The store is bounded by max_bytes: each store tracks the size of
+the directory from its first write on, and evicts the least recently used
+walks once that size passes max_bytes.
+"""
+from __future__ import absolute_import, division
+import os
+import hashlib
+import tempfile
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from .agn_drw import agn_drw_start_date, agn_drw_extend_walks
+
+__all__ = ['AgnLightCurveStore']
+
+# bump this if the layout of the files or the walks change
+_store_version = 2
+
+_magic = b'TWKDRW'
+
+_header_dtype = np.dtype([('magic', 'S8'), ('version', '<i8'),
+                          ('n_steps', '<i8'), ('pos', '<i8'),
+                          ('has_gauss', '<i8'), ('cached_gaussian', '<f8'),
+                          ('key', '<u4', (624,)), ('n_steps_end', '<i8')])
+
+_suffix = '.drw'
+
+# maximum number of (step, walk) elements extended at once
+_batch_elements = 2**22
+
+
+def _make_header(n_steps, rng_state):
+    """
+    Return the header of a walk of n_steps steps whose random draws are
+    in the state rng_state after its last step.
+    """
+    header = np.zeros(1, dtype=_header_dtype)
+    header['magic'] = _magic
+    header['version'] = _store_version
+    header['n_steps'] = n_steps
+    header['n_steps_end'] = n_steps
+    header['key'] = rng_state[1]
+    header['pos'] = rng_state[2]
+    header['has_gauss'] = rng_state[3]
+    header['cached_gaussian'] = rng_state[4]
+    return header
+
+
+def _read_header(input_file):
+    """
+    Return the header of the open walk file input_file, or None if it is
+    not a complete header of a file holding all of its steps.
+    """
+    input_file.seek(0)
+    header = np.fromfile(input_file, dtype=_header_dtype, count=1)
+    if (len(header) != 1 or header['magic'][0] != _magic or
+            header['version'][0] != _store_version or
+            header['n_steps'][0] != header['n_steps_end'][0]):
+        return None
+    if os.fstat(input_file.fileno()).st_size < _header_dtype.itemsize + 8*int(header['n_steps'][0]):
+        return None
+    return header
+
+
+class AgnLightCurveStore(object):
+    """
+    Memory-mapped store of AGN damped random walks, keyed by the seed,
+    tau, redshift and u-band structure function of the walk, its start
+    date and its step.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        directory of the store; defaults to the agn_light_curves
+        directory of desc.twinkles.twinkles_cache_dir()
+    max_bytes : int, optional
+        size above which the least recently used walks are evicted; the
+        size is that of the directory when the store first writes to it,
+        plus what the store writes
+
+    Attributes
+    ----------
+    stats : dict
+        numbers of walks found long enough ('hits'), not found ('misses')
+        and extended ('extensions'), and of files evicted ('evictions')
+    """
+    def __init__(self, cache_dir=None, max_bytes=2**30):
+        if cache_dir is None:
+            # imported here so that the store does not need the stack
+            from .magnorm_cache import twinkles_cache_dir
+            cache_dir = os.path.join(twinkles_cache_dir(), 'agn_light_curves')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = dict(hits=0, misses=0, extensions=0, evictions=0)
+        self._tracked_bytes = None
+
+    @staticmethod
+    def walk_key(seed, tau, redshift, sfu, start_date=agn_drw_start_date):
+        """
+        Return the hash identifying a walk; the step of the walk is tau/100.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(('agn drw v%d %d' % (_store_version, int(seed))).encode('ascii'))
+        for value in (tau, redshift, sfu, start_date, tau/100.):
+            hasher.update(float(value).hex().encode('ascii'))
+        return hasher.hexdigest()
+
+    def _file_name(self, key):
+        return os.path.join(self.cache_dir, key + _suffix)
+
+    def read(self, key):
+        """
+        Return the header and the read-only map of the values of the walk
+        key, or None if the store does not hold it.
+        """
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, 'rb') as input_file:
+                header = _read_header(input_file)
+                if header is None:
+                    return None
+                n_steps = int(header['n_steps'][0])
+                values = np.memmap(input_file, dtype='<f8', mode='r',
+                                   offset=_header_dtype.itemsize, shape=(n_steps,))
+            os.utime(file_name, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return header[0], values
+
+    def write(self, key, values, rng_state):
+        """
+        Store the values of the walk key and the state of its random
+        draws after its last step.
+        """
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        header = _make_header(len(values), rng_state)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                output.write(header.tobytes())
+                output.write(np.ascontiguousarray(values, dtype='<f8').tobytes())
+            os.rename(tmp_name, self._file_name(key))
+        except Exception:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+    def append(self, key, n_old, values, rng_state):
+        """
+        Append values to the first n_old values of the walk key in place,
+        and store the state of its random draws after its last step.
+
+        Returns
+        -------
+        bool, False (and nothing written) if the store does not hold
+        n_old values of the walk, or cannot lock its file
+        """
+        if fcntl is None:
+            return False
+        try:
+            output = open(self._file_name(key), 'r+b')
+        except (IOError, OSError):
+            return False
+        with output:
+            fcntl.flock(output.fileno(), fcntl.LOCK_EX)
+            header = _read_header(output)
+            if header is None or header['n_steps'][0] != n_old:
+                return False
+            # drop what an interrupted append may have left past the steps
+            output.truncate(_header_dtype.itemsize + 8*n_old)
+            output.seek(0, os.SEEK_END)
+            output.write(np.ascontiguousarray(values, dtype='<f8').tobytes())
+            output.flush()
+            output.seek(0)
+            output.write(_make_header(n_old + len(values), rng_state).tobytes())
+            output.flush()
+        return True
+
+    def walks(self, seed, tau, redshift, sfu, start_date, n_steps):
+        """
+        Return the values of walks over at least their first n_steps steps,
+        extending (and storing) the walks the store holds fewer steps of.
+
+        Parameters
+        ----------
+        seed, tau, redshift, sfu : `numpy.ndarray`
+            parameters of each walk
+        start_date : float
+            MJD at which the walks start
+        n_steps : `numpy.ndarray`
+            number of steps needed of each walk
+
+        Returns
+        -------
+        list of `numpy.ndarray` of the values of each walk after each step
+        """
+        n_steps = np.asarray(n_steps, dtype=int)
+        walks = [np.zeros(0)]*len(n_steps)
+        keys = {}
+        to_extend = []
+        stored = {}
+        for i_walk in np.where(n_steps > 0)[0]:
+            key = self.walk_key(seed[i_walk], tau[i_walk], redshift[i_walk],
+                                sfu[i_walk], start_date)
+            keys[i_walk] = key
+            found = self.read(key)
+            if found is None:
+                self.stats['misses'] += 1
+            elif len(found[1]) >= n_steps[i_walk]:
+                self.stats['hits'] += 1
+                walks[i_walk] = found[1]
+                continue
+            else:
+                self.stats['extensions'] += 1
+            stored[i_walk] = found
+            to_extend.append(i_walk)
+
+        if to_extend and self._tracked_bytes is None:
+            self._tracked_bytes = self.size()
+
+        # extend in batches of walks needing similar numbers of new steps
+        n_old = dict((i_walk, 0 if stored[i_walk] is None else len(stored[i_walk][1]))
+                     for i_walk in to_extend)
+        to_extend.sort(key=lambda i_walk: n_steps[i_walk] - n_old[i_walk])
+        while to_extend:
+            batch = []
+            for i_walk in to_extend:
+                if batch and (len(batch) + 1)*(n_steps[i_walk] - n_old[i_walk]) > _batch_elements:
+                    break
+                batch.append(i_walk)
+            to_extend = to_extend[len(batch):]
+            last_values = []
+            rng_states = []
+            for i_walk in batch:
+                if stored[i_walk] is None:
+                    last_values.append(0.0)
+                    rng_states.append(None)
+                else:
+                    header, values = stored[i_walk]
+                    last_values.append(values[-1])
+                    rng_states.append(('MT19937', header['key'], int(header['pos']),
+                                       int(header['has_gauss']),
+                                       float(header['cached_gaussian'])))
+            batch_arr = np.array(batch)
+            new_values, rng_states = agn_drw_extend_walks(
+                seed[batch_arr], tau[batch_arr], sfu[batch_arr],
+                n_steps[batch_arr] - np.array([n_old[i_walk] for i_walk in batch]),
+                last_values=last_values, rng_states=rng_states)
+            for i_walk, values, rng_state in zip(batch, new_values, rng_states):
+                key = keys[i_walk]
+                if stored[i_walk] is not None and self.append(key, n_old[i_walk],
+                                                              values, rng_state):
+                    self._tracked_bytes += 8*len(values)
+                    found = self.read(key)
+                    if found is not None and len(found[1]) >= n_steps[i_walk]:
+                        walks[i_walk] = found[1]
+                    else:
+                        walks[i_walk] = np.concatenate((stored[i_walk][1], values))
+                    continue
+                if stored[i_walk] is not None:
+                    # the file was evicted or replaced since it was read
+                    values = np.concatenate((stored[i_walk][1], values))
+                    self._tracked_bytes -= _header_dtype.itemsize + 8*n_old[i_walk]
+                self.write(key, values, rng_state)
+                self._tracked_bytes += _header_dtype.itemsize + 8*len(values)
+                walks[i_walk] = values
+
+        if self._tracked_bytes is not None and self._tracked_bytes > self.max_bytes:
+            self.evict(protect=set(keys.values()))
+        return walks
+
+    def evict(self, protect=()):
+        """
+        Delete the least recently used walks, except those in protect,
+        until the store takes no more than max_bytes.
+        """
+        if not os.path.isdir(self.cache_dir):
+            self._tracked_bytes = 0
+            return
+        files = []
+        total = 0
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(_suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                continue
+            total += stat.st_size
+            files.append((stat.st_mtime, file_name, stat.st_size))
+        files.sort()
+        for _, file_name, size in files:
+            if total <= self.max_bytes:
+                break
+            if file_name[:-len(_suffix)] in protect:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                continue
+            total -= size
+            self.stats['evictions'] += 1
+        self._tracked_bytes = total
+
+    def size(self):
+        """
+        Return the number of bytes the walks of the store take.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        return sum(os.path.getsize(os.path.join(self.cache_dir, file_name))
+                   for file_name in os.listdir(self.cache_dir)
+                   if file_name.endswith(_suffix))
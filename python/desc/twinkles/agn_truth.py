@@ -0,0 +1,181 @@
+"""
+Truth light curves of the sprinkled, time-delayed AGN.
+
+The truth tables of the time-delay challenge need the dMag of every
+lensed AGN image at every visit.  Going through the variability mixins
+means building an instance catalog per visit; agn_truth_dmags() instead
+takes the sprinkled catalog and the MJDs and bands of all the visits (e.g.
+the expMJD and filter columns of OpSimOrdering.filteredOpSim) and returns
+the (object, visit) dMag matrix in one pass, with the same dMags as
+TimeDelayVariability.applyAgnTimeDelay.  The objects are split into shards
+of whole walks (the images of a lensed AGN share one), which can be
+computed in parallel worker processes.
+"""
+from __future__ import absolute_import, division
+import json
+import multiprocessing
+import numpy as np
+from .agn_drw import agn_drw_dmags, agn_drw_groups, agn_ou_dmags
+from .var_params import add_var_param_columns, var_param_column
+
+__all__ = ['agn_truth_dmags', 'write_agn_truth', 'read_agn_truth']
+
+_bands = 'ugrizy'
+
+# bump this if the layout of the truth files changes
+_truth_version = 1
+
+
+# the sampler arguments of the worker processes, set by _init_worker
+_worker_kwargs = None
+
+
+def _init_worker(kwargs):
+    global _worker_kwargs
+    _worker_kwargs = kwargs
+
+
+def _shard_dmags(args):
+    return _u_band_dmags(*args, **_worker_kwargs)
+
+
+def _u_band_dmags(seed, tau, redshift, t_delay, sfu, expmjd, sampler='grid',
+                  store=None):
+    if sampler == 'exact':
+        return agn_ou_dmags(seed, tau, redshift, t_delay, sfu, expmjd)
+    return agn_drw_dmags(seed, tau, redshift, t_delay, sfu, expmjd, store=store)
+
+
+def _fork_context():
+    # the workers inherit the light curve store instead of unpickling it
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def agn_truth_dmags(catalog, expmjd, bands, var_col='varParamStr',
+                    redshift_col='redshift', sampler='grid', store=None,
+                    processes=0, n_shards=None):
+    """
+    Return the dMags of the time-delayed AGN of a sprinkled catalog at a
+    set of visits.
+
+    Parameters
+    ----------
+    catalog : `numpy.ndarray`
+        structured array of sprinkled objects, with a JSON variability
+        column (or its typed columns, see desc.twinkles.var_params) and a
+        redshift column
+    expmjd : array_like
+        MJD of each visit
+    bands : array_like
+        band ('u', 'g', 'r', 'i', 'z' or 'y') of each visit
+    var_col : str, optional
+        name of the variability column
+    redshift_col : str, optional
+        name of the redshift column
+    sampler : str, optional, defaults to 'grid'
+        'grid' or 'exact', see TimeDelayVariability.agn_drw_sampler
+    store : `desc.twinkles.AgnLightCurveStore`, optional
+        store of the 'grid' walks
+    processes : int, optional, defaults to 0
+        number of worker processes, which are forked from the calling
+        process; with 0 the dMags are computed by the calling process
+    n_shards : int, optional
+        number of shards of the objects; defaults to 4 per process
+
+    Returns
+    -------
+    rows : `numpy.ndarray`
+        indices of the rows of catalog with applyAgnTimeDelay variability
+    dmags : `numpy.ndarray`
+        dMags of those rows (first axis) at the visits (second axis)
+    """
+    if sampler not in ('grid', 'exact'):
+        raise ValueError('unknown sampler %s; expected grid or exact' % sampler)
+    expmjd = np.asarray(expmjd, dtype=float)
+    band_dex = np.array([_bands.index(band) for band in np.asarray(bands).astype(str)],
+                        dtype=int)
+    if band_dex.shape != expmjd.shape:
+        raise ValueError('expected one band per visit')
+
+    catalog = add_var_param_columns(catalog, var_col)
+    rows = np.where(catalog[var_param_column(var_col, 'method')] == 'applyAgnTimeDelay')[0]
+    params = dict((field, catalog[var_param_column(var_col, field)][rows])
+                  for field in ('seed', 't0Delay', 'agn_tau', 'agn_sfu'))
+    redshift = catalog[redshift_col][rows].astype(float)
+    dmags = np.zeros((len(rows), len(expmjd)))
+    if len(rows) == 0 or len(expmjd) == 0:
+        return rows, dmags
+
+    # each distinct MJD is computed once, in the u band
+    mjds, mjd_dex = np.unique(expmjd, return_inverse=True)
+    args = (params['seed'], params['agn_tau'], redshift, params['t0Delay'],
+            params['agn_sfu'])
+    if processes <= 0:
+        u_dmags = _u_band_dmags(*(args + (mjds,)), sampler=sampler, store=store)
+    else:
+        if n_shards is None:
+            n_shards = 4*processes
+        _, group = agn_drw_groups(params['seed'], params['agn_tau'], redshift,
+                                  params['agn_sfu'])
+        shard = (group*n_shards)//(group.max() + 1)
+        shards = [np.where(shard == i_shard)[0] for i_shard in np.unique(shard)]
+        pool = _fork_context().Pool(min(processes, len(shards)),
+                                    initializer=_init_worker,
+                                    initargs=(dict(sampler=sampler, store=store),))
+        try:
+            outputs = pool.map(_shard_dmags,
+                               [tuple(arr[objs] for arr in args) + (mjds,)
+                                for objs in shards], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        u_dmags = np.zeros((len(rows), len(mjds)))
+        for objs, output in zip(shards, outputs):
+            u_dmags[objs] = output
+
+    # the other bands scale the u band dMags by their structure functions,
+    # as applyAgnTimeDelay does
+    dmags[:] = u_dmags[:, mjd_dex]
+    for i_band in np.unique(band_dex[band_dex > 0]):
+        visits = np.where(band_dex == i_band)[0]
+        sf = catalog[var_param_column(var_col, 'agn_sf%s' % _bands[i_band])][rows]
+        dmags[:, visits] = dmags[:, visits]*sf[:, None]/params['agn_sfu'][:, None]
+    return rows, dmags
+
+
+def write_agn_truth(file_name, ids, expmjd, bands, dmags, obsHistIDs=None):
+    """
+    Write AGN truth light curves to the .npz file file_name, one array per
+    column: the object ids ('id'), the MJD, band and (optionally)
+    obsHistID of the visits ('expMJD', 'filter', 'obsHistID') and the
+    (object, visit) dMag matrix ('dmag').
+    """
+    dmags = np.asarray(dmags, dtype=float)
+    if dmags.shape != (len(ids), len(expmjd)):
+        raise ValueError('expected a dMag matrix of shape (%d, %d); got %s'
+                         % (len(ids), len(expmjd), dmags.shape))
+    arrays = {'meta': np.array(json.dumps({'version': _truth_version})),
+              'id': np.asarray(ids),
+              'expMJD': np.asarray(expmjd, dtype=float),
+              'filter': np.asarray(bands).astype(str),
+              'dmag': dmags}
+    if obsHistIDs is not None:
+        arrays['obsHistID'] = np.asarray(obsHistIDs)
+    with open(file_name, 'wb') as output_file:
+        np.savez(output_file, **arrays)
+
+
+def read_agn_truth(file_name):
+    """
+    Read the truth light curves written by write_agn_truth() and return
+    them as a dict of their columns
+    """
+    with np.load(file_name, allow_pickle=False) as truth_file:
+        meta = json.loads(str(truth_file['meta']))
+        if meta['version'] != _truth_version:
+            raise RuntimeError('%s is a version %d truth file; expected version %d'
+                               % (file_name, meta['version'], _truth_version))
+        return dict((name, truth_file[name]) for name in truth_file.files
+                    if name != 'meta')
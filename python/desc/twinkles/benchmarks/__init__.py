@@ -0,0 +1,3 @@
+from __future__ import absolute_import
+from .synthetic import *
+from .scenarios import *
@@ -0,0 +1,460 @@
+"""
+Timed benchmark scenarios for the sprinkler and the galaxy cache
+CatalogDBObject, run on the synthetic inputs of
+desc.twinkles.benchmarks.synthetic so that they need neither the CatSim
+database nor the DC2 data.  Results are plain dicts that are written to
+JSON, so that runs on two commits can be compared with compare_results().
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from timeit import default_timer
+import numpy as np
+from lsst.utils import getPackageDir
+from lsst.sims.utils import SpecMap
+from lsst.sims.photUtils import BandpassDict
+from ..magnorm_cache import load_src_mag_norm
+from ..sprinkler import sprinkler, sprinkler_registry, _peak_rss_bytes
+from ..twinklesGalaxyCache import GalaxyCacheSprinklerObj
+from .synthetic import (read_defs_file, write_defs_file, complete_defs,
+                        make_om10_catalog, write_om10_catalog,
+                        make_sne_catalog, SyntheticGalaxyChunks)
+
+__all__ = ['BenchmarkInputs', 'bench_sprinkler_init', 'bench_sprinkle',
+           'bench_create_sn_sed', 'bench_final_pass', 'run_benchmarks',
+           'write_results', 'read_results', 'compare_results']
+
+# MJD of the benchmark visit, within the range of the stand-in SNe
+_visit_mjd = 60500.0
+
+
+class BenchmarkInputs(object):
+    """
+    Work directory holding the stand-in OM10 and SNe catalogs and the defs
+    file of a catalog layout, from which the benchmarks build sprinklers
+    and galaxy chunks.
+
+    Parameters
+    ----------
+    work_dir : str
+        directory in which the inputs (and the SN SEDs written by the
+        sprinkler) are put; it is created if needed
+    layout : str
+        'dc2' or 'catsim', for the column layout of data/dc2_defs.csv or
+        data/catsim_defs.csv
+    n_lenses : int
+        number of systems in the OM10 stand-in
+    n_sne_systems : int
+        number of systems in the SNe stand-in
+    seed : int
+        seed of the synthetic inputs
+    """
+    def __init__(self, work_dir, layout='dc2', n_lenses=1000,
+                 n_sne_systems=1000, seed=11):
+        self.layout = layout
+        self.seed = seed
+        self.work_dir = os.path.join(work_dir, layout)
+        if not os.path.isdir(self.work_dir):
+            os.makedirs(self.work_dir)
+
+        self.lenscat = make_om10_catalog(n_lenses, seed=seed)
+        self.om10_cat = os.path.join(self.work_dir, 'benchmark_lenses.fits')
+        write_om10_catalog(self.lenscat, self.om10_cat)
+
+        self.sne_catalog = make_sne_catalog(n_sne_systems, seed=seed+1)
+        self.sne_cat = os.path.join(self.work_dir, 'benchmark_sne_cat.csv')
+        self.sne_catalog.to_csv(self.sne_cat, index=False)
+
+        defs_file = os.path.join(getPackageDir('Twinkles'), 'data', '%s_defs.csv' % layout)
+        self.defs = complete_defs(read_defs_file(defs_file))
+        self.defs_file = os.path.join(self.work_dir, 'benchmark_defs.csv')
+        write_defs_file(self.defs, self.defs_file)
+
+        self.sed_path = os.path.join(self.work_dir, 'Dynamic')
+        if not os.path.isdir(self.sed_path):
+            os.makedirs(self.sed_path)
+        self.spec_file_map = SpecMap(fileDict={}, dirDict={'(^specFileGLSN)': 'Dynamic'})
+        self.magnorm_cache_dir = os.path.join(self.work_dir, 'magnorm_cache')
+        self._src_mag_norm = None
+
+    @property
+    def src_mag_norm(self):
+        """
+        magNorms of the OM10 sources, as computed by the sprinkler
+        """
+        if self._src_mag_norm is None:
+            bandpassDict = BandpassDict.loadTotalBandpassesFromFiles(bandpassNames=['i'])
+            agn_fname = os.path.join(getPackageDir('sims_sed_library'), 'agnSED', 'agn.spec.gz')
+            self._src_mag_norm = load_src_mag_norm(self.om10_cat, self.lenscat['MAGI_IN'],
+                                                   self.lenscat['ZSRC'], agn_fname,
+                                                   bandpassDict,
+                                                   cache_dir=self.magnorm_cache_dir)
+        return self._src_mag_norm
+
+    def galaxy_chunks(self, chunk_size=100000, **kwargs):
+        """
+        Return the SyntheticGalaxyChunks of this layout; kwargs are passed
+        to its constructor
+        """
+        return SyntheticGalaxyChunks(self.defs, self.lenscat, self.src_mag_norm,
+                                     self.sne_catalog, chunk_size=chunk_size,
+                                     seed=self.seed+2, **kwargs)
+
+    def write_cache_files(self, chunks, n_rows):
+        """
+        Write the cached sprinkling files of the hosts placed in the first
+        n_rows galaxies of chunks and return their names
+        """
+        agn_cache, sne_cache = chunks.cache_tables(n_rows)
+        agn_cache_file = os.path.join(self.work_dir, 'benchmark_agn_cache_%d.csv' % n_rows)
+        sne_cache_file = os.path.join(self.work_dir, 'benchmark_sne_cache_%d.csv' % n_rows)
+        agn_cache.to_csv(agn_cache_file, index=False)
+        sne_cache.to_csv(sne_cache_file, index=False)
+        return agn_cache_file, sne_cache_file
+
+    def sprinkler_kwargs(self, **kwargs):
+        """
+        Keyword arguments of the sprinkler constructor pointing at the
+        stand-in inputs, updated with kwargs
+        """
+        sprinkler_kwargs = {'om10_cat': self.om10_cat,
+                            'sne_cat': self.sne_cat,
+                            'defs_file': self.defs_file,
+                            'magnorm_cache_dir': self.magnorm_cache_dir}
+        sprinkler_kwargs.update(kwargs)
+        return sprinkler_kwargs
+
+    def make_sprinkler(self, catalog, **kwargs):
+        """
+        Return a new sprinkler for chunks like catalog; kwargs are passed
+        to its constructor
+        """
+        return sprinkler(catalog, _visit_mjd, self.spec_file_map, self.sed_path,
+                         **self.sprinkler_kwargs(**kwargs))
+
+
+def _result(scenario, params, times, rows=None):
+    """
+    Return the record of a scenario that ran repeat times, taking times
+    seconds
+    """
+    times = [float(t) for t in times]
+    result = {'scenario': scenario,
+              'params': params,
+              'times': times,
+              'min': min(times),
+              'median': float(np.median(times)),
+              'mean': float(np.mean(times)),
+              'peak_rss_bytes': _peak_rss_bytes(),
+              'error': None}
+    if rows is not None:
+        result['rows'] = int(rows)
+        result['rows_per_second'] = rows/result['min'] if result['min'] > 0 else None
+    return result
+
+
+def _error_result(scenario, params, error):
+    return {'scenario': scenario, 'params': params, 'times': [],
+            'peak_rss_bytes': _peak_rss_bytes(),
+            'error': '%s: %s' % (type(error).__name__, error)}
+
+
+def bench_sprinkler_init(inputs, repeat=3):
+    """
+    Time the construction of a sprinkler, with the OM10 magNorms computed
+    ('cold') and read from their on-disk cache ('warm').
+    """
+    catalog = inputs.galaxy_chunks(chunk_size=10).chunk(0, 10)
+    results = []
+    for cache in ('cold', 'warm'):
+        times = []
+        for _ in range(repeat):
+            cache_dir = inputs.magnorm_cache_dir
+            if cache == 'cold':
+                cache_dir = tempfile.mkdtemp(dir=inputs.work_dir)
+            t_start = default_timer()
+            inputs.make_sprinkler(catalog, magnorm_cache_dir=cache_dir)
+            times.append(default_timer() - t_start)
+            if cache == 'cold':
+                shutil.rmtree(cache_dir)
+        results.append(_result('sprinkler_init',
+                               {'layout': inputs.layout, 'magnorm_cache': cache},
+                               times))
+    return results
+
+
+def bench_sprinkle(inputs, n_rows, cached=False, batch_mode=True,
+                   chunk_size=100000, repeat=3, write_sn_sed=True):
+    """
+    Time sprinkler.sprinkle() over a catalog of n_rows galaxies read in
+    chunks of chunk_size rows.  The chunks are generated outside of the
+    timed region; the sprinkler is constructed once.
+    """
+    params = {'layout': inputs.layout, 'n_rows': int(n_rows),
+              'chunk_size': int(chunk_size), 'cached': cached,
+              'batch_mode': batch_mode, 'write_sn_sed': write_sn_sed}
+    chunks = inputs.galaxy_chunks(chunk_size=chunk_size)
+    kwargs = {'batch_mode': batch_mode, 'write_sn_sed': write_sn_sed,
+              'cached_sprinkling': cached}
+    if cached:
+        kwargs['agn_cache_file'], kwargs['sne_cache_file'] = \
+            inputs.write_cache_files(chunks, n_rows)
+    sp = inputs.make_sprinkler(chunks.chunk(0, n_rows), **kwargs)
+
+    times = []
+    rows_out = 0
+    for _ in range(repeat):
+        sp.used_systems = []
+        elapsed = 0.0
+        rows_out = 0
+        for chunk in chunks.chunks(n_rows):
+            t_start = default_timer()
+            output = sp.sprinkle(chunk, 'r')
+            elapsed += default_timer() - t_start
+            rows_out += len(output)
+            del output
+        times.append(elapsed)
+    result = _result('sprinkle', params, times, rows=n_rows)
+    result['rows_out'] = rows_out
+    result['max_buffer_bytes'] = sp.max_buffer_bytes
+    return result
+
+
+def bench_create_sn_sed(inputs, n_systems=20, repeat=3, write_sn_sed=True):
+    """
+    Time the creation of the SEDs of the images of n_systems lensed SNe
+    that are live at the benchmark visit, one image at a time with
+    sprinkler.create_sn_sed() and one system at a time with
+    sprinkler.create_sn_system_seds().
+    """
+    catalog = inputs.galaxy_chunks(chunk_size=10).chunk(0, 10)
+    sp = inputs.make_sprinkler(catalog, write_sn_sed=write_sn_sed)
+    sne = inputs.sne_catalog
+    live = sne['twinkles_sysno'][np.abs(sne['t_start'].values - _visit_mjd) < 20.0].unique()
+    systems = [sne[sne['twinkles_sysno'].values == sysno] for sysno in live[:n_systems]]
+    n_images = sum(len(system_df) for system_df in systems)
+    rng = np.random.RandomState(inputs.seed)
+    positions = [(np.radians(53.0 + rng.uniform(-0.5, 0.5, len(system_df))),
+                  np.radians(-27.4 + rng.uniform(-0.5, 0.5, len(system_df))))
+                 for system_df in systems]
+    params = {'layout': inputs.layout, 'n_systems': len(systems),
+              'n_images': n_images, 'write_sn_sed': write_sn_sed}
+
+    results = []
+    times = []
+    for _ in range(repeat):
+        t_start = default_timer()
+        for system_df, (sn_ra, sn_dec) in zip(systems, positions):
+            for i_img in range(len(system_df)):
+                sp.create_sn_sed(system_df.iloc[i_img], sn_ra[i_img], sn_dec[i_img],
+                                 _visit_mjd, write_sn_sed=write_sn_sed)
+        sp.sed_writer.flush()
+        times.append(default_timer() - t_start)
+    results.append(_result('create_sn_sed', params, times, rows=n_images))
+
+    times = []
+    for _ in range(repeat):
+        t_start = default_timer()
+        for system_df, (sn_ra, sn_dec) in zip(systems, positions):
+            sp.create_sn_system_seds(system_df, sn_ra, sn_dec, _visit_mjd,
+                                     write_sn_sed=write_sn_sed)
+        sp.sed_writer.flush()
+        times.append(default_timer() - t_start)
+    results.append(_result('create_sn_system_seds', params, times, rows=n_images))
+    return results
+
+
+def bench_final_pass(inputs, n_rows, chunk_size=100000, repeat=3, batch_mode=True):
+    """
+    Time GalaxyCacheSprinklerObj._final_pass(), i.e. the galtileid
+    conversion and sprinkling the chunk with the sprinkler held by
+    sprinkler_registry, over a catalog of n_rows galaxies.  The first
+    chunk is passed once before timing, so that the construction of the
+    sprinkler is not included.  Needs the 'catsim' layout, whose galaxies
+    are identified by galtileid.
+    """
+    params = {'layout': inputs.layout, 'n_rows': int(n_rows),
+              'chunk_size': int(chunk_size), 'batch_mode': batch_mode}
+    chunks = inputs.galaxy_chunks(chunk_size=chunk_size)
+
+    # the CatalogDBObject is not connected to a database: _final_pass
+    # only needs the sprinkler configuration
+    dbo = GalaxyCacheSprinklerObj.__new__(GalaxyCacheSprinklerObj)
+    dbo.mjd = _visit_mjd
+    dbo.catalog_band = 'r'
+    dbo.specFileMap = inputs.spec_file_map
+    dbo.sed_path = inputs.sed_path
+    dbo.defs_file = inputs.defs_file
+    dbo.om10_cat = inputs.om10_cat
+    dbo.sne_cat = inputs.sne_cat
+    dbo.batch_mode = batch_mode
+    dbo._final_pass(chunks.chunk(0, n_rows))
+
+    times = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        for chunk in chunks.chunks(n_rows):
+            t_start = default_timer()
+            dbo._final_pass(chunk)
+            elapsed += default_timer() - t_start
+        times.append(elapsed)
+    return _result('final_pass', params, times, rows=n_rows)
+
+
+def _metadata():
+    """
+    Return a dict describing the code and the machine the benchmarks ran on
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=package_dir,
+                                         stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'git_commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine()}
+
+
+def run_benchmarks(work_dir, scenarios=('sprinkler_init', 'sprinkle',
+                                        'create_sn_sed', 'final_pass'),
+                   n_rows=(10000, 100000, 1000000, 10000000),
+                   chunk_size=100000, repeat=3, batch_modes=(True,),
+                   write_sn_sed=True, seed=11, verbose=True):
+    """
+    Run the benchmark scenarios and return their results as
+    {'metadata': ..., 'results': [...]}.  A scenario that fails is
+    recorded with its error and the others still run.
+
+    Parameters
+    ----------
+    work_dir : str
+        directory of the synthetic inputs and of the SEDs written
+    scenarios : sequence of str
+        scenarios to run, among 'sprinkler_init', 'sprinkle',
+        'create_sn_sed' and 'final_pass'
+    n_rows : sequence of int
+        catalog sizes of the 'sprinkle' and 'final_pass' scenarios
+    chunk_size : int
+        number of rows passed to the sprinkler at once
+    repeat : int
+        number of times each scenario is timed
+    batch_modes : sequence of bool
+        sprinkler.batch_mode settings to time 'sprinkle' with
+    write_sn_sed : bool
+        whether the SN SEDs are written to disk
+    seed : int
+        seed of the synthetic inputs
+    """
+    inputs = {}
+
+    def get_inputs(layout):
+        if layout not in inputs:
+            inputs[layout] = BenchmarkInputs(work_dir, layout=layout, seed=seed)
+        return inputs[layout]
+
+    runs = []
+    if 'sprinkler_init' in scenarios:
+        runs.append(('sprinkler_init', {}, lambda: bench_sprinkler_init(get_inputs('dc2'), repeat=repeat)))
+    if 'sprinkle' in scenarios:
+        for rows in n_rows:
+            for cached in (False, True):
+                for batch_mode in batch_modes:
+                    params = {'n_rows': int(rows), 'cached': cached, 'batch_mode': batch_mode}
+                    runs.append(('sprinkle', params,
+                                 lambda rows=rows, cached=cached, batch_mode=batch_mode:
+                                 bench_sprinkle(get_inputs('dc2'), rows, cached=cached,
+                                                batch_mode=batch_mode, chunk_size=chunk_size,
+                                                repeat=repeat, write_sn_sed=write_sn_sed)))
+    if 'create_sn_sed' in scenarios:
+        runs.append(('create_sn_sed', {},
+                     lambda: bench_create_sn_sed(get_inputs('dc2'), repeat=repeat,
+                                                 write_sn_sed=write_sn_sed)))
+    if 'final_pass' in scenarios:
+        for rows in n_rows:
+            runs.append(('final_pass', {'n_rows': int(rows)},
+                         lambda rows=rows: bench_final_pass(get_inputs('catsim'), rows,
+                                                            chunk_size=chunk_size,
+                                                            repeat=repeat)))
+
+    results = []
+    for scenario, params, run in runs:
+        try:
+            result = run()
+        except Exception as error:
+            result = _error_result(scenario, params, error)
+        if isinstance(result, dict):
+            result = [result]
+        for record in result:
+            if verbose:
+                if record['error'] is None:
+                    print('%s %s: %.3f s' % (record['scenario'], record['params'], record['min']))
+                else:
+                    print('%s %s failed: %s' % (record['scenario'], record['params'], record['error']))
+            results.append(record)
+    sprinkler_registry.clear()
+    return {'metadata': _metadata(), 'results': results}
+
+
+def write_results(results, file_name):
+    """
+    Write the output of run_benchmarks() to the JSON file file_name
+    """
+    with open(file_name, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+def read_results(file_name):
+    """
+    Read benchmark results written by write_results()
+    """
+    with open(file_name, 'r') as input_file:
+        return json.load(input_file)
+
+
+def _result_key(record):
+    return (record['scenario'], json.dumps(record['params'], sort_keys=True))
+
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compare two sets of benchmark results on their fastest times.
+
+    Parameters
+    ----------
+    baseline, current : dict
+        outputs of run_benchmarks() (or read_results())
+    threshold : float
+        relative slowdown above which a scenario is flagged as a regression
+
+    Returns
+    -------
+    list of dicts with the scenario, params, baseline and current minimum
+    times, their ratio and whether it is a regression, for the scenarios
+    that ran without error in both
+    """
+    baseline_times = dict((_result_key(record), record['min'])
+                          for record in baseline['results'] if record['error'] is None)
+    comparison = []
+    for record in current['results']:
+        key = _result_key(record)
+        if record['error'] is not None or key not in baseline_times:
+            continue
+        ratio = record['min']/baseline_times[key] if baseline_times[key] > 0 else np.inf
+        comparison.append({'scenario': record['scenario'],
+                           'params': record['params'],
+                           'baseline': baseline_times[key],
+                           'current': record['min'],
+                           'ratio': ratio,
+                           'regression': ratio > 1.0 + threshold})
+    return comparison
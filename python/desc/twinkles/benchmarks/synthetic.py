@@ -0,0 +1,423 @@
+"""
+Synthetic inputs for the sprinkler benchmarks: galaxy chunks laid out as
+the catalogs described by the sprinkler defs files, and stand-ins for the
+OM10 lens catalog and the lensed SNe catalog.  Everything is generated
+from a seed, so that benchmark runs on different commits see the same
+inputs.
+"""
+from __future__ import absolute_import, division
+import numpy as np
+import pandas as pd
+
+__all__ = ['read_defs_file', 'write_defs_file', 'complete_defs',
+           'galaxy_chunk_dtype', 'make_om10_catalog', 'write_om10_catalog',
+           'make_sne_catalog', 'SyntheticGalaxyChunks']
+
+# SEDs of the sims_sed_library used for the stand-in lens galaxies
+_lens_seds = ('galaxySED/Exp.62E09.04Z.spec.gz',
+              'galaxySED/Exp.80E09.1Z.spec.gz',
+              'galaxySED/Exp.25E08.04Z.spec.gz',
+              'galaxySED/Burst.10E09.02Z.spec.gz',
+              'galaxySED/Burst.62E09.04Z.spec.gz')
+
+_disk_seds = ('galaxySED/Inst.32E07.002Z.spec.gz',
+              'galaxySED/Inst.25E07.002Z.spec.gz',
+              'galaxySED/Inst.19E07.002Z.spec.gz')
+
+# defs read by the sprinkler that catsim_defs.csv does not define, and the
+# CatSim compound catalog columns they stand for
+_catsim_missing_defs = (('raJ2000', 'galaxyAgn_raJ2000'),
+                        ('decJ2000', 'galaxyAgn_decJ2000'),
+                        ('galaxyBulge_internalRv', 'galaxyBulge_internalRv'))
+
+# keys of the defs files that name keys of the varParamStr JSON rather
+# than catalog columns
+_json_defs = ('pars', 'varMethodName')
+
+# the Twinkles field, in degrees
+_field_ra = 53.0
+_field_dec = -27.4
+
+
+def read_defs_file(defs_file):
+    """
+    Read a sprinkler defs file (see data/dc2_defs.csv) into a list of
+    (key, value) pairs, in the order of the file.  As in the sprinkler,
+    the value of a line with more than one column is a tuple.
+    """
+    defs = []
+    with open(defs_file, 'r') as input_file:
+        for line in input_file:
+            line_defs = line.strip().split(',')
+            if len(line_defs) == 2:
+                defs.append((line_defs[0], line_defs[1]))
+            elif len(line_defs) > 2:
+                defs.append((line_defs[0], tuple(line_defs[1:])))
+    return defs
+
+
+def write_defs_file(defs, defs_file):
+    """
+    Write the (key, value) pairs defs in the format of read_defs_file
+    """
+    with open(defs_file, 'w') as output_file:
+        for key, value in defs:
+            if isinstance(value, tuple):
+                value = ','.join(value)
+            output_file.write('%s,%s\n' % (key, value))
+
+
+def complete_defs(defs):
+    """
+    Return defs with the keys the sprinkler reads that the CatSim layout
+    (data/catsim_defs.csv) does not define, mapped to the columns of the
+    CatSim compound catalog.  Layouts that define them are returned as is.
+    """
+    keys = set(key for key, _ in defs)
+    if 'galaxyAgn_raJ2000' not in [value for _, value in defs]:
+        return list(defs)
+    return list(defs) + [(key, value) for key, value in _catsim_missing_defs
+                         if key not in keys]
+
+
+def _column_type(key, has_sn_truth_params):
+    if key.endswith('sedFilename'):
+        return (str, 40)
+    if key.endswith('varParamStr'):
+        return (str, 256)
+    if key.endswith('sn_truth_params'):
+        return (str, 400) if has_sn_truth_params else None
+    if key.endswith('is_sprinkled'):
+        return int
+    if key == 'galtileid':
+        return np.int64
+    return float
+
+
+def galaxy_chunk_dtype(defs, has_sn_truth_params=True):
+    """
+    Return the dtype of a catalog chunk with the columns named in defs
+    (as returned by read_defs_file), in the order they first appear.
+
+    Parameters
+    ----------
+    defs : list
+        (key, value) pairs of a defs file
+    has_sn_truth_params : bool
+        whether the chunk has the SN truth parameters column
+    """
+    columns = []
+    names = set()
+    for key, value in defs:
+        if key in _json_defs:
+            continue
+        column_type = _column_type(key, has_sn_truth_params)
+        if column_type is None:
+            continue
+        values = value if isinstance(value, tuple) else (value,)
+        for name in values:
+            if name not in names:
+                names.add(name)
+                if isinstance(column_type, tuple):
+                    columns.append((name,) + column_type)
+                else:
+                    columns.append((name, column_type))
+    return np.dtype(columns)
+
+
+def make_om10_catalog(n_lenses=1000, seed=11):
+    """
+    Return a structured array standing in for the OM10 catalog used by
+    Twinkles (data/twinkles_lenses_v2.fits), with the OM10 columns and the
+    lens galaxy columns added for Twinkles.
+
+    Parameters
+    ----------
+    n_lenses : int
+        number of lens systems
+    seed : int
+        seed of the random number generator
+    """
+    rng = np.random.RandomState(seed)
+    dtype = [('LENSID', np.int32), ('FLAGTYPE', np.int16), ('NIMG', np.int16),
+             ('ZLENS', float), ('VELDISP', float), ('ELLIP', float),
+             ('PHIE', float), ('GAMMA', float), ('PHIG', float),
+             ('ZSRC', float), ('XSRC', float), ('YSRC', float),
+             ('MAGI_IN', float), ('MAGI', float), ('IMSEP', float),
+             ('XIMG', float, 4), ('YIMG', float, 4), ('MAG', float, 4),
+             ('DELAY', float, 4), ('APMAG_I', float), ('REFF', float),
+             ('lens_sed', str, 40), ('sed_magNorm', float, 6),
+             ('lens_av', float), ('lens_rv', float), ('twinklesId', np.int32)]
+    lenscat = np.zeros(n_lenses, dtype=dtype)
+    lenscat['LENSID'] = np.arange(n_lenses) + 10000
+    lenscat['NIMG'] = rng.choice([2, 4], size=n_lenses, p=[0.8, 0.2])
+    lenscat['ZLENS'] = rng.uniform(0.1, 1.0, n_lenses)
+    lenscat['VELDISP'] = rng.uniform(150.0, 350.0, n_lenses)
+    lenscat['ELLIP'] = rng.uniform(0.0, 0.6, n_lenses)
+    lenscat['PHIE'] = rng.uniform(-90.0, 90.0, n_lenses)
+    lenscat['GAMMA'] = rng.uniform(0.0, 0.1, n_lenses)
+    lenscat['PHIG'] = rng.uniform(-90.0, 90.0, n_lenses)
+    lenscat['ZSRC'] = lenscat['ZLENS'] + rng.uniform(0.3, 3.0, n_lenses)
+    lenscat['XSRC'] = rng.normal(0.0, 0.3, n_lenses)
+    lenscat['YSRC'] = rng.normal(0.0, 0.3, n_lenses)
+    lenscat['MAGI_IN'] = rng.uniform(19.0, 24.0, n_lenses)
+    lenscat['IMSEP'] = rng.uniform(0.5, 4.0, n_lenses)
+
+    # unused image slots are zero, as in OM10
+    in_system = np.arange(4) < lenscat['NIMG'][:, None]
+    for name, scale in (('XIMG', 1.0), ('YIMG', 1.0), ('MAG', 3.0), ('DELAY', 30.0)):
+        lenscat[name] = np.where(in_system, rng.normal(0.0, scale, (n_lenses, 4)), 0.0)
+    lenscat['DELAY'][:, 0] = 0.0
+    lenscat['MAGI'] = lenscat['MAGI_IN'] - 2.5*np.log10(np.abs(lenscat['MAG']).sum(axis=1) + 1.0)
+    lenscat['APMAG_I'] = rng.uniform(17.0, 22.0, n_lenses)
+    lenscat['REFF'] = rng.uniform(0.3, 3.0, n_lenses)
+    lenscat['lens_sed'] = rng.choice(_lens_seds, size=n_lenses)
+    lenscat['sed_magNorm'] = lenscat['APMAG_I'][:, None] + rng.uniform(-1.0, 1.0, (n_lenses, 6))
+    lenscat['lens_av'] = rng.uniform(0.0, 0.5, n_lenses)
+    lenscat['lens_rv'] = rng.uniform(2.5, 4.0, n_lenses)
+    lenscat['twinklesId'] = rng.permutation(n_lenses)
+    return lenscat
+
+
+def write_om10_catalog(lenscat, file_name):
+    """
+    Write the OM10 stand-in lenscat to the fits file file_name, which
+    om10.DB can read in place of data/twinkles_lenses_v2.fits
+    """
+    from astropy.io import fits
+    fits.BinTableHDU(data=lenscat).writeto(file_name, overwrite=True)
+
+
+def make_sne_catalog(n_systems=1000, seed=12, t_min=59580.0, t_max=63232.0):
+    """
+    Return a `pandas.DataFrame` standing in for the lensed SNe catalog
+    (data/cosmoDC2_v1.1.4_sne_cat.csv), one row per image.
+
+    Parameters
+    ----------
+    n_systems : int
+        number of lensed SN systems
+    seed : int
+        seed of the random number generator
+    t_min, t_max : float
+        range of the MJDs of the explosions
+    """
+    rng = np.random.RandomState(seed)
+    n_img = rng.choice([2, 4], size=n_systems, p=[0.7, 0.3])
+    system = np.repeat(np.arange(n_systems), n_img)
+    n_rows = len(system)
+    offsets = np.cumsum(n_img) - n_img
+    imno = np.arange(n_rows) - np.repeat(offsets, n_img)
+
+    zs = rng.uniform(0.2, 1.2, n_systems)
+    zl = zs*rng.uniform(0.3, 0.7, n_systems)
+    t0 = rng.uniform(t_min, t_max, n_systems)
+    td = np.where(imno == 0, 0.0, rng.uniform(0.0, 40.0, n_rows))
+
+    sne = pd.DataFrame({'t0': np.zeros(n_rows),
+                        'e': rng.uniform(0.0, 0.6, n_systems)[system],
+                        'theta_e': rng.uniform(0.0, 180.0, n_systems)[system],
+                        'zs': zs[system],
+                        'zl': zl[system],
+                        'x0': rng.uniform(1.0e-6, 1.0e-4, n_systems)[system],
+                        'x1': rng.normal(0.0, 1.0, n_systems)[system],
+                        'c': rng.normal(0.0, 0.1, n_systems)[system],
+                        'lensgal_reff': rng.uniform(0.3, 3.0, n_systems)[system],
+                        'lensgal_sed': rng.choice(_lens_seds, size=n_systems)[system],
+                        'lens_av': rng.uniform(0.0, 0.5, n_systems)[system],
+                        'lens_rv': rng.uniform(2.5, 4.0, n_systems)[system],
+                        'twinkles_sysno': (np.arange(n_systems) + 1000)[system],
+                        'td': td,
+                        'x': rng.normal(0.0, 1.0, n_rows),
+                        'y': rng.normal(0.0, 1.0, n_rows),
+                        'mu': rng.normal(0.0, 3.0, n_rows),
+                        'imno': imno,
+                        't_start': t0[system] + td})
+    lens_mag = rng.uniform(17.0, 22.0, n_systems)
+    for band in 'ugrizy':
+        sne['lensgal_magnorm_%s' % band] = (lens_mag + rng.uniform(-1.0, 1.0, n_systems))[system]
+    return sne
+
+
+class SyntheticGalaxyChunks(object):
+    """
+    Generator of galaxy catalog chunks, laid out as the catalogs described
+    by a defs file, whose hosts can be sprinkled with a given OM10 and
+    SNe catalog.
+
+    The rows of chunk i only depend on the seed and i.  A fraction of the
+    galaxies have an AGN; a fraction of those are placed within the
+    redshift and magNorm windows of an OM10 source, and a fraction of the
+    galaxies without AGN within the redshift window of a SN system.  The
+    other galaxies cannot host a lens.  cache_tables() returns the hosts
+    placed in the chunks, in the format of the cached sprinkling files.
+
+    Parameters
+    ----------
+    defs : list
+        (key, value) pairs of the defs file, as returned by read_defs_file
+    lenscat : `numpy.ndarray`
+        the OM10 catalog
+    src_mag_norm : array_like
+        magNorms of the OM10 sources, as computed by the sprinkler
+    sne_catalog : `pandas.DataFrame`
+        the SNe catalog
+    chunk_size : int
+        number of rows in a chunk
+    agn_fraction : float
+        fraction of the galaxies with an AGN
+    lens_host_fraction : float
+        fraction of the AGN hosts placed on an OM10 source
+    sne_host_fraction : float
+        fraction of the galaxies without AGN placed on a SN system
+    has_sn_truth_params : bool
+        whether the chunks have the SN truth parameters column
+    seed : int
+        seed of the random number generators
+    """
+    def __init__(self, defs, lenscat, src_mag_norm, sne_catalog,
+                 chunk_size=100000, agn_fraction=0.1, lens_host_fraction=0.01,
+                 sne_host_fraction=0.001, has_sn_truth_params=True, seed=13):
+        self.defs = list(defs)
+        self.defs_dict = dict(self.defs)
+        self.dtype = galaxy_chunk_dtype(self.defs, has_sn_truth_params)
+        self.lenscat = lenscat
+        self.src_mag_norm = np.asarray(src_mag_norm, dtype=float)
+        self.sne_systems = sne_catalog.drop_duplicates('twinkles_sysno')
+        self.chunk_size = int(chunk_size)
+        self.agn_fraction = agn_fraction
+        self.lens_host_fraction = lens_host_fraction
+        self.sne_host_fraction = sne_host_fraction
+        self.seed = seed
+
+    def n_chunks(self, n_rows):
+        """
+        Number of chunks holding n_rows galaxies
+        """
+        return (int(n_rows) + self.chunk_size - 1)//self.chunk_size
+
+    def _chunk_rows(self, i_chunk, n_rows):
+        return min(self.chunk_size, int(n_rows) - i_chunk*self.chunk_size)
+
+    def _placements(self, i_chunk, n_rows):
+        """
+        Return the galtileids of chunk i_chunk, the random state to use for
+        the rest of the chunk and the rows placed on lens systems, as
+        (rows, indices in lenscat) for the AGN and (rows, indices in
+        sne_systems) for the SNe.
+        """
+        rng = np.random.RandomState([self.seed, i_chunk])
+        galtileid = i_chunk*self.chunk_size + np.arange(n_rows, dtype=np.int64) + 1
+        is_agn = rng.uniform(size=n_rows) < self.agn_fraction
+        placed = rng.uniform(size=n_rows)
+        agn_rows = np.where(is_agn & (placed < self.lens_host_fraction))[0]
+        sne_rows = np.where(~is_agn & (placed < self.sne_host_fraction))[0]
+        agn_lenses = rng.randint(0, len(self.lenscat), len(agn_rows))
+        sne_systems = rng.randint(0, len(self.sne_systems), len(sne_rows))
+        return galtileid, is_agn, rng, (agn_rows, agn_lenses), (sne_rows, sne_systems)
+
+    def chunk(self, i_chunk, n_rows):
+        """
+        Return chunk i_chunk of a catalog of n_rows galaxies
+        """
+        n_chunk = self._chunk_rows(i_chunk, n_rows)
+        galtileid, is_agn, rng, agn_placed, sne_placed = self._placements(i_chunk, n_chunk)
+        defs = self.defs_dict
+        chunk = np.zeros(n_chunk, dtype=self.dtype)
+
+        ra = np.radians(_field_ra + rng.uniform(-0.5, 0.5, n_chunk))
+        dec = np.radians(_field_dec + rng.uniform(-0.5, 0.5, n_chunk))
+        redshift = rng.uniform(0.05, 3.0, n_chunk)
+        agn_mag_norm = np.where(is_agn, rng.uniform(18.0, 26.0, n_chunk), np.nan)
+
+        # hosts that are not placed on a lens system are kept out of the
+        # redshift (for the SNe) and magNorm (for the AGN) windows
+        agn_rows, agn_lenses = agn_placed
+        sne_rows, sne_systems = sne_placed
+        if len(self.src_mag_norm) > 0:
+            agn_mag_norm = np.where(is_agn, agn_mag_norm + self.src_mag_norm.max() + 1.0 - 18.0,
+                                    np.nan)
+        if len(self.sne_systems) > 0:
+            z_sne_max = self.sne_systems['zs'].values.max()*10**0.2
+            redshift = np.where(is_agn, redshift, z_sne_max + redshift)
+        redshift[agn_rows] = self.lenscat['ZSRC'][agn_lenses]*10**rng.uniform(-0.05, 0.05, len(agn_rows))
+        agn_mag_norm[agn_rows] = self.src_mag_norm[agn_lenses] + rng.uniform(-0.1, 0.1, len(agn_rows))
+        redshift[sne_rows] = self.sne_systems['zs'].values[sne_systems]*10**rng.uniform(-0.05, 0.05, len(sne_rows))
+
+        def set_column(key, values):
+            if key not in defs:
+                return
+            names = defs[key] if isinstance(defs[key], tuple) else (defs[key],)
+            for name in names:
+                chunk[name] = values
+
+        set_column('galtileid', galtileid)
+        for component in ('galaxyBulge', 'galaxyDisk', 'galaxyAgn'):
+            set_column('%s_raJ2000' % component, ra)
+            set_column('%s_decJ2000' % component, dec)
+        set_column('raJ2000', ra)
+        set_column('decJ2000', dec)
+
+        for component, sizes in (('galaxyDisk', (0.5, 3.0)), ('galaxyBulge', (0.2, 1.5))):
+            major = np.radians(rng.uniform(sizes[0], sizes[1], n_chunk)/3600.0)
+            set_column('%s_majorAxis' % component, major)
+            set_column('%s_minorAxis' % component, major*rng.uniform(0.3, 1.0, n_chunk))
+            set_column('%s_positionAngle' % component, rng.uniform(0.0, np.pi, n_chunk))
+            set_column('%s_internalAv' % component, rng.uniform(0.0, 1.0, n_chunk))
+            set_column('%s_internalRv' % component, rng.uniform(2.5, 4.0, n_chunk))
+        set_column('galaxyDisk_magNorm', np.where(rng.uniform(size=n_chunk) < 0.8,
+                                                  rng.uniform(18.0, 28.0, n_chunk), np.nan))
+        set_column('galaxyBulge_magNorm', rng.uniform(18.0, 28.0, n_chunk))
+        set_column('galaxyDisk_sedFilename', rng.choice(_disk_seds, size=n_chunk))
+        set_column('galaxyBulge_sedFilename', rng.choice(_lens_seds, size=n_chunk))
+        set_column('galaxyAgn_sedFilename', np.where(is_agn, 'agnSED/agn.spec.gz', 'None'))
+        set_column('galaxyAgn_magNorm', agn_mag_norm)
+
+        var_str = np.char.mod('{"%s": "applyAgn", "%s": {"seed": %%d, ' %
+                              (defs.get('varMethodName', 'varMethodName'), defs.get('pars', 'pars')),
+                              rng.randint(0, 2**31 - 1, n_chunk))
+        tau = np.char.mod('"agn_tau": %.4f', 10**rng.uniform(1.0, 3.0, n_chunk))
+        sf = [np.char.mod(', "agn_sf%s": %%.4f' % band, rng.uniform(0.05, 0.5, n_chunk))
+              for band in 'ugrizy']
+        for part in [tau] + sf + ['}}']:
+            var_str = np.char.add(var_str, part)
+        set_column('galaxyAgn_varParamStr', np.where(is_agn, var_str, 'None'))
+
+        set_column('galaxyAgn_sn_t0', np.nan)
+        set_column('galaxyAgn_sn_truth_params', 'None')
+        set_column('galaxyAgn_is_sprinkled', 0)
+
+        # several redshift keys may name the same column
+        for component in ('galaxyBulge', 'galaxyDisk', 'galaxyAgn'):
+            set_column('%s_redshift' % component, redshift)
+        return chunk
+
+    def chunks(self, n_rows):
+        """
+        Iterate over the chunks of a catalog of n_rows galaxies
+        """
+        for i_chunk in range(self.n_chunks(n_rows)):
+            yield self.chunk(i_chunk, n_rows)
+
+    def cache_tables(self, n_rows):
+        """
+        Return the AGN and SN hosts placed in a catalog of n_rows galaxies
+        as two `pandas.DataFrame` with the galtileid and twinkles_system
+        columns of the cached sprinkling files.
+        """
+        agn_ids = []
+        agn_systems = []
+        sne_ids = []
+        sne_systems = []
+        for i_chunk in range(self.n_chunks(n_rows)):
+            galtileid, _, _, agn_placed, sne_placed = \
+                self._placements(i_chunk, self._chunk_rows(i_chunk, n_rows))
+            agn_ids.append(galtileid[agn_placed[0]])
+            agn_systems.append(self.lenscat['twinklesId'][agn_placed[1]])
+            sne_ids.append(galtileid[sne_placed[0]])
+            sne_systems.append(self.sne_systems['twinkles_sysno'].values[sne_placed[1]])
+        agn_cache = pd.DataFrame({'galtileid': np.concatenate(agn_ids),
+                                  'twinkles_system': np.concatenate(agn_systems)})
+        sne_cache = pd.DataFrame({'galtileid': np.concatenate(sne_ids),
+                                  'twinkles_system': np.concatenate(sne_systems)})
+        return agn_cache, sne_cache
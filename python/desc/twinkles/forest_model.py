@@ -0,0 +1,136 @@
+"""
+Pickle-free storage and NumPy evaluation of the random forest that
+predicts the phosim CPU times.
+
+run1_cpu_generate_rf.py fits a scikit-learn RandomForestRegressor.
+ForestModel.from_forest() flattens its trees into the node arrays of all
+the trees concatenated (split feature, threshold, children and leaf value),
+which ForestModel.write() stores in an .npz file.  Reading them back needs
+neither pickle nor scikit-learn, and ForestModel.predict() walks all the
+rows down each tree at once, one tree level per step.  The features are
+compared in single precision, as scikit-learn does, and the trees are
+averaged in the same order, so the predictions match those of the forest.
+"""
+from __future__ import absolute_import, division
+import json
+import numpy as np
+
+__all__ = ['ForestModel']
+
+# bump this if the layout of the .npz files changes
+_forest_version = 1
+
+
+class ForestModel(object):
+    """
+    Regression forest stored as flat node arrays.
+
+    Parameters
+    ----------
+    feature : `numpy.ndarray`
+        feature split on at each node (0 at the leaves)
+    threshold : `numpy.ndarray`
+        threshold of each split: rows with feature <= threshold go left
+    children_left, children_right : `numpy.ndarray`
+        index of the children of each node; the leaves are their own
+        children
+    value : `numpy.ndarray`
+        prediction of each node
+    roots : `numpy.ndarray`
+        index of the root node of each tree
+    n_features : int
+        number of features the forest was fit to
+    """
+    def __init__(self, feature, threshold, children_left, children_right,
+                 value, roots, n_features):
+        self.feature = np.asarray(feature, dtype=np.int64)
+        self.threshold = np.asarray(threshold, dtype=float)
+        self.children_left = np.asarray(children_left, dtype=np.int64)
+        self.children_right = np.asarray(children_right, dtype=np.int64)
+        self.value = np.asarray(value, dtype=float)
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.n_features = int(n_features)
+        self.is_leaf = self.children_left == np.arange(len(self.children_left))
+
+    @classmethod
+    def from_forest(cls, forest):
+        """
+        Flatten a fitted single-output scikit-learn forest (e.g. a
+        RandomForestRegressor)
+        """
+        arrays = dict(feature=[], threshold=[], children_left=[],
+                      children_right=[], value=[])
+        roots = []
+        n_nodes = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count) + n_nodes
+            leaf = tree.children_left < 0
+            arrays['feature'].append(np.where(leaf, 0, tree.feature))
+            arrays['threshold'].append(np.where(leaf, 0., tree.threshold))
+            arrays['children_left'].append(np.where(leaf, nodes, tree.children_left + n_nodes))
+            arrays['children_right'].append(np.where(leaf, nodes, tree.children_right + n_nodes))
+            arrays['value'].append(np.asarray(tree.value).reshape(tree.node_count, -1)[:, 0])
+            roots.append(n_nodes)
+            n_nodes += tree.node_count
+        # older scikit-learn versions call it n_features_
+        n_features = getattr(forest, 'n_features_in_', None)
+        if n_features is None:
+            n_features = forest.n_features_
+        return cls(roots=roots, n_features=n_features,
+                   **dict((name, np.concatenate(arrays[name])) for name in arrays))
+
+    def write(self, file_name):
+        """
+        Write the forest to the .npz file file_name
+        """
+        meta = {'version': _forest_version, 'n_features': self.n_features}
+        with open(file_name, 'wb') as output_file:
+            np.savez(output_file, meta=np.array(json.dumps(meta)),
+                     feature=self.feature, threshold=self.threshold,
+                     children_left=self.children_left,
+                     children_right=self.children_right,
+                     value=self.value, roots=self.roots)
+
+    @classmethod
+    def read(cls, file_name):
+        """
+        Read a forest written by ForestModel.write()
+        """
+        with np.load(file_name, allow_pickle=False) as forest_file:
+            meta = json.loads(str(forest_file['meta']))
+            if meta['version'] != _forest_version:
+                raise RuntimeError('%s is a version %d forest; expected version %d'
+                                   % (file_name, meta['version'], _forest_version))
+            return cls(forest_file['feature'], forest_file['threshold'],
+                       forest_file['children_left'], forest_file['children_right'],
+                       forest_file['value'], forest_file['roots'],
+                       meta['n_features'])
+
+    def predict(self, X):
+        """
+        Return the `numpy.ndarray` of the predictions of the forest for the
+        rows of the (row, feature) array X
+        """
+        # the trees split single precision features
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError('expected an array of shape (n, %d); got %s'
+                             % (self.n_features, X.shape))
+        features = np.ascontiguousarray(X.T)
+        total = np.zeros(len(X))
+        for root in self.roots:
+            # walk the rows that have not reached a leaf one level down
+            node = np.full(len(X), root, dtype=np.int64)
+            rows = np.arange(len(X))
+            if self.is_leaf[root]:
+                rows = rows[:0]
+            while len(rows) > 0:
+                at = node[rows]
+                go_left = features[self.feature[at], rows] <= self.threshold[at]
+                child = np.where(go_left, self.children_left[at], self.children_right[at])
+                node[rows] = child
+                rows = rows[~self.is_leaf[child]]
+            # the trees are added in order, as scikit-learn does
+            total += self.value[node]
+        return total/len(self.roots)
@@ -0,0 +1,377 @@
+"""
+Index structures used by the sprinkler to find which lens systems can be
+placed in a given host galaxy.
+"""
+from __future__ import absolute_import, division
+import numpy as np
+
+__all__ = ['LensCandidateIndex', 'SortedKeyIndex', 'SNSystemAssigner',
+           'SNReservationTable']
+
+
+class LensCandidateIndex(object):
+    """
+    Two dimensional index of the OM10 lensed sources on log10(ZSRC) and
+    source magNorm.
+
+    The lenses are binned in log10(ZSRC) with bins as wide as the redshift
+    window and sorted by magNorm inside each bin, so that the candidates
+    for a host are found in a few contiguous slices of the index.
+    Every slice is padded by a small tolerance and then cut with exactly
+    the same comparisons as a brute force scan of the catalog, so the
+    candidate sets are identical to
+
+        np.where((np.abs(np.log10(zsrc) - np.log10(galz)) <= dex_window) &
+                 (np.abs(mag_norm - gal_mag) <= mag_window))[0]
+
+    Parameters
+    ----------
+    zsrc : array_like
+        redshifts of the lensed sources
+    mag_norm : array_like
+        magNorms of the lensed sources
+    twinkles_id : array_like
+        twinklesId of the lens systems; candidates are returned in the
+        order of np.argsort(twinkles_id) applied to the brute force result
+    dex_window : float, defaults to 0.1
+        half width of the redshift window in dex
+    mag_window : float, defaults to 0.25
+        half width of the magNorm window
+    """
+    # padding applied to the windows before the exact cut, to absorb the
+    # rounding of the composite sort key
+    _tol = 1.0e-6
+
+    def __init__(self, zsrc, mag_norm, twinkles_id, dex_window=0.1,
+                 mag_window=0.25):
+        self.dex_window = dex_window
+        self.mag_window = mag_window
+        self.twinkles_id = np.asarray(twinkles_id)
+        self._unique_ids = len(np.unique(self.twinkles_id)) == len(self.twinkles_id)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_z = np.log10(np.asarray(zsrc, dtype=float))
+        mag = np.ravel(np.asarray(mag_norm, dtype=float))
+        self._log_z_all = log_z
+        self._mag_all = mag
+
+        # lenses with undefined redshift or magNorm can never be candidates
+        usable = np.where(np.isfinite(log_z) & np.isfinite(mag))[0]
+        if len(usable) == 0:
+            self._order = usable
+            self._n_bins = 0
+            return
+
+        self._log_z_min = log_z[usable].min()
+        self._mag_min = mag[usable].min()
+        # width of the magNorm axis of the composite key; any value larger
+        # than the spread of the magNorms keeps the key ordered by (bin, mag)
+        self._mag_span = mag[usable].max() - self._mag_min + 1.0
+
+        z_bin = self._z_bin(log_z[usable])
+        sort = np.lexsort((mag[usable], z_bin))
+        self._order = usable[sort]
+        self._n_bins = z_bin.max() + 1
+        self._key = z_bin[sort]*self._mag_span + (mag[self._order] - self._mag_min)
+
+    def __len__(self):
+        return len(self._log_z_all)
+
+    def _z_bin(self, log_z):
+        return np.floor((log_z - self._log_z_min)/self.dex_window).astype(int)
+
+    def query(self, galz, gal_mag):
+        """
+        Find the lens candidates of many hosts at once.
+
+        Parameters
+        ----------
+        galz : array_like
+            redshifts of the hosts
+        gal_mag : array_like
+            AGN magNorms of the hosts
+
+        Returns
+        -------
+        offsets : `numpy.ndarray`
+            the candidates of host i are candidates[offsets[i]:offsets[i+1]]
+        candidates : `numpy.ndarray`
+            indices into the lens catalog
+        """
+        galz = np.atleast_1d(np.asarray(galz, dtype=float))
+        gal_mag = np.atleast_1d(np.asarray(gal_mag, dtype=float))
+        n_host = len(galz)
+        if n_host == 0 or self._n_bins == 0:
+            return np.zeros(n_host+1, dtype=int), np.array([], dtype=int)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_galz = np.log10(galz)
+        usable = np.isfinite(log_galz) & np.isfinite(gal_mag)
+        log_galz = np.where(usable, log_galz, 0.0)
+        gal_mag = np.where(usable, gal_mag, 0.0)
+
+        pad_z = self.dex_window + self._tol
+        pad_mag = self.mag_window + self._tol
+        bin_lo = np.clip(self._z_bin(log_galz - pad_z), 0, None)
+        bin_hi = np.clip(self._z_bin(log_galz + pad_z), None, self._n_bins-1)
+        # keep the magNorm limits inside the key range of a single bin
+        mag_lo = np.clip(gal_mag - pad_mag - self._mag_min, 0.0, self._mag_span-0.5)
+        mag_hi = np.clip(gal_mag + pad_mag - self._mag_min, 0.0, self._mag_span-0.5)
+
+        # the padded redshift window only spans a few bins
+        hosts = [np.array([], dtype=int)]
+        positions = [np.array([], dtype=int)]
+        n_offsets = max(0, (bin_hi - bin_lo)[usable].max()+1) if usable.any() else 0
+        for offset in range(n_offsets):
+            z_bin = bin_lo + offset
+            active = usable & (z_bin <= bin_hi)
+            lo = np.searchsorted(self._key, z_bin*self._mag_span + mag_lo, side='left')
+            hi = np.searchsorted(self._key, z_bin*self._mag_span + mag_hi, side='right')
+            n_found = np.where(active, np.clip(hi - lo, 0, None), 0)
+            hosts.append(np.repeat(np.arange(n_host), n_found))
+            positions.append(np.arange(n_found.sum()) +
+                             np.repeat(lo - (np.cumsum(n_found) - n_found), n_found))
+        hosts = np.concatenate(hosts)
+        lenses = self._order[np.concatenate(positions)]
+
+        # the exact cut of the brute force search
+        keep = ((np.abs(self._log_z_all[lenses] - log_galz[hosts]) <= self.dex_window) &
+                (np.abs(self._mag_all[lenses] - gal_mag[hosts]) <= self.mag_window))
+        hosts = hosts[keep]
+        lenses = lenses[keep]
+
+        if self._unique_ids:
+            sort = np.lexsort((self.twinkles_id[lenses], hosts))
+            hosts = hosts[sort]
+            lenses = lenses[sort]
+        else:
+            # reproduce np.argsort on each catalog-ordered candidate set
+            sort = np.lexsort((lenses, hosts))
+            hosts = hosts[sort]
+            lenses = lenses[sort]
+            bounds = np.searchsorted(hosts, np.arange(n_host+1))
+            for i_host in np.where(np.diff(bounds) > 1)[0]:
+                sub = lenses[bounds[i_host]:bounds[i_host+1]]
+                lenses[bounds[i_host]:bounds[i_host+1]] = sub[np.argsort(self.twinkles_id[sub])]
+
+        offsets = np.searchsorted(hosts, np.arange(n_host+1))
+        return offsets, lenses
+
+    def candidates(self, galz, gal_mag):
+        """
+        Return the indices of the lens candidates of a single host, sorted
+        by twinklesId.
+        """
+        offsets, lenses = self.query([galz], [gal_mag])
+        return lenses[offsets[0]:offsets[1]]
+
+
+class SortedKeyIndex(object):
+    """
+    Index from integer keys (galtileid, twinklesId, twinkles_sysno, ...) to
+    the rows of a table holding them, built on a stable argsort so that
+    many keys can be joined at once with np.searchsorted.
+
+    Parameters
+    ----------
+    keys : array_like
+        the key of every row of the table
+    """
+    def __init__(self, keys):
+        keys = np.asarray(keys)
+        self.rows = np.argsort(keys, kind='mergesort')
+        self._keys = keys[self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def unique_keys(self):
+        """
+        The distinct keys of the table, sorted
+        """
+        return np.unique(self._keys)
+
+    def bounds(self, keys):
+        """
+        Return (start, end) such that the rows holding keys[i] are
+        self.rows[start[i]:end[i]], in table order.  Missing keys have
+        start == end.
+        """
+        keys = np.asarray(keys)
+        return (np.searchsorted(self._keys, keys, side='left'),
+                np.searchsorted(self._keys, keys, side='right'))
+
+    def first(self, keys):
+        """
+        Return the index of the first row holding each of keys, or -1 for
+        keys that are not in the table.
+        """
+        start, end = self.bounds(keys)
+        found = start < end
+        if len(self.rows) == 0:
+            return np.full(len(start), -1, dtype=int)
+        return np.where(found, self.rows[np.where(found, start, 0)], -1)
+
+    def all_rows(self, key):
+        """
+        Return the indices of the rows holding a single key, in table order
+        """
+        start, end = self.bounds([key])
+        return self.rows[start[0]:end[0]]
+
+
+class SNSystemAssigner(object):
+    """
+    Assigns the lensed SN systems of the SNe catalog to host galaxies.
+
+    The catalog is reduced to a table of its distinct (log10(zs), system)
+    pairs sorted on redshift, so the systems within the redshift window of
+    a host are found with two binary searches, and the systems that have
+    already been placed are tracked in a boolean mask over the systems.
+    A host gets the same system as with
+
+        rng = np.random.RandomState(galtileid % (2**32 - 1))
+        rng.choice(np.unique(sysno[np.abs(np.log10(zs) - np.log10(galz)) <= dex_window])
+                   minus the used systems)
+
+    Parameters
+    ----------
+    zs : array_like
+        source redshift of every row of the SNe catalog
+    sysno : array_like
+        twinkles_sysno of every row of the SNe catalog
+    dex_window : float, defaults to 0.1
+        half width of the redshift window in dex
+    """
+    # padding applied to the binary searches before the exact cut
+    _tol = 1.0e-6
+
+    def __init__(self, zs, sysno, dex_window=0.1):
+        self.dex_window = dex_window
+        sysno = np.asarray(sysno)
+        self.systems = np.unique(sysno)
+        sys_dex = np.searchsorted(self.systems, sysno)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_z = np.log10(np.asarray(zs, dtype=float))
+
+        # rows with undefined redshifts can never be in a window
+        usable = np.isfinite(log_z)
+        log_z = log_z[usable]
+        sys_dex = sys_dex[usable]
+        sort = np.lexsort((sys_dex, log_z))
+        log_z = log_z[sort]
+        sys_dex = sys_dex[sort]
+        distinct = np.ones(len(log_z), dtype=bool)
+        distinct[1:] = (np.diff(log_z) != 0) | (np.diff(sys_dex) != 0)
+        self._log_z = log_z[distinct]
+        self._sys_dex = sys_dex[distinct]
+        self._used = np.zeros(len(self.systems), dtype=bool)
+
+    def __len__(self):
+        return len(self.systems)
+
+    @property
+    def used(self):
+        """
+        The systems that have been marked as used, sorted
+        """
+        return self.systems[self._used]
+
+    def mark_used(self, systems):
+        """
+        Record systems as used so that they are no longer candidates.
+        Systems that are not in the catalog are ignored.
+        """
+        systems = np.atleast_1d(np.asarray(systems))
+        if len(systems) == 0 or len(self.systems) == 0:
+            return
+        sys_dex = np.clip(np.searchsorted(self.systems, systems), 0, len(self.systems)-1)
+        self._used[sys_dex[self.systems[sys_dex] == systems]] = True
+
+    def reset(self):
+        """
+        Mark all the systems as unused
+        """
+        self._used[:] = False
+
+    def candidates(self, galz):
+        """
+        Return the unused systems within the redshift window of a host at
+        redshift galz, sorted
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_galz = np.log10(galz)
+        if not np.isfinite(log_galz):
+            return self.systems[:0]
+        lo = np.searchsorted(self._log_z, log_galz - self.dex_window - self._tol, side='left')
+        hi = np.searchsorted(self._log_z, log_galz + self.dex_window + self._tol, side='right')
+        in_window = np.abs(self._log_z[lo:hi] - log_galz) <= self.dex_window
+        sys_dex = np.unique(self._sys_dex[lo:hi][in_window])
+        return self.systems[sys_dex[~self._used[sys_dex]]]
+
+    def choose(self, galtileid, galz):
+        """
+        Return the system to place in the host galtileid at redshift galz,
+        or None if no unused system is within its redshift window.
+        """
+        unused_sysno = self.candidates(galz)
+        if len(unused_sysno) == 0:
+            return None
+        rng = np.random.RandomState(galtileid % (2**32 -1))
+        return rng.choice(unused_sysno)
+
+
+class SNReservationTable(object):
+    """
+    The lensed SN systems reserved for host galaxies, keyed by galtileid.
+
+    Sharded sprinkling assigns the SN systems of all the shards at once,
+    in the order a serial run would, and hands each shard the part of the
+    table covering its hosts; sprinkling a shard then takes the systems
+    from the table instead of assigning them.
+
+    Parameters
+    ----------
+    galtileids : array_like
+        the hosts, which must be distinct
+    systems : array_like
+        twinkles_sysno reserved for each host
+    """
+    def __init__(self, galtileids, systems):
+        self.galtileids = np.asarray(galtileids, dtype=np.int64)
+        self.systems = np.asarray(systems, dtype=np.int64)
+        if len(self.galtileids) != len(self.systems):
+            raise ValueError('galtileids and systems must have the same length')
+        self._index = SortedKeyIndex(self.galtileids)
+        if len(self._index.unique_keys) != len(self.galtileids):
+            raise ValueError('a host can only reserve one SN system')
+
+    def __len__(self):
+        return len(self.galtileids)
+
+    def lookup(self, galtileids):
+        """
+        Return the systems reserved for galtileids and a mask of the
+        galtileids that have a reservation
+        """
+        rows = self._index.first(galtileids)
+        reserved = rows >= 0
+        return self.systems[rows[reserved]], reserved
+
+    def subset(self, galtileids):
+        """
+        Return the table restricted to the hosts among galtileids
+        """
+        systems, reserved = self.lookup(galtileids)
+        return SNReservationTable(np.asarray(galtileids)[reserved], systems)
+
+    @staticmethod
+    def concatenate(tables):
+        """
+        Merge the reservations of tables, which must not share hosts
+        """
+        if len(tables) == 0:
+            return SNReservationTable([], [])
+        return SNReservationTable(np.concatenate([table.galtileids for table in tables]),
+                                  np.concatenate([table.systems for table in tables]))
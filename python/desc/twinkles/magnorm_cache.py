@@ -0,0 +1,145 @@
+"""
+Persistent cache of the magNorms of the OM10 lensed AGN, which the sprinkler
+needs to match lensed sources to CatSim AGN.
+"""
+from __future__ import absolute_import, division
+import os
+import hashlib
+import tempfile
+import numpy as np
+from lsst.sims.catUtils.matchSED import matchBase
+from lsst.sims.photUtils import Sed
+
+__all__ = ['twinkles_cache_dir', 'src_mag_norm_cache_key',
+           'compute_src_mag_norm', 'load_src_mag_norm']
+
+# bump this if the way the magNorms are computed changes
+_cache_version = 1
+
+
+def twinkles_cache_dir():
+    """
+    Directory in which Twinkles keeps its on-disk caches: $TWINKLES_CACHE_DIR
+    if it is set, ~/.twinkles_cache otherwise.
+    """
+    return os.environ.get('TWINKLES_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.twinkles_cache'))
+
+
+def _hash_file(hasher, file_name):
+    with open(file_name, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1 << 20), b''):
+            hasher.update(block)
+
+
+def src_mag_norm_cache_key(lens_cat_file, sed_file, bandpassDict):
+    """
+    Return the hash identifying a set of source magNorms.
+
+    Parameters
+    ----------
+    lens_cat_file : str
+        the OM10 fits file
+    sed_file : str
+        the AGN SED file
+    bandpassDict : `lsst.sims.photUtils.BandpassDict`
+        the bandpasses in which the OM10 magnitudes are given
+
+    Returns
+    -------
+    str : hexadecimal sha1 digest of the contents of the inputs
+    """
+    hasher = hashlib.sha1()
+    hasher.update(('src_mag_norm v%d' % _cache_version).encode('ascii'))
+    _hash_file(hasher, lens_cat_file)
+    _hash_file(hasher, sed_file)
+    for name in bandpassDict:
+        hasher.update(str(name).encode('ascii'))
+        hasher.update(np.ascontiguousarray(bandpassDict[name].wavelen, dtype=float).tobytes())
+        hasher.update(np.ascontiguousarray(bandpassDict[name].sb, dtype=float).tobytes())
+    return hasher.hexdigest()
+
+
+def compute_src_mag_norm(src_mags, src_z, sed_file, bandpassDict):
+    """
+    Compute the magNorms of sources with the SED in sed_file, given their
+    magnitudes in the (single) band of bandpassDict and their redshifts.
+
+    The SED is read once.  For a single band the magNorm fit is a constant
+    offset from the observed magnitude that only depends on redshift, so
+    the offset is computed once per distinct redshift and applied to all
+    the sources as an array operation.  The OM10 source redshifts are
+    continuous, though, so this still calls matchBase.calcMagNorm about
+    once per lens: the loop is only worth avoiding through the cache of
+    load_src_mag_norm.
+
+    Returns
+    -------
+    `numpy.ndarray` of magNorms
+    """
+    src_mags = np.asarray(src_mags, dtype=float)
+    src_z = np.asarray(src_z, dtype=float)
+    base_sed = Sed()
+    base_sed.readSED_flambda(sed_file)
+
+    unique_z, z_dex = np.unique(src_z, return_inverse=True)
+    offsets = np.zeros(len(unique_z), dtype=float)
+    matcher = matchBase()
+    for i_z, redshift in enumerate(unique_z):
+        agn_sed = Sed(wavelen=base_sed.wavelen, flambda=base_sed.flambda)
+        agn_sed.redshiftSED(redshift, dimming=True)
+        offsets[i_z] = matcher.calcMagNorm([0.0], agn_sed, bandpassDict)
+
+    return src_mags + offsets[z_dex]
+
+
+def load_src_mag_norm(lens_cat_file, src_mags, src_z, sed_file, bandpassDict,
+                      cache_dir=None):
+    """
+    Return the magNorms of the OM10 sources, from the on-disk cache if it
+    holds them and computing (and caching) them otherwise.
+
+    Parameters
+    ----------
+    lens_cat_file : str
+        the OM10 fits file src_mags and src_z were read from
+    src_mags : array_like
+        magnitudes of the sources in the band of bandpassDict
+    src_z : array_like
+        redshifts of the sources
+    sed_file : str
+        the SED of the sources
+    bandpassDict : `lsst.sims.photUtils.BandpassDict`
+        the bandpass of src_mags
+    cache_dir : str, optional
+        directory of the cache; defaults to twinkles_cache_dir()
+
+    Returns
+    -------
+    `numpy.ndarray` of magNorms
+    """
+    if cache_dir is None:
+        cache_dir = twinkles_cache_dir()
+    key = src_mag_norm_cache_key(lens_cat_file, sed_file, bandpassDict)
+    cache_file = os.path.join(cache_dir, 'om10_src_mag_norm_%s.npy' % key)
+
+    if os.path.exists(cache_file):
+        mag_norm = np.load(cache_file)
+        if len(mag_norm) == len(src_mags):
+            return mag_norm
+
+    mag_norm = compute_src_mag_norm(src_mags, src_z, sed_file, bandpassDict)
+
+    # write to a temporary file and rename it, so that concurrent jobs never
+    # read a partially written cache
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as output_file:
+            np.save(output_file, mag_norm)
+        os.rename(tmp_name, cache_file)
+    except (IOError, OSError):
+        pass
+
+    return mag_norm
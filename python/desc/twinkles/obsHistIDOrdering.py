@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function
 import os
+import functools
 import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
@@ -9,6 +10,30 @@ from .phosim_cpu_pred import CpuPred
 
 __all__ = ['OpSimOrdering']
 
+
+def _memoizedSubset(method):
+    """
+    Decorator computing a subset of `OpSimOrdering` once, see
+    `OpSimOrdering._subset`, and returning a copy of it
+    """
+    @functools.wraps(method)
+    def subset(self):
+        return _copySubset(self._subset(method.__name__, method))
+    subset.computeSubset = method
+    return subset
+
+
+def _copySubset(subset):
+    """
+    Copy of a subset: a dataFrame, a tuple of dataFrames or None
+    """
+    if subset is None:
+        return None
+    if isinstance(subset, tuple):
+        return tuple(df.copy() for df in subset)
+    return subset.copy()
+
+
 class OpSimOrdering(object):
     """
     Code to split the Twinkles 3 obsHistIDs into sets that will be ordered so
@@ -37,6 +62,14 @@ class OpSimOrdering(object):
     cpuPred : instance of `sklearn.ensemble.forest.RandomForestRegressor`
         obtained from a pickle file if `self.ignorePredictedTimes` is False
     minimizeBy : parameter `minimizeBy`
+
+    The derived subsets (`uniqueOpSimRecords`, `filteredOpSim`, the run
+    subsets `Twinkles_*` and `obsHistIDsPredictedToTakeTooLong`) are each
+    computed once and shared by the subsets that depend on them; the
+    properties return copies of the cached dataFrames, which can be
+    modified freely.  They are recomputed if `timeMax`, `minimizeBy`,
+    `ignorePredictedTimes`, `distinctGroup` or the OpSim dataFrame change;
+    call `invalidateSubsets` after modifying the OpSim dataFrame in place.
     """
     def __init__(self, opSimDBPath,
                  randomForestPickle=None,
@@ -50,7 +83,10 @@ class OpSimOrdering(object):
             absolute path to a sqlite OpSim database
         randomForestPickle : string, defaults to None
             absolute path to a pickle of an instance of
-            `sklearn.ensemble.forest.RandomForestRegressor`
+            `sklearn.ensemble.forest.RandomForestRegressor`, or to the .npz
+            file of the same forest written by run1_cpu_generate_rf.py.
+            Defaults to data/RF_forest.npz if it exists, data/RF_pickle.p
+            otherwise
         timeMax: float, defaults to 120.0
             max value of predicted PhoSim Run times of selected OpSim records.
             Records with predicted PhoSIm run times beyond this value are
@@ -66,13 +102,19 @@ class OpSimOrdering(object):
         """
         twinklesDir = getPackageDir('Twinkles')
 
+        self._subsets = {}
+        self._subsetState = None
+
         self.ignorePredictedTimes = ignorePredictedTimes
         self._opsimDF = self.fullOpSimDF(opSimDBPath)
         self._opsimDF['year'] = self._opsimDF.night // 365
 
         if randomForestPickle is None:
             randomForestPickle = os.path.join(twinklesDir, 'data',
-                                              'RF_pickle.p')
+                                              'RF_forest.npz')
+            if not os.path.exists(randomForestPickle):
+                randomForestPickle = os.path.join(twinklesDir, 'data',
+                                                  'RF_pickle.p')
 
         if minimizeBy not in self._opsimDF.columns and minimizeBy != 'predictedPhoSimTimes':
                 raise NotImplementedError('minimizing by {} not implemented, try `expMJD`', minimizeBy)
@@ -109,15 +151,62 @@ class OpSimOrdering(object):
         if obsHistIDs is None:
             obsHistIDs = self._opsimDF.reset_index()['obsHistID'].values
 
-        obsHistIds = np.ravel(obsHistIDs)
-        times = np.ones_like(obsHistIds) * np.nan 
-        for i, obshistid in enumerate(obsHistIds):
-            times[i] = self.cpuPred(obshistid)
+        # a single evaluation of the forest for all the obsHistIDs
+        times = self.cpuPred.predict_many(obsHistIDs)
 
         # convert to hours from seconds before return
         return times / 3600.0
 
+    def _subsetStateKey(self):
+        df = self._opsimDF
+        return (df, df.shape, tuple(df.columns), self.timeMax,
+                self.minimizeBy, self.ignorePredictedTimes,
+                tuple(self.distinctGroup))
+
+    def _subset(self, name, method):
+        """
+        Return the subset name computed by method, computing it if it is
+        not cached for the current state of the instance
+        """
+        state = self._subsetStateKey()
+        cached = self._subsetState
+        if cached is None or cached[0] is not state[0] or cached[1:] != state[1:]:
+            self._subsets = {}
+            self._subsetState = state
+        if name not in self._subsets:
+            self._subsets[name] = method(self)
+        return self._subsets[name]
+
+    def _shared(self, name):
+        """
+        Return the cached subset name itself rather than a copy, for the
+        subsets computed from it, which must not modify it
+        """
+        return self._subset(name, getattr(type(self), name).fget.computeSubset)
+
+    def invalidateSubsets(self):
+        """
+        Forget the cached subsets, e.g. after modifying the OpSim dataFrame
+        in place
+        """
+        self._subsets = {}
+        self._subsetState = None
+
+    def materialize_all(self):
+        """
+        Compute all the run subsets, each subset once, and return them as
+        a dict keyed by name: `Twinkles_WFD`, `Twinkles_3p1`, `Twinkles_3p1b`,
+        `Twinkles_3p2`, `Twinkles_3p3` and, if some visits are predicted to
+        take too long, `Twinkles_3p4`
+        """
+        names = ['Twinkles_WFD', 'Twinkles_3p1', 'Twinkles_3p1b',
+                 'Twinkles_3p2', 'Twinkles_3p3']
+        if self._shared('obsHistIDsPredictedToTakeTooLong') is not None:
+            names.append('Twinkles_3p4')
+        return dict((name, getattr(self, name)) for name in names)
+
     @property
+    @_memoizedSubset
     def uniqueOpSimRecords(self):
         """
         - drop duplicates in favor of propID for WFD
@@ -129,6 +218,7 @@ class OpSimOrdering(object):
         return pts
 
     @property
+    @_memoizedSubset
     def filteredOpSim(self):
         """
         dataframe dropping records from the unique set `self.uniqueOpSimRecords`
@@ -138,18 +228,19 @@ class OpSimOrdering(object):
         """
         thresh = self.timeMax
         if self.ignorePredictedTimes:
-            return self.uniqueOpSimRecords
+            return self._shared('uniqueOpSimRecords')
         else:
-            return self.uniqueOpSimRecords.query('predictedPhoSimTimes < @thresh')
+            return self._shared('uniqueOpSimRecords').query('predictedPhoSimTimes < @thresh')
 
     @property
     def opSimCols(self):
         """
         columns in `filteredOpSim`
         """
-        return self.filteredOpSim.columns
+        return self._shared('filteredOpSim').columns
 
     @property
+    @_memoizedSubset
     def obsHistIDsPredictedToTakeTooLong(self):
         """
         obsHistIDs dropped from Twink_3p1, Twink_3p2, Twink_3p3 because the
@@ -162,69 +253,75 @@ class OpSimOrdering(object):
         if self.ignorePredictedTimes:
             return None
         filteredObsHistID = \
-            tuple(self.filteredOpSim.reset_index().obsHistID.values.tolist())
+            tuple(self._shared('filteredOpSim').reset_index().obsHistID.values.tolist())
 
-        missing = self.uniqueOpSimRecords.query('obsHistID not in @filteredObsHistID')
+        missing = self._shared('uniqueOpSimRecords').query('obsHistID not in @filteredObsHistID')
         if len(missing) > 0:
             return missing[['obsHistID', 'expMJD', 'predictedPhoSimTimes', 'filter', 'propID']]
         else:
             return None
 
     @property
+    @_memoizedSubset
     def Twinkles_WFD(self):
         """
         return a dataframe with all the visits for each unique combination with
         the lowest propID (all WFD visits or all DDF visits) in each unique
         combination
         """
-        groupDistinct = self.filteredOpSim.groupby(self.distinctGroup)
+        filteredOpSim = self._shared('filteredOpSim')
+        groupDistinct = filteredOpSim.groupby(self.distinctGroup)
         gdf = groupDistinct[self.opSimCols].agg(dict(propID=min))
         idx = gdf.propID.obsHistID.values 
-        df = self.filteredOpSim.set_index('obsHistID').ix[idx].sort_values(by='expMJD')
+        df = filteredOpSim.set_index('obsHistID').ix[idx].sort_values(by='expMJD')
         return df.reset_index()
     
     @property
+    @_memoizedSubset
     def Twinkles_3p1(self):
         """
         for visits selected in Twinkles_WFD, pick the visit in each unique
         combination with the lowest value of the `predictedPhoSimTimes`
         """
-        groupDistinct = self.Twinkles_WFD.groupby(self.distinctGroup)
+        groupDistinct = self._shared('Twinkles_WFD').groupby(self.distinctGroup)
 
         # The variable we are minimizing by
         discVar = self.minimizeBy
         gdf = groupDistinct[self.opSimCols].agg(dict(discVar=min))
         idx = gdf.discVar.obsHistID.values 
-        df = self.filteredOpSim.set_index('obsHistID').ix[idx]
+        df = self._shared('filteredOpSim').set_index('obsHistID').ix[idx]
         return df.sort_values(by='expMJD', inplace=False).reset_index()
 
     @property
+    @_memoizedSubset
     def Twinkles_3p1b(self):
         """
         dataframe containing those WFD visits that are part of `Twinkles_WFD` and not
         covered in `self.Twinkles_3p1` (for example on nights when there are
         multiple WFD visits in the same filter)
         """
-        doneObsHist = tuple(self.Twinkles_3p1.obsHistID.values.tolist())
+        doneObsHist = tuple(self._shared('Twinkles_3p1').obsHistID.values.tolist())
         query = 'obsHistID not in @doneObsHist and propID == 54'
-        df = self.filteredOpSim.query(query).sort_values(by='expMJD',
+        df = self._shared('filteredOpSim').query(query).sort_values(by='expMJD',
                                                          inplace=False)
         return df
                 
     @property
+    @_memoizedSubset
     def Twinkles_3p2(self):
         """
         dr5 Observations that are in `filteredOpSim` and have not been done in
         Twinkles_3p1
         """
-        obs_1 = self.Twinkles_3p1.obsHistID.values.tolist()
-        obs_1b = self.Twinkles_3p1b.obsHistID.values.tolist()
+        obs_1 = self._shared('Twinkles_3p1').obsHistID.values.tolist()
+        obs_1b = self._shared('Twinkles_3p1b').obsHistID.values.tolist()
         doneObsHist = tuple(obs_1 + obs_1b)
         query = 'year == 4 and obsHistID not in @doneObsHist'
-        return self.filteredOpSim.query(query).sort_values(by='expMJD',
+        return self._shared('filteredOpSim').query(query).sort_values(by='expMJD',
                                                            inplace=False)
 
     @property
+    @_memoizedSubset
     def Twinkles_3p3(self):
         """
         dataFrame of visit obsHistID for Run 3p3. These are DDF visits
@@ -233,21 +330,22 @@ class OpSimOrdering(object):
         Run 3.1 or the visits in a particular year covered as part of
         3.2 
         """
-        obs_1 = self.Twinkles_3p1.obsHistID.values.tolist()
-        obs_1b = self.Twinkles_3p1b.obsHistID.values.tolist()
-        obs_2 = self.Twinkles_3p2.obsHistID.values.tolist()
+        obs_1 = self._shared('Twinkles_3p1').obsHistID.values.tolist()
+        obs_1b = self._shared('Twinkles_3p1b').obsHistID.values.tolist()
+        obs_2 = self._shared('Twinkles_3p2').obsHistID.values.tolist()
         obs = tuple(obs_1 + obs_1b + obs_1b + obs_2)
         query = 'obsHistID not in @obs'
-        return self.filteredOpSim.query(query).sort_values(by='expMJD',
+        return self._shared('filteredOpSim').query(query).sort_values(by='expMJD',
                                                            inplace=False)
     @property
+    @_memoizedSubset
     def Twinkles_3p4(self):
         """
         tuple of dataFrames for wfd and ddf visits for visits left out
         of Run 3p1,2,3 due to high predicted phosim times, orderded by
         predicted phosim run times.
         """
-        leftovers = self.obsHistIDsPredictedToTakeTooLong
+        leftovers = self._shared('obsHistIDsPredictedToTakeTooLong')
         wfdvisits = leftovers.query('propID == 54')
         wfdvisits.sort_values(by='expMJD', inplace=True)
         ddfvisits = leftovers.query('propID == 56')
@@ -17,6 +17,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import pylab
 from .sqlite_tools import SqliteDataFrameFactory
+from .forest_model import ForestModel
 
 __all__ = ['CpuPred']
 
@@ -29,13 +30,29 @@ class CpuPred(object):
     SLAC Linux.  Also by default it looks only for obsHistID values that are
     in the Twinkles Run 1 field (by selecting on the corresponding fieldID).
 
-    RF_pickle.p is written by run1_cpu_generate_rf.py
+    RF_pickle.p is written by run1_cpu_generate_rf.py, together with
+    RF_forest.npz, the same forest as flat arrays (see
+    desc.twinkles.ForestModel).  rf_pickle_file may name either; the .npz
+    file loads without pickle or scikit-learn.
+
+    predict_many() predicts the CPU times of a sequence of obsHistIDs with
+    a single evaluation of the forest.
+
+    A forest fit by fit_cpu_forest() with use_n_objects also predicts from
+    the number of objects in the instance catalog of each visit (see
+    uses_n_objects); predict_many() and cputime_many() then need those
+    counts.
     """
     def __init__(self, rf_pickle_file='RF_pickle.p',
         opsim_db_file='/nfs/farm/g/lsst/u1/DESC/Twinkles/kraken_1042_sqlite.db',
             opsim_df = None,
             fieldID=1427):
-        self.RFbest = pickle.load(open(rf_pickle_file, 'rb'))
+        if rf_pickle_file.endswith('.npz'):
+            self.RFbest = ForestModel.read(rf_pickle_file)
+        else:
+            self.RFbest = pickle.load(open(rf_pickle_file, 'rb'))
+        self.fieldID = fieldID
+        self._conditions_by_id = None
         if opsim_df is None:
             factory = SqliteDataFrameFactory(opsim_db_file)
             self.obs_conditions = factory.create('obsHistID filter moonAlt moonPhase'.split(), 'Summary',
@@ -66,14 +83,80 @@ class CpuPred(object):
             moonalt = math.degrees(rec['moonAlt'].values[0])
             moonphase = rec['moonPhase'].values[0]
         else:
-            raise RuntimeError('%d is not a Run 1 obsHistID in field %d'%obsid,fieldID)
+            raise RuntimeError('%d is not a Run 1 obsHistID in field %d'%(obsid,self.fieldID))
+
+        return filter_index, moonalt, moonphase
 
+    def conditions_many(self, obsids):
+        """
+        Return the arrays of filter indices, moon altitudes (deg) and moon
+        phases for a sequence of obsHistIDs, as conditions() does for one:
+        an obsHistID with several records takes the first one.
+        """
+        if self._conditions_by_id is None:
+            # index the first record of each obsHistID once
+            unique = self.obs_conditions.drop_duplicates(subset='obsHistID', keep='first')
+            self._conditions_by_id = unique.set_index('obsHistID')
+        obsids = np.ravel(obsids)
+        rows = self._conditions_by_id.index.get_indexer(obsids)
+        if (rows < 0).any():
+            raise RuntimeError('%d is not a Run 1 obsHistID in field %d'
+                               %(obsids[rows < 0][0],self.fieldID))
+        rec = self._conditions_by_id.iloc[rows]
+
+        # Translate the filter strings into indices 0-5
+        filter_index = np.array(['ugrizy'.find(band) for band in rec['filter'].values],
+                                dtype=int)
+        moonalt = np.degrees(rec['moonAlt'].values.astype(float))
+        moonphase = rec['moonPhase'].values.astype(float)
         return filter_index, moonalt, moonphase
 
+    @property
+    def uses_n_objects(self):
+        """
+        True if the forest also predicts from the number of objects in
+        the instance catalogs
+        """
+        n_features = getattr(self.RFbest, 'n_features', None)
+        if n_features is None:
+            # a scikit-learn forest read from a pickle
+            n_features = getattr(self.RFbest, 'n_features_in_',
+                                 getattr(self.RFbest, 'n_features_', 3))
+        return n_features == 4
+
+    def predict_many(self, obsids, n_objects=None):
+        """
+        Return the `numpy.ndarray` of the predicted CPU times in seconds of
+        a sequence of obsHistIDs, identical to calling the instance on
+        each of them.  n_objects holds the number of objects in the
+        instance catalog of each visit, for a forest that uses them.
+        """
+        filter_index, moonalt, moonphase = self.conditions_many(obsids)
+        if len(filter_index) == 0:
+            return np.zeros(0)
+        return self.cputime_many(filter_index, moonalt, moonphase,
+                                 n_objects=n_objects)
+
     def cputime(self, filter_index, moonalt, moonphase):
         return 10.**self.RFbest.predict(np.array([[filter_index, moonalt,
             moonphase]]))
 
+    def cputime_many(self, filter_index, moonalt, moonphase, n_objects=None):
+        """
+        Return the predicted CPU times for arrays of filter indices, moon
+        altitudes and moon phases, and of numbers of objects in the
+        instance catalogs for a forest that uses them
+        """
+        features = [filter_index, moonalt, moonphase]
+        if self.uses_n_objects:
+            if n_objects is None:
+                raise ValueError('the forest predicts from the number of objects '
+                                 'in the instance catalogs; n_objects is needed')
+            features.append(np.broadcast_to(n_objects, np.shape(filter_index)))
+        elif n_objects is not None:
+            raise ValueError('the forest does not predict from the number of objects')
+        return 10.**self.RFbest.predict(np.column_stack(features).astype(float))
+
 if __name__ == '__main__':
     # Here are some dumb examples
     pred = CpuPred()
@@ -94,10 +177,7 @@ if __name__ == '__main__':
     moonphase = np.array(run1meta['moonphase'])
     actual = np.array(run1meta['cputime_fell'])
 
-    predicted = np.zeros(filter.size,dtype=float)
-
-    for i in range(filter.size):
-        predicted[i] = pred.cputime(filter[i],moonalt[i],moonphase[i])
+    predicted = pred.cputime_many(filter,moonalt,moonphase)
 
     plt.scatter(np.log10(actual), np.log10(predicted))
     plt.plot([4,6.5],[4,6.5])
@@ -0,0 +1,238 @@
+"""
+Measured phoSim run times, and the retraining of the CPU time predictor
+on them.
+
+runPhoSim.py appends one JSON record per phoSim segment (a run up to the
+next checkpoint) to phosim_runtimes.txt in the permanent work directory of
+the sensor, TW_WORK/<stream>/<sensor>/work, the tree scanned by
+helpers/status.py.  Each record holds the obsHistID, sensor, checkpoint,
+start time (unix seconds), wall-clock and CPU time (seconds), host, return
+code and number of objects in the instance catalog.
+
+harvest_phosim_runtimes() collects the records of a task, visit_runtimes()
+adds up the segments of each visit, runtime_training_set() joins the
+visits with the OpSim conditions that CpuPred predicts from and with its
+predictions, prediction_error_history() reports how far off the
+predictions were over time and fit_cpu_forest() fits a new forest, in the
+way run1_cpu_generate_rf.py does, that CpuPred can read.  On request, the
+forest also predicts from the number of objects in the instance catalogs
+of the visits, the source density; CpuPred then needs those counts.
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from .forest_model import ForestModel
+
+__all__ = ['runtime_record_file', 'cpu_features', 'density_feature',
+           'read_runtime_records', 'harvest_phosim_runtimes', 'visit_runtimes',
+           'runtime_training_set', 'prediction_error_history', 'fit_cpu_forest']
+
+# name of the run time records in each sensor work directory
+runtime_record_file = 'phosim_runtimes.txt'
+
+# the features of the CpuPred forest, named as in run1_metadata_v6.csv
+cpu_features = ('filter', 'moonalt', 'moonphase')
+
+# the feature fit_cpu_forest() adds with use_n_objects
+density_feature = 'n_objects'
+
+_segment_columns = ['stream', 'sensor', 'obsHistID', 'checkpoint', 'start',
+                    'wall_time', 'cpu_time', 'host', 'rc', 'n_objects']
+
+
+def read_runtime_records(file_name):
+    """
+    Return the list of the records (dicts) in a run time record file.  A
+    last line cut short by a job killed while writing it is skipped.
+    """
+    records = []
+    with open(file_name) as input_file:
+        for line in input_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def _host_class(host):
+    "The batch host class of a host name, e.g. fell for fell0123.slac.stanford.edu"
+    return re.sub(r'\d+$', '', host.split('.')[0])
+
+
+def harvest_phosim_runtimes(work_root, host_scale=None):
+    """
+    Collect the phoSim run time records of a task.
+
+    Parameters
+    ----------
+    work_root : str
+        the phoSim work area of the task (TW_WORK), holding one directory
+        per stream with one directory per sensor
+    host_scale : dict, optional
+        factor converting the CPU time on each host class (host name
+        without its number and domain) to the equivalent time on a fell
+        host, as the cputime_fell column of the Run 1 metadata is.  Hosts
+        of other classes are not scaled.
+
+    Returns
+    -------
+    `pandas.DataFrame` with one row per phoSim segment and the columns
+    stream, sensor, obsHistID, checkpoint, start, wall_time, cpu_time
+    (scaled), host, rc and n_objects
+    """
+    if host_scale is None:
+        host_scale = {}
+    records = []
+    for stream in sorted(os.listdir(work_root)):
+        stream_dir = os.path.join(work_root, stream)
+        if not stream.isdigit() or not os.path.isdir(stream_dir):
+            continue
+        for sensor in sorted(os.listdir(stream_dir)):
+            record_file = os.path.join(stream_dir, sensor, 'work', runtime_record_file)
+            if sensor == 'archives' or not os.path.isfile(record_file):
+                continue
+            for record in read_runtime_records(record_file):
+                record['stream'] = int(stream)
+                record['sensor'] = sensor
+                records.append(record)
+    segments = pd.DataFrame(records, columns=_segment_columns)
+    scale = [host_scale.get(_host_class(host), 1.) for host in segments['host']]
+    segments['cpu_time'] = segments['cpu_time'].astype(float)*np.array(scale, dtype=float)
+    return segments
+
+
+def visit_runtimes(segments):
+    """
+    Add up the phoSim segments of each visit.
+
+    Parameters
+    ----------
+    segments : `pandas.DataFrame`
+        the segments returned by harvest_phosim_runtimes()
+
+    Returns
+    -------
+    `pandas.DataFrame` with one row per obsHistID and the columns
+    obsHistID, cpu_time and wall_time (seconds, summed over the sensors
+    and segments), n_segments, n_sensors, n_failed (segments with a
+    non-zero return code), n_objects (the most objects in a catalog of
+    the visit) and end (unix time at which the last segment ended)
+    """
+    segments = segments.assign(end=segments['start'] + segments['wall_time'],
+                               failed=segments['rc'] != 0)
+    grouped = segments.groupby('obsHistID', sort=True)
+    visits = pd.DataFrame({'cpu_time': grouped['cpu_time'].sum(),
+                           'wall_time': grouped['wall_time'].sum(),
+                           'n_segments': grouped.size(),
+                           'n_sensors': grouped['sensor'].nunique(),
+                           'n_failed': grouped['failed'].sum().astype(int),
+                           'n_objects': grouped['n_objects'].max(),
+                           'end': grouped['end'].max()})
+    return visits.reset_index()
+
+
+def runtime_training_set(visits, cpu_pred):
+    """
+    Join the completed visits with the conditions CpuPred predicts from.
+
+    Parameters
+    ----------
+    visits : `pandas.DataFrame`
+        the visits returned by visit_runtimes()
+    cpu_pred : `CpuPred`
+        predictor whose OpSim records hold the conditions of the visits
+
+    Returns
+    -------
+    `pandas.DataFrame` of the visits without failed segments and with a
+    known obsHistID, with the columns filter (index 0-5), moonalt (deg),
+    moonphase and cputime_fell (seconds), as in run1_metadata_v6.csv,
+    followed by predicted (the CpuPred prediction in seconds, from the
+    n_objects of the visits if its forest uses them), n_objects, wall_time
+    and end
+    """
+    visits = visits[(visits['n_failed'] == 0) & (visits['obsHistID'] >= 0)]
+    filter_index, moonalt, moonphase = cpu_pred.conditions_many(visits['obsHistID'].values)
+    training_set = pd.DataFrame({'obsHistID': visits['obsHistID'].values,
+                                 'filter': filter_index, 'moonalt': moonalt,
+                                 'moonphase': moonphase,
+                                 'cputime_fell': visits['cpu_time'].values})
+    kwargs = {}
+    if getattr(cpu_pred, 'uses_n_objects', False):
+        kwargs['n_objects'] = visits[density_feature].values
+    training_set['predicted'] = (cpu_pred.cputime_many(filter_index, moonalt, moonphase,
+                                                       **kwargs)
+                                 if len(training_set) > 0 else np.zeros(0))
+    for column in ('n_objects', 'wall_time', 'end'):
+        training_set[column] = visits[column].values
+    return training_set
+
+
+def prediction_error_history(training_set, period='1D'):
+    """
+    Summarize the errors of the predicted CPU times over time.
+
+    Parameters
+    ----------
+    training_set : `pandas.DataFrame`
+        the visits returned by runtime_training_set()
+    period : str, optional
+        pandas frequency of the periods, by the end time of the visits
+
+    Returns
+    -------
+    `pandas.DataFrame` indexed by the start of each period with the
+    number of visits, the bias and rms of log10(predicted/actual CPU time)
+    and the fraction of visits predicted within a factor of 2
+    """
+    log_ratio = np.log10(training_set['predicted'].values/training_set['cputime_fell'].values)
+    errors = pd.DataFrame({'log_ratio': log_ratio,
+                           'within_2': np.abs(log_ratio) <= np.log10(2.)})
+    errors['period'] = pd.to_datetime(training_set['end'].values, unit='s').floor(period)
+    grouped = errors.groupby('period')
+    return pd.DataFrame({'visits': grouped.size(),
+                         'bias': grouped['log_ratio'].mean(),
+                         'rms': np.sqrt((errors['log_ratio']**2).groupby(errors['period']).mean()),
+                         'within_2': grouped['within_2'].mean()})
+
+
+def fit_cpu_forest(training_set, n_estimators=64, random_state=999,
+                   use_n_objects=False):
+    """
+    Fit a random forest to the log10 of the CPU times of a training set,
+    with the CpuPred features, as run1_cpu_generate_rf.py does.
+
+    Parameters
+    ----------
+    training_set : `pandas.DataFrame`
+        visits with the columns filter, moonalt, moonphase and
+        cputime_fell, e.g. the Run 1 metadata and the visits of
+        runtime_training_set() concatenated
+    n_estimators : int, optional
+        number of trees
+    random_state : int, optional
+        seed of the forest
+    use_n_objects : bool, optional
+        also fit to the n_objects column, the number of objects in the
+        instance catalogs of the visits, which the Run 1 metadata do not
+        have; CpuPred then predicts only for given object counts
+
+    Returns
+    -------
+    `ForestModel`, to be written to the .npz file read by CpuPred
+    """
+    from sklearn.ensemble import RandomForestRegressor
+    features = list(cpu_features)
+    if use_n_objects:
+        if training_set[density_feature].isnull().any():
+            raise ValueError('the number of objects of %d visits is unknown'
+                             % training_set[density_feature].isnull().sum())
+        features.append(density_feature)
+    X = training_set[features].values.astype(float)
+    y = np.log10(training_set['cputime_fell'].values.astype(float))
+    forest = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state)
+    return ForestModel.from_forest(forest.fit(X, y))
@@ -0,0 +1,131 @@
+"""
+In-memory cache of parsed SED files, so that code looping over catalog rows
+reads each file of the sims_sed_library once.
+"""
+from __future__ import absolute_import, division
+import threading
+from collections import OrderedDict
+import numpy as np
+from lsst.sims.photUtils import Sed
+
+__all__ = ['SedCache', 'sed_cache']
+
+
+class SedCache(object):
+    """
+    Least recently used cache of SEDs keyed by file name and redshift.
+
+    The cached wavelen and flambda arrays are read-only, so that they can
+    be shared by every caller; get_sed() wraps copies of them in a new
+    Sed for callers that go on to normalize, redden or redshift it.
+
+    Parameters
+    ----------
+    max_bytes : int, optional, defaults to 256 MB
+        bound on the memory held by the cached arrays; the least recently
+        used SEDs are dropped to stay below it
+
+    Attributes
+    ----------
+    hits : int
+        number of requests served from the cache
+    misses : int
+        number of requests that had to read or redshift an SED
+    evictions : int
+        number of SEDs dropped to honor max_bytes
+    """
+    def __init__(self, max_bytes=256*1024*1024):
+        self.max_bytes = max_bytes
+        self._seds = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._seds)
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the cached arrays
+        """
+        return self._nbytes
+
+    @staticmethod
+    def key(file_name, redshift=None, dimming=False):
+        if redshift is None:
+            return (str(file_name), None, False)
+        return (str(file_name), float(redshift), bool(dimming))
+
+    def get(self, file_name, redshift=None, dimming=False):
+        """
+        Return the wavelen and flambda arrays of the SED in file_name,
+        redshifted as Sed.redshiftSED(redshift, dimming=dimming) if
+        redshift is not None.  The arrays must not be modified.
+        """
+        key = self.key(file_name, redshift, dimming)
+        with self._lock:
+            if key in self._seds:
+                # re-insert to mark as most recently used
+                arrays = self._seds.pop(key)
+                self._seds[key] = arrays
+                self.hits += 1
+                return arrays
+
+        if redshift is None:
+            sed = Sed()
+            sed.readSED_flambda(str(file_name))
+        else:
+            wavelen, flambda = self.get(file_name)
+            sed = Sed(wavelen=np.copy(wavelen), flambda=np.copy(flambda))
+            sed.redshiftSED(redshift, dimming=dimming)
+
+        arrays = (np.array(sed.wavelen, dtype=float), np.array(sed.flambda, dtype=float))
+        for array in arrays:
+            array.flags.writeable = False
+        self._insert(key, arrays)
+        return arrays
+
+    def get_sed(self, file_name, redshift=None, dimming=False):
+        """
+        Return a new Sed holding copies of the cached arrays of
+        get(file_name, redshift, dimming), which the caller is free to
+        modify.
+        """
+        wavelen, flambda = self.get(file_name, redshift=redshift, dimming=dimming)
+        return Sed(wavelen=np.copy(wavelen), flambda=np.copy(flambda))
+
+    def _insert(self, key, arrays):
+        nbytes = sum(array.nbytes for array in arrays)
+        with self._lock:
+            self.misses += 1
+            if key in self._seds or nbytes > self.max_bytes:
+                return
+            self._seds[key] = arrays
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, dropped = self._seds.popitem(last=False)
+                self._nbytes -= sum(array.nbytes for array in dropped)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drop all the cached SEDs
+        """
+        with self._lock:
+            self._seds.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """
+        Return a dict summarizing the use of the cache
+        """
+        return {'seds': len(self._seds), 'nbytes': self._nbytes,
+                'max_bytes': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+# the cache shared by the modules of desc.twinkles
+sed_cache = SedCache()
@@ -0,0 +1,181 @@
+"""
+Sprinkling of a galaxy catalog split into shards, in parallel worker
+processes.
+
+The AGN lenses only depend on the host, but the lensed SNe go through the
+sprinkler's record of the SN systems already placed, which a serial run
+updates from one chunk to the next.  Sharded sprinkling therefore runs in
+three steps:
+
+1. propose: the hosts eligible for a lensed SN are collected from every
+   shard, in shard order and row order;
+2. resolve: the parent process assigns the SN systems to the proposed
+   hosts in that order, exactly as sprinkling the shards one after the
+   other would, and records the assignments in a `SNReservationTable`;
+3. the shards are sprinkled in worker processes, taking their SN systems
+   from their part of the table.
+
+The outputs are identical to sprinkling the shards in order with a single
+sprinkler, and the sprinkler is left with the same record of used systems.
+"""
+from __future__ import absolute_import, division
+import multiprocessing
+import numpy as np
+from .sn_sed_writer import SNSedWriter
+
+__all__ = ['shard_by_galtileid', 'shard_by_sky_tile', 'ShardedSprinkler']
+
+
+def shard_by_galtileid(galtileids, n_shards):
+    """
+    Split catalog rows into n_shards ranges of galtileid holding about the
+    same number of rows.
+
+    Parameters
+    ----------
+    galtileids : array_like
+        galtileid of every row
+    n_shards : int
+        number of shards
+
+    Returns
+    -------
+    list of `numpy.ndarray` holding the indices of the rows of each shard,
+    in row order; the shards are in increasing galtileid order
+    """
+    galtileids = np.asarray(galtileids)
+    n_shards = max(1, min(int(n_shards), len(galtileids)))
+    if len(galtileids) == 0:
+        return [np.array([], dtype=int)]
+    sorted_ids = np.sort(galtileids, kind='mergesort')
+    cuts = sorted_ids[(np.arange(1, n_shards)*len(galtileids))//n_shards]
+    shard = np.searchsorted(cuts, galtileids, side='right')
+    return [np.where(shard == i_shard)[0] for i_shard in range(n_shards)
+            if (shard == i_shard).any()]
+
+
+def shard_by_sky_tile(ra, dec, tile_size):
+    """
+    Split catalog rows into sky tiles about tile_size degrees on a side:
+    bands of declination divided into equal ranges of RA.
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        position of every row in radians
+    tile_size : float
+        size of the tiles in degrees
+
+    Returns
+    -------
+    list of `numpy.ndarray` holding the indices of the rows of each
+    non-empty tile, in row order; the tiles are sorted by declination band
+    and then RA
+    """
+    ra = np.degrees(np.asarray(ra, dtype=float)) % 360.0
+    dec = np.degrees(np.asarray(dec, dtype=float))
+    n_bands = int(np.ceil(180.0/tile_size))
+    band = np.clip(np.floor((dec + 90.0)/tile_size).astype(int), 0, n_bands-1)
+    band_dec = np.radians(-90.0 + (band + 0.5)*tile_size)
+    n_cells = np.maximum(1, np.floor(360.0*np.cos(band_dec)/tile_size)).astype(int)
+    cell = np.minimum(np.floor(ra*n_cells/360.0).astype(int), n_cells-1)
+    tile = band.astype(np.int64)*(int(n_cells.max()) if len(n_cells) > 0 else 1) + cell
+    tiles, tile_dex = np.unique(tile, return_inverse=True)
+    order = np.argsort(tile_dex, kind='mergesort')
+    bounds = np.searchsorted(tile_dex[order], np.arange(len(tiles)+1))
+    return [order[bounds[i_tile]:bounds[i_tile+1]] for i_tile in range(len(tiles))]
+
+
+# the sprinkler of a worker process, set by _init_worker
+_worker_sprinkler = None
+
+
+def _init_worker(sp):
+    global _worker_sprinkler
+    # the SN SEDs are written by the worker itself
+    sp.sed_writer = SNSedWriter()
+    _worker_sprinkler = sp
+
+
+def _sprinkle_shard(args):
+    shard, catalog_band, reservation = args
+    return _sprinkle_reserved(_worker_sprinkler, shard, catalog_band, reservation)
+
+
+def _sprinkle_reserved(sp, shard, catalog_band, reservation):
+    sp.sne_reservation = reservation
+    try:
+        return sp.sprinkle(shard, catalog_band)
+    finally:
+        sp.sne_reservation = None
+
+
+def _fork_context():
+    # the workers inherit the sprinkler instead of unpickling it
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+class ShardedSprinkler(object):
+    """
+    Sprinkles the shards of a catalog in parallel with the configuration
+    and state of a sprinkler.
+
+    Parameters
+    ----------
+    sp : `desc.twinkles.sprinkler`
+        the sprinkler; its record of used SN systems is updated as if it
+        had sprinkled the shards itself
+    processes : int, optional, defaults to 0
+        number of worker processes, which are forked from the calling
+        process; with 0 the shards are sprinkled by the calling process
+    """
+    def __init__(self, sp, processes=0):
+        self.sprinkler = sp
+        self.processes = processes
+
+    def reserve(self, shards):
+        """
+        Run the propose and resolve steps over shards and return the
+        `SNReservationTable` of each shard
+        """
+        proposals = [self.sprinkler.propose_sne_hosts(shard) for shard in shards]
+        if len(proposals) == 0:
+            return []
+        table = self.sprinkler.reserve_sne_systems(np.concatenate([galtileids for galtileids, _ in proposals]),
+                                                   np.concatenate([galz for _, galz in proposals]))
+        return [table.subset(galtileids) for galtileids, _ in proposals]
+
+    def sprinkle(self, shards, catalog_band):
+        """
+        Sprinkle the catalog chunks shards and return the list of the
+        sprinkled chunks, identical to
+
+            [sp.sprinkle(shard, catalog_band) for shard in shards]
+
+        Parameters
+        ----------
+        shards : list of `numpy.ndarray`
+            the catalog chunks, e.g. catalog[rows] for the rows returned
+            by shard_by_galtileid() or shard_by_sky_tile()
+        catalog_band : str
+            the band of the catalog
+        """
+        reservations = self.reserve(shards)
+        tasks = [(shard, catalog_band, reservation)
+                 for shard, reservation in zip(shards, reservations)]
+        if self.processes <= 0 or len(tasks) < 2:
+            return [_sprinkle_reserved(self.sprinkler, *task) for task in tasks]
+
+        # nothing the parent still has to write may be duplicated by fork
+        self.sprinkler.sed_writer.flush()
+        pool = _fork_context().Pool(min(self.processes, len(tasks)),
+                                    initializer=_init_worker,
+                                    initargs=(self.sprinkler,))
+        try:
+            outputs = pool.map(_sprinkle_shard, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return outputs
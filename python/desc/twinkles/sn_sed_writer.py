@@ -0,0 +1,153 @@
+"""
+Writer of the SEDs of the lensed SNe placed by the sprinkler.
+"""
+from __future__ import absolute_import, division
+import os
+import gzip
+import hashlib
+import tempfile
+import multiprocessing
+import numpy as np
+
+__all__ = ['sed_checksum', 'sed_file_checksum', 'write_sed_gz', 'SNSedWriter']
+
+# first line of every SED file written here
+_checksum_header = 'twinkles_sed_sha1'
+
+
+def sed_checksum(wavelen, flambda):
+    """
+    Return the hexadecimal sha1 digest of an SED given as wavelen and
+    flambda arrays.
+    """
+    hasher = hashlib.sha1()
+    hasher.update(np.ascontiguousarray(wavelen, dtype=float).tobytes())
+    hasher.update(np.ascontiguousarray(flambda, dtype=float).tobytes())
+    return hasher.hexdigest()
+
+
+def sed_file_checksum(file_name):
+    """
+    Return the checksum recorded in the header of a gzipped SED written by
+    write_sed_gz, or None if file_name does not exist or has no checksum.
+    """
+    if not os.path.exists(file_name):
+        return None
+    try:
+        with gzip.open(file_name, 'rb') as input_file:
+            header = input_file.readline().decode('ascii', 'replace').split()
+    except (IOError, OSError, EOFError):
+        return None
+    if len(header) == 3 and header[0] == '#' and header[1] == _checksum_header:
+        return header[2]
+    return None
+
+
+def write_sed_gz(file_name, wavelen, flambda, checksum=None):
+    """
+    Write an SED straight to the gzipped file file_name, in the two column
+    format of Sed.writeSED preceded by a comment line holding the checksum
+    of the SED.
+
+    The file is written under a temporary name and renamed, so readers and
+    concurrent writers never see a partial file.
+    """
+    if checksum is None:
+        checksum = sed_checksum(wavelen, flambda)
+    out_dir = os.path.dirname(file_name) or '.'
+    fd, tmp_name = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw_file:
+            # a fixed mtime and name keep the output a function of the SED
+            with gzip.GzipFile(filename=os.path.basename(file_name)[:-len('.gz')],
+                               mode='wb', fileobj=raw_file, mtime=0) as output_file:
+                np.savetxt(output_file, np.column_stack((wavelen, flambda)),
+                           fmt=('%.2f', '%.7g'),
+                           header='%s %s' % (_checksum_header, checksum))
+        os.rename(tmp_name, file_name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+    return file_name
+
+
+class SNSedWriter(object):
+    """
+    Writes gzipped lensed SN SEDs, skipping the ones that are already on
+    disk with the same content and optionally handing the formatting and
+    compression to a pool of worker processes.
+
+    Parameters
+    ----------
+    processes : int, optional, defaults to 0
+        number of worker processes; with 0 the SEDs are written by the
+        calling process as they are submitted
+
+    Attributes
+    ----------
+    written : int
+        number of SEDs written (or submitted to the pool)
+    skipped : int
+        number of SEDs that were already on disk
+    """
+    def __init__(self, processes=0):
+        self.processes = processes
+        self.written = 0
+        self.skipped = 0
+        self._pool = None
+        self._pending = []
+
+    def write(self, file_name, wavelen, flambda):
+        """
+        Write an SED to file_name + '.gz', unless that file already holds
+        the same SED.
+
+        Returns
+        -------
+        str : the name of the gzipped file
+        """
+        gz_name = str(file_name) + '.gz'
+        checksum = sed_checksum(wavelen, flambda)
+        if sed_file_checksum(gz_name) == checksum:
+            self.skipped += 1
+            return gz_name
+
+        self.written += 1
+        if self.processes > 0:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            self._pending.append(self._pool.apply_async(write_sed_gz,
+                                                        (gz_name, np.asarray(wavelen),
+                                                         np.asarray(flambda), checksum)))
+        else:
+            write_sed_gz(gz_name, wavelen, flambda, checksum)
+        return gz_name
+
+    def flush(self):
+        """
+        Wait for the SEDs submitted to the worker processes to be written,
+        re-raising the first error of the workers.
+        """
+        pending = self._pending
+        self._pending = []
+        for result in pending:
+            result.get()
+
+    def close(self):
+        """
+        Flush the pending SEDs and shut the worker processes down.
+        """
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
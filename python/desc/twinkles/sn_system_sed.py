@@ -0,0 +1,127 @@
+"""
+SEDs of all the images of a lensed SN system from a single SN model.
+"""
+from __future__ import absolute_import, division
+import copy
+import numpy as np
+from lsst.sims.photUtils import Sed
+
+__all__ = ['SNSystemSED']
+
+
+class SNSystemSED(object):
+    """
+    SALT2 model shared by the images of a lensed SN system.
+
+    The images of a system have the same z, x0, x1 and c and differ only in
+    position (hence Milky Way extinction), time delay (hence t0) and
+    magnification, which the sprinkler applies to the magNorm.  A single
+    SNObject with t0 = 0 is built for the system and evaluated at the
+    phases of all the images in one call, which gives the same phases as
+    one SNObject per image with its own t0.
+
+    Parameters
+    ----------
+    sn_obj : `lsst.sims.catUtils.supernovae.SNObject`
+        template whose state provides the model parameters not taken
+        from the system
+    system_df : `pandas.DataFrame`
+        rows of the lensed SNe catalog of the images of the system
+    """
+    def __init__(self, sn_obj, system_df):
+        sn_param_dict = copy.deepcopy(sn_obj.SNstate)
+        first_image = system_df.iloc[0]
+        sn_param_dict['z'] = first_image['zs']
+        sn_param_dict['c'] = first_image['c']
+        sn_param_dict['x0'] = first_image['x0']
+        sn_param_dict['x1'] = first_image['x1']
+        sn_param_dict['t0'] = 0.
+        self._sn_param_dict = sn_param_dict
+        self.sn_obj = sn_obj.fromSNState(sn_param_dict)
+        self.t0 = system_df['t_start'].values.astype(float)
+
+    def __len__(self):
+        return len(self.t0)
+
+    def set_positions(self, sn_ra, sn_dec):
+        """
+        Look up the Milky Way E(B-V) of the images at sn_ra, sn_dec (in
+        radians) and return the state of the SNObject of each image, as
+        SNObject.SNstate.  The SNObject of each image is made from its
+        state, as create_sn_sed does, so that the positions are not
+        converted to degrees and back.
+        """
+        self.ebv = np.zeros(len(self.t0), dtype=float)
+        states = []
+        for i_img in range(len(self.t0)):
+            sn_param_dict = copy.deepcopy(self._sn_param_dict)
+            sn_param_dict['_ra'] = sn_ra[i_img]
+            sn_param_dict['_dec'] = sn_dec[i_img]
+            sn_param_dict['t0'] = self.t0[i_img]
+            image_sn_obj = self.sn_obj.fromSNState(sn_param_dict)
+            image_sn_obj.mwEBVfromMaps()
+            self.ebv[i_img] = image_sn_obj.ebvofMW
+            states.append(image_sn_obj.SNstate)
+        return states
+
+    def flambda(self, time, wavelen, images=None):
+        """
+        Return the flambda (in ergs/cm^2/s/nm, with Milky Way extinction)
+        of the images at MJD time on the grid wavelen (in nm), as an
+        (images, wavelen) array, following SNObject.SNObjectSED.
+        set_positions must have been called first.
+
+        Parameters
+        ----------
+        time : float
+            MJD of the observation
+        wavelen : `numpy.ndarray`
+            wavelength grid in nm
+        images : array_like, optional
+            indices of the images to evaluate; defaults to all of them
+        """
+        if images is None:
+            images = np.arange(len(self.t0))
+        images = np.asarray(images, dtype=int)
+        t0 = self.t0[images]
+        flambda = np.zeros((len(images), len(wavelen)), dtype=float)
+
+        # outside of the model time range the SED is zero
+        in_time = np.where((time >= self.sn_obj.mintime() + t0) &
+                           (time <= self.sn_obj.maxtime() + t0))[0]
+        if len(in_time) > 0:
+            # the model does not extend over the whole grid; flag the
+            # wavelengths it does not cover with np.nan
+            wave = wavelen*10.0
+            mask = (wave >= self.sn_obj.minwave()) & (wave <= self.sn_obj.maxwave())
+            model_flux = self.sn_obj.flux(time=time - t0[in_time], wave=wave[mask])
+            model_flux = np.atleast_2d(model_flux)
+            flambda[in_time] = np.nan
+            # ergs/cm^2/sec/Ang to ergs/cm^2/sec/nm
+            flambda[np.ix_(in_time, np.where(mask)[0])] = model_flux*10.0
+
+        if self.sn_obj.rectifySED:
+            # as SNObjectSED does; this also turns the np.nan flags into 0
+            flambda = np.where(flambda > 0., flambda, 0.)
+
+        if len(images) == 0:
+            return flambda
+        # the CCM coefficients only depend on the grid
+        a_x, b_x = Sed(wavelen=wavelen, flambda=flambda[0]).setupCCM_ab()
+        for i_row, i_img in enumerate(images):
+            sed = Sed(wavelen=wavelen, flambda=flambda[i_row])
+            sed.addDust(a_x, b_x, ebv=self.ebv[i_img])
+            flambda[i_row] = sed.flambda
+        return flambda
+
+    def band_mags(self, time, bandpass, images=None):
+        """
+        Return the AB magnitudes of the images in bandpass at MJD time, as
+        SNObject.catsimBandMag.
+        """
+        flambda = self.flambda(time, bandpass.wavelen, images=images)
+        mags = np.zeros(len(flambda), dtype=float)
+        for i_row in range(len(flambda)):
+            sed = Sed(wavelen=bandpass.wavelen, flambda=flambda[i_row])
+            mags[i_row] = -2.5*np.log10(sed.calcFlux(bandpass)/3631.0)
+        return mags
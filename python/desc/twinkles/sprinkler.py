@@ -5,6 +5,7 @@ Created on Feb 6, 2015
 '''
 from __future__ import absolute_import, division, print_function
 from future.utils import iteritems
+import atexit
 import time
 import om10
 import numpy as np
@@ -13,8 +14,11 @@ import json
 import os
 import pandas as pd
 import copy
-import gzip
-import shutil
+import sys
+try:
+    import resource
+except ImportError:
+    resource = None
 from lsst.utils import getPackageDir
 from lsst.sims.utils import SpecMap, defaultSpecMap
 from lsst.sims.catUtils.baseCatalogModels import GalaxyTileCompoundObj
@@ -22,8 +26,36 @@ from lsst.sims.catUtils.matchSED import matchBase
 from lsst.sims.photUtils import Bandpass, BandpassDict, Sed
 from lsst.sims.utils import radiansFromArcsec
 from lsst.sims.catUtils.supernovae import SNObject
+from .lens_candidates import (LensCandidateIndex, SortedKeyIndex, SNSystemAssigner,
+                              SNReservationTable)
+from .magnorm_cache import load_src_mag_norm
+from .sn_sed_writer import SNSedWriter
+from .sn_system_sed import SNSystemSED
+from .var_params import (var_param_column, var_param_dtype, add_var_param_columns,
+                         parse_var_params, clear_var_params, render_var_params)
+from .sprinkling_plan import SprinklingPlan
+from .sprinkler_profile import SprinklerProfiler
+
+__all__ = ['sprinklerCompound', 'sprinkler', 'SprinklerRegistry',
+           'sprinkler_registry', 'get_sprinkler']
+
+# (defs_dict key, value) pairs used to blank out the disk and bulge
+# components of a sprinkled galaxy.  The order matters: several defs_dict
+# keys can point at the same catalog column.
+_clear_disk_values = (('galaxyDisk_majorAxis', 0.0),
+                      ('galaxyDisk_minorAxis', 0.0),
+                      ('galaxyDisk_positionAngle', 0.0),
+                      ('galaxyDisk_internalAv', 0.0),
+                      ('galaxyDisk_magNorm', 999.),
+                      ('galaxyDisk_sedFilename', None))
+
+_clear_bulge_values = (('galaxyBulge_majorAxis', 0.0),
+                       ('galaxyBulge_minorAxis', 0.0),
+                       ('galaxyBulge_positionAngle', 0.0),
+                       ('galaxyBulge_internalAv', 0.0),
+                       ('galaxyBulge_magNorm', 999.),
+                       ('galaxyBulge_sedFilename', None))
 
-__all__ = ['sprinklerCompound', 'sprinkler']
 class sprinklerCompound(GalaxyTileCompoundObj):
     objid = 'sprinklerCompound'
     objectTypeId = 66
@@ -32,6 +64,13 @@ class sprinklerCompound(GalaxyTileCompoundObj):
     sne_cache_file = None
     defs_file = None
     sed_path = None
+    batch_mode = False
+    sed_processes = 0
+    typed_var_params = False
+    render_var_param_json = False
+    catalog_band = None
+    plan_file = None
+    profile_sprinkler = False
 
     def _final_pass(self, results):
         #From the original GalaxyTileCompoundObj final pass method
@@ -50,14 +89,24 @@ class sprinklerCompound(GalaxyTileCompoundObj):
         # the factor of 10^8, making the uniqueIDs a more manageable size
         # results['galtileid'] = results['galtileid']#%100000000
 
-        #Use Sprinkler now
-        sp = sprinkler(results, self.mjd, self.specFileMap, self.sed_path,
-                       density_param=1.0,
-                       cached_sprinkling=self.cached_sprinkling,
-                       agn_cache_file=self.agn_cache_file,
-                       sne_cache_file=self.sne_cache_file,
-                       defs_file=self.defs_file)
-        results = sp.sprinkle()
+        #Use Sprinkler now; the same instance is reused for every chunk
+        if self.catalog_band is None:
+            raise AttributeError('Must specify catalog_band, the band (one of ugrizy) '
+                                 'of the lens galaxy magNorms, to sprinkle with %s.'
+                                 % self.objid)
+        sp = get_sprinkler(results, self.mjd, self.specFileMap, self.sed_path,
+                           density_param=1.0,
+                           cached_sprinkling=self.cached_sprinkling,
+                           agn_cache_file=self.agn_cache_file,
+                           sne_cache_file=self.sne_cache_file,
+                           defs_file=self.defs_file,
+                           batch_mode=self.batch_mode,
+                           sed_processes=self.sed_processes,
+                           typed_var_params=self.typed_var_params,
+                           render_var_param_json=self.render_var_param_json,
+                           plan_file=self.plan_file,
+                           profile=self.profile_sprinkler)
+        results = sp.sprinkle(results, self.catalog_band)
 
         return results
 
@@ -66,7 +115,9 @@ class sprinkler():
                  om10_cat='twinkles_lenses_v2.fits',
                  sne_cat='dc2_sne_cat.csv', density_param=1., cached_sprinkling=False,
                  agn_cache_file=None, sne_cache_file=None, defs_file=None,
-                 write_sn_sed=True):
+                 write_sn_sed=True, batch_mode=False, magnorm_cache_dir=None,
+                 sed_processes=0, typed_var_params=False, plan_file=None,
+                 profile=False, render_var_param_json=False):
         """
         Parameters
         ----------
@@ -92,6 +143,39 @@ class sprinkler():
         write_sn_sed: boolean
             Controls whether or not to actually write supernova
             SEDs to disk (default=True)
+        batch_mode: boolean
+            If true, sprinkle() builds the lens galaxies and lensed images
+            with whole-array operations on the catalog columns instead of
+            looping over rows.  The output is identical to the per-row
+            path (default=False)
+        magnorm_cache_dir: str
+            Directory of the on-disk cache of the OM10 source magNorms
+            (defaults to $TWINKLES_CACHE_DIR or ~/.twinkles_cache)
+        sed_processes: int
+            Number of worker processes writing the supernova SEDs while
+            the catalog is sprinkled; 0 writes them in this process
+            (default=0)
+        typed_var_params: boolean
+            If true, the AGN variability parameters are carried as typed
+            columns appended to the catalog (see desc.twinkles.var_params)
+            and the lensed images get their time delays in those columns.
+            Only the JSON of the lens hosts is parsed, and the JSON
+            varParamStr of the images is left as the host's unless
+            render_var_param_json is set (default=False)
+        plan_file: str
+            .npz file of a SprinklingPlan built for the catalog (see
+            desc.twinkles.sprinkling_plan).  If given, sprinkle() applies
+            the plan instead of assigning the lens systems and building
+            the hosts and images again (default=None)
+        profile: boolean
+            If true, the time spent in each phase of the sprinkler and the
+            numbers of hosts, systems and images are recorded by
+            self.profiler (see desc.twinkles.sprinkler_profile) for every
+            chunk and visit (default=False)
+        render_var_param_json: boolean
+            If true, with typed_var_params, the JSON varParamStr of the
+            lensed AGN images is rendered from their typed columns, for
+            catalogs that write varParamStr out (default=False)
 
         Returns
         -------
@@ -99,24 +183,33 @@ class sprinkler():
             results array with lens systems added.
         """
         t_start = time.time()
+        self.profiler = SprinklerProfiler(enabled=profile)
         twinklesDir = getPackageDir('Twinkles')
         om10_cat = os.path.join(twinklesDir, 'data', om10_cat)
         self.write_sn_sed = write_sn_sed
+        self.batch_mode = batch_mode
+        self.typed_var_params = typed_var_params
+        self.render_var_param_json = render_var_param_json
         self.catalog_column_names = catsim_cat.dtype.names
         # ****** THIS ASSUMES THAT THE ENVIRONMENT VARIABLE OM10_DIR IS SET *******
-        lensdb = om10.DB(catalog=om10_cat, vb=False)
-        self.lenscat = lensdb.lenses.copy()
+        with self.profiler.phase('om10_load'):
+            lensdb = om10.DB(catalog=om10_cat, vb=False)
+            self.lenscat = lensdb.lenses.copy()
         self.density_param = density_param
         self.bandpassDict = BandpassDict.loadTotalBandpassesFromFiles(bandpassNames=['i'])
         self.lsst_band_indexes = {'u':0, 'g':1, 'r':2, 'i':3, 'z':4, 'y':5}
 
         self.sne_catalog = pd.read_csv(os.path.join(twinklesDir, 'data', sne_cat))
         #self.sne_catalog = self.sne_catalog.iloc[:101] ### Remove this after testing
-        self.used_systems = []
         self._visit_mjd = visit_mjd
         self.sn_obj = SNObject(0., 0.)
         self.write_dir = specFileMap.subdir_map['(^specFileGLSN)']
         self.sed_path = sed_path
+        self.sed_writer = SNSedWriter(processes=sed_processes)
+        self.chunk_memory = None
+        self.max_buffer_bytes = 0
+        self.sne_reservation = None
+        self.plan = None if plan_file is None else SprinklingPlan.read(plan_file)
 
         self.cached_sprinkling = cached_sprinkling
         if self.cached_sprinkling is True:
@@ -129,6 +222,7 @@ class sprinkler():
         else:
             self.agn_cache = None
             self.sne_cache = None
+        self._build_join_indexes()
 
         if defs_file is None:
             self.defs_file = os.path.join(twinklesDir, 'data', 'catsim_defs.csv')
@@ -147,20 +241,14 @@ class sprinkler():
         #Calculate imsimband magnitudes of source galaxies for matching
 
         agn_fname = str(getPackageDir('sims_sed_library') + '/agnSED/agn.spec.gz')
-        src_iband = self.lenscat['MAGI_IN']
-        src_z = self.lenscat['ZSRC']
-        self.src_mag_norm = []
-        for src, s_z in zip(src_iband, src_z):
-            agn_sed = Sed()
-            agn_sed.readSED_flambda(agn_fname)
-            agn_sed.redshiftSED(s_z, dimming=True)
-            self.src_mag_norm.append(matchBase().calcMagNorm([src],
-                                                             agn_sed,
-                                                             self.bandpassDict))
-        #self.src_mag_norm = matchBase().calcMagNorm(src_iband,
-        #                                            [agn_sed]*len(src_iband),
-        #
-        #                                            self.bandpassDict)
+        with self.profiler.phase('magnorm_precompute'):
+            self.src_mag_norm = load_src_mag_norm(om10_cat, self.lenscat['MAGI_IN'],
+                                                  self.lenscat['ZSRC'], agn_fname,
+                                                  self.bandpassDict,
+                                                  cache_dir=magnorm_cache_dir)
+        self.lens_index = LensCandidateIndex(self.lenscat['ZSRC'],
+                                             self.src_mag_norm,
+                                             self.lenscat['twinklesId'])
 
         has_sn_truth_params = False
         for name in self.catalog_column_names:
@@ -196,38 +284,206 @@ class sprinkler():
     def visit_mjd(self, val):
         self._visit_mjd = val
 
-    def sprinkle(self, input_catalog, catalog_band):
-        # Define a list that we can write out to a text file
-        lenslines = []
-        # For each galaxy in the catsim catalog
+    def _build_join_indexes(self):
+        """
+        Build the sorted-key indexes joining host galtileids to lens systems
+        (for cached sprinkling) and lens systems to their rows in the OM10
+        and SNe catalogs.
+        """
+        self._lens_id_index = SortedKeyIndex(self.lenscat['twinklesId'])
+        self._sne_system_index = SortedKeyIndex(self.sne_catalog['twinkles_sysno'].values)
+        self.sne_assigner = SNSystemAssigner(self.sne_catalog['zs'].values,
+                                             self.sne_catalog['twinkles_sysno'].values)
+        if self.cached_sprinkling:
+            self._agn_cache_index = SortedKeyIndex(self.agn_cache['galtileid'].values)
+            self._sne_cache_index = SortedKeyIndex(self.sne_cache['galtileid'].values)
+            self._unq_agn_gid = self._agn_cache_index.unique_keys
+            self._unq_sne_gid = self._sne_cache_index.unique_keys
+
+    @property
+    def used_systems(self):
+        """
+        The lensed SN systems that have already been placed in a host
+        """
+        return list(self.sne_assigner.used)
+
+    @used_systems.setter
+    def used_systems(self, systems):
+        self.sne_assigner.reset()
+        self.sne_assigner.mark_used(systems)
+
+    def _cached_agn_lenses(self, galtileids):
+        """
+        Return the indices in self.lenscat of the lens systems that the AGN
+        cache assigns to galtileids
+        """
+        cache_rows = self._agn_cache_index.first(galtileids)
+        if (cache_rows < 0).any():
+            raise RuntimeError('galtileids %s are not in the AGN cache'
+                               % str(np.asarray(galtileids)[cache_rows < 0]))
+        systems = self.agn_cache['twinkles_system'].values[cache_rows]
+        lenses = self._lens_id_index.first(systems)
+        if (lenses < 0).any():
+            raise RuntimeError('twinkles_systems %s of the AGN cache are not in the lens catalog'
+                               % str(systems[lenses < 0]))
+        return lenses
+
+    def _cached_sne_systems(self, galtileids):
+        """
+        Return the twinkles_sysno that the SNe cache assigns to each of
+        galtileids, and a mask of the galtileids that are in the cache
+        """
+        cache_rows = self._sne_cache_index.first(galtileids)
+        in_cache = cache_rows >= 0
+        return self.sne_cache['twinkles_system'].values[cache_rows[in_cache]], in_cache
+
+    def _sne_system_bounds(self, systems):
+        """
+        Return (start, end) such that the rows of self.sne_catalog holding
+        the images of systems[i] are self._sne_system_index.rows[start[i]:end[i]]
+        """
+        start, end = self._sne_system_index.bounds(systems)
+        if (end <= start).any():
+            raise RuntimeError('twinkles_sysno %s are not in the SNe catalog'
+                               % str(np.asarray(systems)[end <= start]))
+        return start, end
+
+    def _valid_host_rows(self, input_catalog):
+        """
+        Return the indices of the rows in input_catalog that are eligible
+        to host a lensed AGN and a lensed SN respectively.
+        """
         if isinstance(self.defs_dict['galtileid'], tuple):
             galid_dex = self.defs_dict['galtileid'][0]
         else:
             galid_dex = self.defs_dict['galtileid']
 
-        agn_magnorm_dex = self.defs_dict['galaxyAgn_magNorm']
-        agn_magnorm_array  = np.array([row[agn_magnorm_dex] for row in input_catalog])
+        agn_magnorm_array = np.array(input_catalog[self.defs_dict['galaxyAgn_magNorm']])
         nan_magnorm = np.isnan(agn_magnorm_array)
 
         if self.cached_sprinkling:
-            if not hasattr(self, '_unq_agn_gid'):
-                self._unq_agn_gid = np.unique(self.agn_cache['galtileid'].values)
-                self._unq_sne_gid = np.unique(self.sne_cache['galtileid'].values)
-
-            galtileid_array = np.array([row[galid_dex] for row in input_catalog])
-            valid_agn = np.where(np.logical_and(np.logical_not(nan_magnorm),
-                                                np.in1d(galtileid_array,
-                                                        self._unq_agn_gid,
-                                                        assume_unique=True)))[0]
-
-            valid_sne = np.where(np.logical_and(nan_magnorm,
-                                                np.in1d(galtileid_array,
-                                                        self._unq_sne_gid,
-                                                        assume_unique=True)))[0]
+            with self.profiler.phase('cache_join'):
+                galtileid_array = np.array(input_catalog[galid_dex])
+                valid_agn = np.where(np.logical_and(np.logical_not(nan_magnorm),
+                                                    np.isin(galtileid_array,
+                                                            self._unq_agn_gid,
+                                                            assume_unique=True)))[0]
+
+                valid_sne = np.where(np.logical_and(nan_magnorm,
+                                                    np.isin(galtileid_array,
+                                                            self._unq_sne_gid,
+                                                            assume_unique=True)))[0]
         else:
             valid_agn = np.where(np.logical_not(nan_magnorm))[0]
             valid_sne = np.where(nan_magnorm)[0]
 
+        self.profiler.count('agn_hosts_seen', len(valid_agn))
+        self.profiler.count('sne_hosts_seen', len(valid_sne))
+        return valid_agn, valid_sne
+
+    def _with_var_param_columns(self, input_catalog):
+        """
+        Return input_catalog with the typed AGN variability columns if the
+        sprinkler carries them.  No JSON is parsed: the lens hosts are
+        parsed once they are chosen (see _parse_host_var_params).
+        """
+        if not self.typed_var_params:
+            return input_catalog
+        return add_var_param_columns(input_catalog,
+                                     self.defs_dict['galaxyAgn_varParamStr'],
+                                     self.defs_dict['varMethodName'],
+                                     self.defs_dict['pars'], rows=[])
+
+    def _parse_host_var_params(self, catalog, agn_hosts):
+        """
+        Fill the typed AGN variability columns of the rows agn_hosts of
+        catalog from their JSON
+        """
+        with self.profiler.phase('json'):
+            parse_var_params(catalog, self.defs_dict['galaxyAgn_varParamStr'], agn_hosts,
+                             method_key=self.defs_dict['varMethodName'],
+                             pars_key=self.defs_dict['pars'])
+
+    def _new_output(self, input_catalog, n_out):
+        """
+        Return an array of n_out rows whose first rows are a copy of
+        input_catalog, with the typed AGN variability columns if the
+        sprinkler carries them (left unparsed for the input rows)
+        """
+        if not self.typed_var_params:
+            output = np.empty(n_out, dtype=input_catalog.dtype)
+            output[:len(input_catalog)] = input_catalog
+            return output
+        var_col = self.defs_dict['galaxyAgn_varParamStr']
+        dtype = var_param_dtype(input_catalog.dtype, var_col)
+        output = np.empty(n_out, dtype=dtype)
+        if dtype is input_catalog.dtype:
+            output[:len(input_catalog)] = input_catalog
+            return output
+        for name in input_catalog.dtype.names:
+            output[name][:len(input_catalog)] = input_catalog[name]
+        clear_var_params(output, var_col, slice(0, len(input_catalog)))
+        return output
+
+    def _render_image_var_params(self, catalog, n_in):
+        """
+        Write the JSON varParamStr of the lensed AGN images, the rows of
+        catalog after the n_in input rows, from their typed columns, so
+        that catalogs writing varParamStr out carry the time delays
+        """
+        if not self.typed_var_params:
+            return
+        images = n_in + np.where(catalog[self._var_col('method')][n_in:] ==
+                                 'applyAgnTimeDelay')[0]
+        render_var_params(catalog, self.defs_dict['galaxyAgn_varParamStr'], rows=images,
+                          method_key=self.defs_dict['varMethodName'],
+                          pars_key=self.defs_dict['pars'])
+
+    def sprinkle(self, input_catalog, catalog_band):
+        if catalog_band not in self.lsst_band_indexes:
+            raise ValueError('catalog_band must be one of ugrizy, not %s' % catalog_band)
+        n_in = len(input_catalog)
+        self.profiler.start_chunk(self.visit_mjd, n_in)
+        # the plan and batch mode add the typed variability columns to
+        # their output buffers
+        if self.plan is not None:
+            input_catalog = self.plan.apply(self, input_catalog, catalog_band)
+        elif self.batch_mode:
+            input_catalog = self._sprinkle_batch(input_catalog, catalog_band)
+        else:
+            # the time the phases inside the loops do not account for is
+            # spent building rows
+            with self.profiler.phase('row_construction'):
+                input_catalog = self._sprinkle_rows(self._with_var_param_columns(input_catalog),
+                                                    catalog_band)
+        if self.render_var_param_json:
+            with self.profiler.phase('json'):
+                self._render_image_var_params(input_catalog, n_in)
+        # the SEDs of the lensed SNe in the chunk must be on disk before
+        # the chunk is written out
+        with self.profiler.phase('sn_sed'):
+            self.sed_writer.flush()
+        self.profiler.end_chunk(len(input_catalog))
+        return input_catalog
+
+    def close(self):
+        """
+        Write the pending SN SEDs and shut down the worker processes of
+        the SED writer
+        """
+        self.sed_writer.close()
+
+    def _sprinkle_rows(self, input_catalog, catalog_band):
+        # Define a list that we can write out to a text file
+        lenslines = []
+        # For each galaxy in the catsim catalog
+        if isinstance(self.defs_dict['galtileid'], tuple):
+            galid_dex = self.defs_dict['galtileid'][0]
+        else:
+            galid_dex = self.defs_dict['galtileid']
+
+        valid_agn, valid_sne = self._valid_host_rows(input_catalog)
+
         new_rows = []
         # print("Running sprinkler. Catalog Length: ", len(input_catalog))
         for rowNum in valid_agn:
@@ -235,30 +491,37 @@ class sprinkler():
             galtileid = row[galid_dex]
 
             if not self.cached_sprinkling:
-                candidates = self.find_lens_candidates(row[self.defs_dict['galaxyAgn_redshift']],
-                                                       row[self.defs_dict['galaxyAgn_magNorm']])
-                rng = np.random.RandomState(galtileid % (2**32 -1))
-                pick_value = rng.uniform()
-
-                if len(candidates) == 0 or pick_value>self.density_param:
-                    # If there aren't any lensed sources at this redshift from
-                    # OM10 move on the next object
-                    continue
-
-                # Randomly choose one the lens systems
-                # (can decide with or without replacement)
-                # Sort first to make sure the same choice is made every time
-
-                candidates = candidates[np.argsort(candidates['twinklesId'])]
-                newlens = rng.choice(candidates)
+                with self.profiler.phase('candidate_search'):
+                    candidates = self.find_lens_candidates(row[self.defs_dict['galaxyAgn_redshift']],
+                                                           row[self.defs_dict['galaxyAgn_magNorm']])
+                    rng = np.random.RandomState(galtileid % (2**32 -1))
+                    pick_value = rng.uniform()
+
+                    if len(candidates) == 0 or pick_value>self.density_param:
+                        # If there aren't any lensed sources at this redshift from
+                        # OM10 move on the next object
+                        continue
+
+                    # Randomly choose one the lens systems
+                    # (can decide with or without replacement)
+                    # Sort first to make sure the same choice is made every time
+
+                    candidates = candidates[np.argsort(candidates['twinklesId'])]
+                    newlens = rng.choice(candidates)
             else:
-                twinkles_sys_cache = self.agn_cache.query('galtileid == %i' % galtileid)['twinkles_system'].values[0]
-                newlens = self.lenscat[np.where(self.lenscat['twinklesId'] == twinkles_sys_cache)[0]][0]
+                with self.profiler.phase('cache_join'):
+                    newlens = self.lenscat[self._cached_agn_lenses([galtileid])[0]]
+            self.profiler.count('agn_systems_placed')
+            self.profiler.count('agn_images', newlens['NIMG'])
 
             #varString = json.loads(row[self.defs_dict['galaxyAgn_varParamStr']])
             # varString[self.defs_dict['pars']]['t0_mjd'] = 59300.0
             #row[self.defs_dict['galaxyAgn_varParamStr']] = json.dumps(varString)
 
+            if self.typed_var_params:
+                self._parse_host_var_params(input_catalog, [rowNum])
+                row = input_catalog[rowNum]
+
             # Append the lens galaxy
             # For each image, append the lens images
             default_lensrow = None
@@ -294,10 +557,15 @@ class sprinkler():
                 lensrow[self.defs_dict['decJ2000']] = lens_dec + delta_dec
                 mag_adjust = 2.5*np.log10(np.abs(newlens['MAG'][i]))
                 lensrow[self.defs_dict['galaxyAgn_magNorm']] -= mag_adjust
-                varString = json.loads(lensrow[self.defs_dict['galaxyAgn_varParamStr']])
-                varString[self.defs_dict['pars']]['t0Delay'] = newlens['DELAY'][i]
-                varString[self.defs_dict['varMethodName']] = 'applyAgnTimeDelay'
-                lensrow[self.defs_dict['galaxyAgn_varParamStr']] = json.dumps(varString)
+                if self.typed_var_params:
+                    lensrow[self._var_col('t0Delay')] = newlens['DELAY'][i]
+                    lensrow[self._var_col('method')] = 'applyAgnTimeDelay'
+                else:
+                    with self.profiler.phase('json'):
+                        varString = json.loads(lensrow[self.defs_dict['galaxyAgn_varParamStr']])
+                        varString[self.defs_dict['pars']]['t0Delay'] = newlens['DELAY'][i]
+                        varString[self.defs_dict['varMethodName']] = 'applyAgnTimeDelay'
+                        lensrow[self.defs_dict['galaxyAgn_varParamStr']] = json.dumps(varString)
 
                 if self.logging_is_sprinkled:
                     lensrow[self.defs_dict['galaxyAgn_is_sprinkled']] = 1
@@ -337,11 +605,6 @@ class sprinkler():
             row[self.defs_dict['galaxyBulge_redshift']] = newlens['ZLENS']
             row[self.defs_dict['galaxyDisk_redshift']] = newlens['ZLENS']
             row[self.defs_dict['galaxyAgn_redshift']] = newlens['ZLENS']
-            row_lens_sed = Sed()
-            row_lens_sed.readSED_flambda(os.path.join(self.sedDir,
-                                                      newlens['lens_sed']))
-
-            row_lens_sed.redshiftSED(newlens['ZLENS'], dimming=True)
             # Get the correct magnorm to maintain galaxy colors
             row[self.defs_dict['galaxyBulge_magNorm']] = newlens['sed_magNorm'][self.lsst_band_indexes[catalog_band]]
             row[self.defs_dict['galaxyBulge_majorAxis']] = radiansFromArcsec(newlens['REFF'] / np.sqrt(1 - newlens['ELLIP']))
@@ -362,26 +625,14 @@ class sprinkler():
         for rowNum in valid_sne:
             row = input_catalog[rowNum]
             galtileid = row[galid_dex]
-            if self.cached_sprinkling is True:
-                if galtileid in self.sne_cache['galtileid'].values:
-                    use_system = self.sne_cache.query('galtileid == %i' % galtileid)['twinkles_system'].values
-                    use_df = self.sne_catalog.query('twinkles_sysno == %i' % use_system)
-                    self.used_systems.append(use_system)
-                else:
-                    continue
-            else:
-                lens_sne_candidates = self.find_sne_lens_candidates(row[self.defs_dict['galaxyDisk_redshift']])
-                candidate_sysno = np.unique(lens_sne_candidates['twinkles_sysno'])
-                num_candidates = len(candidate_sysno)
-                if num_candidates == 0:
-                    continue
-                used_already = np.array([sys_num in self.used_systems for sys_num in candidate_sysno])
-                unused_sysno = candidate_sysno[~used_already]
-                if len(unused_sysno) == 0:
-                    continue
-                rng2 = np.random.RandomState(galtileid % (2**32 -1))
-                use_system = rng2.choice(unused_sysno)
-                use_df = self.sne_catalog.query('twinkles_sysno == %i' % use_system)
+            systems, chosen = self._choose_sne_systems([galtileid],
+                                                       [row[self.defs_dict['galaxyDisk_redshift']]])
+            if not chosen[0]:
+                continue
+            use_system = systems[0]
+            self.profiler.count('sne_systems_placed')
+            with self.profiler.phase('cache_join'):
+                use_df = self.sne_catalog.iloc[self._sne_system_index.all_rows(use_system)]
 
             default_lensrow = row.copy()
             default_lensrow[self.defs_dict['galaxyDisk_majorAxis']] = 0.0
@@ -398,6 +649,8 @@ class sprinkler():
             default_lensrow[self.defs_dict['galaxyBulge_sedFilename']] = None
             varString = 'None'
             default_lensrow[self.defs_dict['galaxyAgn_varParamStr']] = varString
+            if self.typed_var_params:
+                clear_var_params(default_lensrow, self.defs_dict['galaxyAgn_varParamStr'])
 
             for i in range(len(use_df)):
                 lensrow = default_lensrow.copy()
@@ -425,16 +678,18 @@ class sprinkler():
                                               use_system*8 + i)
 
 
-                (add_to_cat, sn_magnorm,
-                 sn_fname, sn_param_dict) = self.create_sn_sed(use_df.iloc[i],
-                                                               lensrow[self.defs_dict['raJ2000']],
-                                                               lensrow[self.defs_dict['decJ2000']],
-                                                               self.visit_mjd,
-                                                               write_sn_sed=self.write_sn_sed)
+                with self.profiler.phase('sn_sed'):
+                    (add_to_cat, sn_magnorm,
+                     sn_fname, sn_param_dict) = self.create_sn_sed(use_df.iloc[i],
+                                                                   lensrow[self.defs_dict['raJ2000']],
+                                                                   lensrow[self.defs_dict['decJ2000']],
+                                                                   self.visit_mjd,
+                                                                   write_sn_sed=self.write_sn_sed)
 
                 if self.store_sn_truth_params:
                     add_to_cat = True
-                    lensrow[self.defs_dict['galaxyAgn_sn_truth_params']] = json.dumps(sn_param_dict)
+                    with self.profiler.phase('json'):
+                        lensrow[self.defs_dict['galaxyAgn_sn_truth_params']] = json.dumps(sn_param_dict)
                     lensrow[self.defs_dict['galaxyAgn_sn_t0']] = sn_param_dict['t0']
 
                 lensrow[self.defs_dict['galaxyAgn_sedFilename']] = sn_fname
@@ -449,6 +704,7 @@ class sprinkler():
 
                 if add_to_cat is True:
                     new_rows.append(lensrow)
+                    self.profiler.count('sne_images')
 
                 #Now manipulate original entry to be the lens galaxy with desired properties
                 #Start by deleting Disk and AGN properties
@@ -486,15 +742,456 @@ class sprinkler():
 
 
         if len(new_rows)>0:
-            input_catalog = np.append(input_catalog, new_rows)
+            with self.profiler.phase('concatenate'):
+                input_catalog = np.append(input_catalog, new_rows)
 
         return input_catalog
 
+    def _set_columns(self, catalog, rows, values):
+        """
+        Assign a sequence of (defs_dict key, value) pairs to the selected
+        rows of a structured catalog array.  The assignments are made in
+        order so that columns shared between several defs_dict keys end up
+        with the same contents as in the per-row path.
+        """
+        for key, val in values:
+            catalog[self.defs_dict[key]][rows] = val
+
+    def _var_col(self, field):
+        """
+        Name of the typed column of the AGN variability parameter field
+        """
+        return var_param_column(self.defs_dict['galaxyAgn_varParamStr'], field)
+
+    def _galid_columns(self):
+        """
+        Return the list of catalog columns holding galtileid
+        """
+        if isinstance(self.defs_dict['galtileid'], tuple):
+            return list(self.defs_dict['galtileid'])
+        return [self.defs_dict['galtileid']]
+
+    def _assign_agn_lens(self, row, candidates=None):
+        """
+        Return the index in self.lenscat of the lens system to place
+        in this AGN host row, or None if the row should not be sprinkled,
+        when sprinkling without the cache.  candidates are the indices of the lens candidates of the row sorted
+        by twinklesId, as returned by self.lens_index; they are looked up if
+        not given.
+        """
+        galtileid = row[self._galid_columns()[0]]
+        if candidates is None:
+            candidates = self.lens_index.candidates(row[self.defs_dict['galaxyAgn_redshift']],
+                                                    row[self.defs_dict['galaxyAgn_magNorm']])
+        rng = np.random.RandomState(galtileid % (2**32 -1))
+        pick_value = rng.uniform()
+        if len(candidates) == 0 or pick_value > self.density_param:
+            return None
+
+        # choosing from the index array consumes the same random draw
+        # as choosing from the candidate records
+        return rng.choice(candidates)
+
+    @staticmethod
+    def _image_numbers(n_img):
+        """
+        Given the number of images of each system, return the image number
+        (0 ... n-1 within its system) of every image.
+        """
+        n_img = np.asarray(n_img, dtype=int)
+        offsets = np.cumsum(n_img) - n_img
+        return np.arange(n_img.sum()) - np.repeat(offsets, n_img)
+
+    def _set_uniqueIds(self, images, systems, img_num):
+        """
+        Mangle galtileid of the lensed images.
+
+        To get back twinklesID in lens catalog from phosim catalog id number
+        just use np.right_shift(phosimID-28, 10). Take the floor of the last
+        3 numbers to get twinklesID in the twinkles lens catalog and the
+        remainder is the image number minus 1.
+        """
+        for col_name in self._galid_columns():
+            images[col_name] = ((images[col_name]+int(1.5e10))*100000 +
+                                systems*8 + img_num)
+
+    def _set_is_sprinkled(self, catalog, rows):
+        if self.logging_is_sprinkled:
+            self._set_columns(catalog, rows,
+                              (('galaxyAgn_is_sprinkled', 1),
+                               ('galaxyBulge_is_sprinkled', 1),
+                               ('galaxyDisk_is_sprinkled', 1)))
+
+    def _overwrite_agn_hosts(self, input_catalog, agn_hosts, agn_lenses,
+                             catalog_band):
+        """
+        Turn the AGN host rows of input_catalog into the lens galaxies of
+        the OM10 systems at agn_lenses
+        """
+        has_disk = np.logical_not(np.isnan(input_catalog[self.defs_dict['galaxyDisk_magNorm']][agn_hosts]))
+        self._set_columns(input_catalog, agn_hosts[has_disk], _clear_disk_values)
+        z_lens = self.lenscat['ZLENS'][agn_lenses]
+        r_eff = self.lenscat['REFF'][agn_lenses]
+        ellip = self.lenscat['ELLIP'][agn_lenses]
+        band_dex = self.lsst_band_indexes[catalog_band]
+        self._set_columns(input_catalog, agn_hosts,
+                          (('galaxyAgn_magNorm', None),
+                           ('galaxyDisk_magNorm', 999.),
+                           ('galaxyAgn_sedFilename', None),
+                           ('galaxyBulge_sedFilename', self.lenscat['lens_sed'][agn_lenses]),
+                           ('galaxyBulge_redshift', z_lens),
+                           ('galaxyDisk_redshift', z_lens),
+                           ('galaxyAgn_redshift', z_lens),
+                           # Get the correct magnorm to maintain galaxy colors
+                           ('galaxyBulge_magNorm', self.lenscat['sed_magNorm'][agn_lenses, band_dex]),
+                           ('galaxyBulge_majorAxis', radiansFromArcsec(r_eff / np.sqrt(1 - ellip))),
+                           ('galaxyBulge_minorAxis', radiansFromArcsec(r_eff * np.sqrt(1 - ellip))),
+                           #Convert orientation angle to west of north from east of north by *-1.0 and convert to radians
+                           ('galaxyBulge_positionAngle', self.lenscat['PHIE'][agn_lenses]*(-1.0)*np.pi/180.0),
+                           ('galaxyBulge_internalAv', self.lenscat['lens_av'][agn_lenses]),
+                           ('galaxyBulge_internalRv', self.lenscat['lens_rv'][agn_lenses])))
+        self._set_is_sprinkled(input_catalog, agn_hosts)
+
+    def _overwrite_sne_hosts(self, input_catalog, sne_hosts, first_rows,
+                             catalog_band):
+        """
+        Turn the SN host rows of input_catalog into the lens galaxies of
+        the lensed SN systems whose first images are at first_rows of
+        self.sne_catalog
+        """
+        lens_df = self.sne_catalog.iloc[first_rows]
+        has_disk = np.logical_not(np.isnan(input_catalog[self.defs_dict['galaxyDisk_magNorm']][sne_hosts]))
+        self._set_columns(input_catalog, sne_hosts[has_disk], _clear_disk_values)
+        z_lens = lens_df['zl'].values
+        r_eff = lens_df['lensgal_reff'].values
+        ellip = lens_df['e'].values
+        self._set_columns(input_catalog, sne_hosts,
+                          (('galaxyAgn_magNorm', None),
+                           ('galaxyDisk_magNorm', 999.),
+                           ('galaxyAgn_sedFilename', None),
+                           ('galaxyBulge_sedFilename', lens_df['lensgal_sed'].values),
+                           ('galaxyBulge_redshift', z_lens),
+                           ('galaxyDisk_redshift', z_lens),
+                           ('galaxyAgn_redshift', z_lens),
+                           ('galaxyBulge_magNorm', lens_df['lensgal_magnorm_%s' % catalog_band].values),
+                           ('galaxyBulge_majorAxis', radiansFromArcsec(r_eff / np.sqrt(1 - ellip))),
+                           ('galaxyBulge_minorAxis', radiansFromArcsec(r_eff * np.sqrt(1 - ellip))),
+                           #Convert orientation angle to west of north from east of north by *-1.0 and convert to radians
+                           ('galaxyBulge_positionAngle', lens_df['theta_e'].values*(-1.0)*np.pi/180.0),
+                           ('galaxyBulge_internalAv', lens_df['lens_av'].values),
+                           ('galaxyBulge_internalRv', lens_df['lens_rv'].values)))
+        self._set_is_sprinkled(input_catalog, sne_hosts)
+
+    def _agn_images(self, input_catalog, agn_hosts, agn_lenses, n_img, agn_images):
+        """
+        Build the lensed AGN images in the preallocated rows agn_images
+        from unmodified copies of the host rows; n_img is the number of
+        images of each system.
+        """
+        defs = self.defs_dict
+        img_lens = np.repeat(agn_lenses, n_img)
+        img_num = self._image_numbers(n_img)
+        if self.typed_var_params:
+            self._parse_host_var_params(input_catalog, agn_hosts)
+        np.take(input_catalog, np.repeat(agn_hosts, n_img), out=agn_images)
+
+        z_src = self.lenscat['ZSRC'][img_lens]
+        self._set_columns(agn_images, slice(None), _clear_disk_values)
+        self._set_columns(agn_images, slice(None), _clear_bulge_values)
+        self._set_columns(agn_images, slice(None),
+                          (('galaxyBulge_redshift', z_src),
+                           ('galaxyDisk_redshift', z_src),
+                           ('galaxyAgn_redshift', z_src)))
+
+        # XIMG and YIMG are in arcseconds
+        # raPhSim and decPhoSim are in radians
+        # Shift all parts of the lensed object,
+        # not just its agn part
+        delta_dec = np.radians(self.lenscat['YIMG'][img_lens, img_num] / 3600.0)
+        delta_ra = np.radians(self.lenscat['XIMG'][img_lens, img_num] / 3600.0)
+        lens_ra = agn_images[defs['raJ2000']]
+        lens_dec = agn_images[defs['decJ2000']]
+        agn_images[defs['raJ2000']] = lens_ra + delta_ra/np.cos(lens_dec)
+        agn_images[defs['decJ2000']] = lens_dec + delta_dec
+        mag_adjust = 2.5*np.log10(np.abs(self.lenscat['MAG'][img_lens, img_num]))
+        agn_images[defs['galaxyAgn_magNorm']] -= mag_adjust
+
+        img_delay = self.lenscat['DELAY'][img_lens, img_num]
+        if self.typed_var_params:
+            agn_images[self._var_col('method')] = 'applyAgnTimeDelay'
+            agn_images[self._var_col('t0Delay')] = img_delay
+        else:
+            # each host's variability parameters only need to be parsed once
+            with self.profiler.phase('json'):
+                var_strings = []
+                host_var = input_catalog[defs['galaxyAgn_varParamStr']][agn_hosts]
+                i_img = 0
+                for var_str, n in zip(host_var, n_img):
+                    varString = json.loads(var_str)
+                    varString[defs['varMethodName']] = 'applyAgnTimeDelay'
+                    for delay in img_delay[i_img:i_img+n]:
+                        varString[defs['pars']]['t0Delay'] = delay
+                        var_strings.append(json.dumps(varString))
+                    i_img += n
+            if len(var_strings) > 0:
+                agn_images[defs['galaxyAgn_varParamStr']] = var_strings
+
+        self._set_is_sprinkled(agn_images, slice(None))
+        self._set_uniqueIds(agn_images, self.lenscat['twinklesId'][img_lens],
+                            img_num)
+
+    def _sne_images(self, input_catalog, sne_hosts, sne_systems, img_sne, n_img,
+                    sne_images):
+        """
+        Build the lensed SN images in the preallocated rows sne_images from
+        unmodified copies of the host rows; img_sne are the rows of
+        self.sne_catalog of the images and n_img the number of images of
+        each system.  Images whose SED has no flux at the visit are
+        dropped, unless the catalog stores the SN truth parameters: the
+        images kept are moved to the front of sne_images and their number
+        is returned.
+        """
+        with self.profiler.phase('row_construction'):
+            self._sne_image_rows(input_catalog, sne_hosts, sne_systems, img_sne,
+                                 n_img, sne_images)
+        return self._sne_image_seds(sne_images, img_sne, n_img)
+
+    def _sne_image_rows(self, input_catalog, sne_hosts, sne_systems, img_sne,
+                        n_img, sne_images):
+        """
+        The part of _sne_images that does not depend on the visit: copy the
+        host rows to sne_images and move them to the images
+        """
+        defs = self.defs_dict
+        img_num = self._image_numbers(n_img)
+        np.take(input_catalog, np.repeat(sne_hosts, n_img), out=sne_images)
+
+        self._set_columns(sne_images, slice(None), _clear_disk_values)
+        self._set_columns(sne_images, slice(None), _clear_bulge_values)
+        self._set_columns(sne_images, slice(None), (('galaxyAgn_varParamStr', 'None'),))
+        if self.typed_var_params:
+            clear_var_params(sne_images, defs['galaxyAgn_varParamStr'])
+
+        delta_ra = np.radians(self.sne_catalog['x'].values[img_sne] / 3600.0)
+        delta_dec = np.radians(self.sne_catalog['y'].values[img_sne] / 3600.0)
+        lens_ra = sne_images[defs['raJ2000']]
+        lens_dec = sne_images[defs['decJ2000']]
+        sne_images[defs['raJ2000']] = lens_ra + delta_ra/np.cos(lens_dec)
+        sne_images[defs['decJ2000']] = lens_dec + delta_dec
+        z_s = self.sne_catalog['zs'].values[img_sne]
+        self._set_columns(sne_images, slice(None),
+                          (('galaxyBulge_redshift', z_s),
+                           ('galaxyDisk_redshift', z_s),
+                           ('galaxyAgn_redshift', z_s)))
+        self._set_uniqueIds(sne_images, np.repeat(sne_systems, n_img), img_num)
+
+    def _sne_image_seds(self, sne_images, img_sne, n_img):
+        """
+        The part of _sne_images that depends on the visit: make the SEDs of
+        the images built by _sne_image_rows, set their magNorms and drop
+        the ones without flux.  Returns the number of images kept.
+        """
+        defs = self.defs_dict
+        # the SEDs are made one system at a time
+        add_to_cat = np.zeros(len(sne_images), dtype=bool)
+        sn_magnorm = np.zeros(len(sne_images), dtype=float)
+        sn_fname = np.empty(len(sne_images), dtype=object)
+        sn_param_dicts = []
+        with self.profiler.phase('sn_sed'):
+            for first, n in zip(np.cumsum(n_img) - n_img, n_img):
+                images = slice(first, first + n)
+                (add_to_cat[images], sn_magnorm[images],
+                 sn_fname[images], system_dicts) = self.create_sn_system_seds(self.sne_catalog.iloc[img_sne[images]],
+                                                                              sne_images[defs['raJ2000']][images],
+                                                                              sne_images[defs['decJ2000']][images],
+                                                                              self.visit_mjd,
+                                                                              write_sn_sed=self.write_sn_sed)
+                sn_param_dicts.extend(system_dicts)
+
+        if self.store_sn_truth_params and len(sne_images) > 0:
+            add_to_cat[:] = True
+            with self.profiler.phase('json'):
+                truth_params = [json.dumps(pp) for pp in sn_param_dicts]
+            self._set_columns(sne_images, slice(None),
+                              (('galaxyAgn_sn_truth_params', truth_params),
+                               ('galaxyAgn_sn_t0', [pp['t0'] for pp in sn_param_dicts])))
+
+        with self.profiler.phase('row_construction'):
+            mag_adjust = 2.5*np.log10(np.abs(self.sne_catalog['mu'].values[img_sne]))
+            self._set_columns(sne_images, slice(None),
+                              (('galaxyAgn_sedFilename', sn_fname),
+                               ('galaxyAgn_magNorm', sn_magnorm - mag_adjust)))
+            self._set_is_sprinkled(sne_images, slice(None))
+        kept = np.where(add_to_cat)[0]
+        if len(kept) < len(sne_images):
+            with self.profiler.phase('concatenate'):
+                sne_images[:len(kept)] = sne_images[kept]
+        self.profiler.count('sne_images', len(kept))
+        return len(kept)
+
+    def _assign_agn_hosts(self, input_catalog, valid_agn):
+        """
+        Return the rows of input_catalog that get a lensed AGN and the
+        indices in self.lenscat of their lens systems
+        """
+        if self.cached_sprinkling:
+            # every valid host is in the cache, so this is a single join
+            with self.profiler.phase('cache_join'):
+                agn_lenses = self._cached_agn_lenses(input_catalog[self._galid_columns()[0]][valid_agn])
+            self.profiler.count('agn_systems_placed', len(agn_lenses))
+            return np.array(valid_agn, dtype=int), np.array(agn_lenses, dtype=int)
+
+        # find the lens candidates of all the AGN hosts at once
+        with self.profiler.phase('candidate_search'):
+            offsets, candidates = self.lens_index.query(input_catalog[self.defs_dict['galaxyAgn_redshift']][valid_agn],
+                                                        input_catalog[self.defs_dict['galaxyAgn_magNorm']][valid_agn])
+            agn_hosts = []
+            agn_lenses = []
+            for i_host, rowNum in enumerate(valid_agn):
+                lens_dex = self._assign_agn_lens(input_catalog[rowNum],
+                                                 candidates[offsets[i_host]:offsets[i_host+1]])
+                if lens_dex is not None:
+                    agn_hosts.append(rowNum)
+                    agn_lenses.append(lens_dex)
+        self.profiler.count('agn_systems_placed', len(agn_lenses))
+        return np.array(agn_hosts, dtype=int), np.array(agn_lenses, dtype=int)
+
+    def _assign_sne_hosts(self, input_catalog, valid_sne):
+        """
+        Return the rows of input_catalog that get a lensed SN and the
+        twinkles_sysno of their systems
+        """
+        sne_systems, chosen = self._choose_sne_systems(input_catalog[self._galid_columns()[0]][valid_sne],
+                                                       input_catalog[self.defs_dict['galaxyDisk_redshift']][valid_sne])
+        self.profiler.count('sne_systems_placed', len(sne_systems))
+        return np.array(valid_sne[chosen], dtype=int), np.array(sne_systems, dtype=int)
+
+    def _choose_sne_systems(self, galtileids, galz):
+        """
+        Return the twinkles_sysno of the SN systems placed in the eligible
+        hosts galtileids at redshifts galz, in order, and a mask of the
+        hosts that get one.  The systems come from self.sne_reservation if
+        it is set, from the SNe cache when sprinkling with the cache and
+        from self.sne_assigner otherwise.
+        """
+        galtileids = np.asarray(galtileids)
+        if self.sne_reservation is not None:
+            with self.profiler.phase('cache_join'):
+                return self.sne_reservation.lookup(galtileids)
+
+        if self.cached_sprinkling:
+            with self.profiler.phase('cache_join'):
+                sne_systems, in_cache = self._cached_sne_systems(galtileids)
+                self.sne_assigner.mark_used(sne_systems)
+            return sne_systems, in_cache
+
+        with self.profiler.phase('candidate_search'):
+            sne_systems = []
+            chosen = np.zeros(len(galtileids), dtype=bool)
+            for i_host in range(len(galtileids)):
+                use_system = self.sne_assigner.choose(galtileids[i_host], galz[i_host])
+                if use_system is not None:
+                    chosen[i_host] = True
+                    sne_systems.append(use_system)
+        return np.array(sne_systems, dtype=int), chosen
+
+    def propose_sne_hosts(self, input_catalog):
+        """
+        Return the galtileids and redshifts of the rows of input_catalog
+        that are eligible to host a lensed SN, in row order.  This is the
+        first step of sharded sprinkling (see
+        desc.twinkles.sharded_sprinkler).
+        """
+        _, valid_sne = self._valid_host_rows(input_catalog)
+        return (np.array(input_catalog[self._galid_columns()[0]][valid_sne]),
+                np.array(input_catalog[self.defs_dict['galaxyDisk_redshift']][valid_sne]))
+
+    def reserve_sne_systems(self, galtileids, galz):
+        """
+        Assign SN systems to the eligible hosts galtileids at redshifts
+        galz, as sprinkling them in this order would, and return the
+        assignments as a `SNReservationTable`.  The systems are marked as
+        used as they would be by sprinkling.
+        """
+        sne_systems, chosen = self._choose_sne_systems(galtileids, galz)
+        return SNReservationTable(np.asarray(galtileids)[chosen], sne_systems)
+
+    def _sprinkle_batch(self, input_catalog, catalog_band):
+        """
+        Columnar implementation of sprinkle().  The lens systems are first
+        assigned to their hosts, which fixes the size of the output: the
+        input rows followed by NIMG images per system.  The output is
+        allocated once, the lensed images are built in place from the
+        host rows and the host rows are then overwritten with the lens
+        galaxies, all as whole-column operations.  input_catalog itself is
+        not modified.
+        """
+        valid_agn, valid_sne = self._valid_host_rows(input_catalog)
+        agn_hosts, agn_lenses = self._assign_agn_hosts(input_catalog, valid_agn)
+        sne_hosts, sne_systems = self._assign_sne_hosts(input_catalog, valid_sne)
+
+        # join the SN systems to the rows of their images
+        with self.profiler.phase('cache_join'):
+            start, end = self._sne_system_bounds(sne_systems)
+            n_sne_img = end - start
+            img_sne = self._sne_system_index.rows[np.repeat(start, n_sne_img) +
+                                                  self._image_numbers(n_sne_img)]
+        n_agn_img = self.lenscat['NIMG'][agn_lenses].astype(int)
+
+        n_in = len(input_catalog)
+        n_agn_out = n_agn_img.sum()
+        with self.profiler.phase('concatenate'):
+            output = self._new_output(input_catalog, n_in + n_agn_out + n_sne_img.sum())
+        hosts = output[:n_in]
+
+        with self.profiler.phase('row_construction'):
+            self._agn_images(hosts, agn_hosts, agn_lenses, n_agn_img,
+                             output[n_in:n_in+n_agn_out])
+        self.profiler.count('agn_images', n_agn_out)
+        # SN images without flux at the visit are dropped, which leaves
+        # unused rows at the end of the buffer
+        n_sne_out = self._sne_images(hosts, sne_hosts, sne_systems, img_sne,
+                                     n_sne_img, output[n_in+n_agn_out:])
+        with self.profiler.phase('row_construction'):
+            if len(agn_hosts) > 0:
+                self._overwrite_agn_hosts(hosts, agn_hosts, agn_lenses, catalog_band)
+            if len(sne_hosts) > 0:
+                self._overwrite_sne_hosts(hosts, sne_hosts,
+                                          self._sne_system_index.rows[start],
+                                          catalog_band)
+
+        self._record_chunk_memory(n_in, int(n_in + n_agn_out + n_sne_out), output.nbytes)
+        return output[:n_in + n_agn_out + n_sne_out]
+
+    def _record_chunk_memory(self, rows_in, rows_out, buffer_bytes):
+        """
+        Record the memory used to sprinkle a chunk in self.chunk_memory and
+        the largest output buffer so far in self.max_buffer_bytes.  The
+        resident set size recorded is the peak of the process so far, not
+        that of the chunk.
+        """
+        self.chunk_memory = {'rows_in': rows_in, 'rows_out': rows_out,
+                             'buffer_bytes': buffer_bytes,
+                             'process_peak_rss_bytes': _peak_rss_bytes()}
+        self.max_buffer_bytes = max(getattr(self, 'max_buffer_bytes', 0), buffer_bytes)
+
+    def memory_report(self):
+        """
+        Return a one line summary of the memory used by the last chunk,
+        with the peak resident set size of the process so far
+        """
+        if getattr(self, 'chunk_memory', None) is None:
+            return 'sprinkler: no chunk sprinkled in batch mode yet'
+        mem = self.chunk_memory
+        return ('sprinkler: %d rows in, %d rows out, output buffer %.1f MB '
+                '(max %.1f MB), process peak RSS %.1f MB' %
+                (mem['rows_in'], mem['rows_out'], mem['buffer_bytes']/2.**20,
+                 self.max_buffer_bytes/2.**20, mem['process_peak_rss_bytes']/2.**20))
+
     def find_lens_candidates(self, galz, gal_mag):
         # search the OM10 catalog for all sources +- 0.1 dex in redshift
         # and within .25 mags of the CATSIM source
-        w = np.where((np.abs(np.log10(self.lenscat['ZSRC']) - np.log10(galz)) <= 0.1) &
-                     (np.abs(self.src_mag_norm - gal_mag) <= .25))[0]
+        w = np.sort(self.lens_index.candidates(galz, gal_mag))
         lens_candidates = self.lenscat[w]
 
         return lens_candidates
@@ -536,10 +1233,8 @@ class sprinkler():
                 sn_name = 'specFileGLSN_%i_%i_%.4f.txt' % (system_df['twinkles_sysno'],
                                                            system_df['imno'], sed_mjd)
                 sed_filename = '%s/%s' % (self.sed_path, sn_name)
-                sn_sed_obj.writeSED(sed_filename)
-                with open(sed_filename, 'rb') as f_in, gzip.open(str(sed_filename + '.gz'), 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-                os.remove(sed_filename)
+                self.sed_writer.write(sed_filename, sn_sed_obj.wavelen,
+                                      sn_sed_obj.flambda)
         else:
             add_to_cat = False
             sn_magnorm = np.nan
@@ -548,6 +1243,52 @@ class sprinkler():
 
         return add_to_cat, sn_magnorm, sn_name, current_sn_obj.SNstate
 
+    def create_sn_system_seds(self, system_df, sn_ra, sn_dec, sed_mjd,
+                              write_sn_sed=True):
+        """
+        create_sn_sed for all the images of a lensed SN system at once.
+        The SN model is built and evaluated once for the system instead of
+        once per image.
+
+        Parameters
+        ----------
+        system_df : `pandas.DataFrame`
+            the rows of self.sne_catalog of the images of the system
+        sn_ra, sn_dec : array_like
+            positions of the images in radians
+        sed_mjd : float
+            MJD of the visit
+        write_sn_sed : bool, optional, defaults to True
+            write the SEDs of the images with flux at sed_mjd
+
+        Returns
+        -------
+        add_to_cat, sn_magnorm, sn_name, sn_param_dict : lists with one
+        entry per image, as returned by create_sn_sed
+        """
+        system_sed = SNSystemSED(self.sn_obj, system_df)
+        sn_param_dicts = system_sed.set_positions(sn_ra, sn_dec)
+        wavelen = np.arange(30., 1800., 0.1)
+        flambda = system_sed.flambda(sed_mjd, wavelen)
+        flux_500 = flambda[:, np.where(wavelen >= 499.99)[0][0]]
+
+        add_to_cat = flux_500 > 0.
+        sn_magnorm = np.full(len(system_df), np.nan)
+        sn_name = [None]*len(system_df)
+        visible = np.where(add_to_cat)[0]
+        if len(visible) > 0:
+            sn_magnorm[visible] = system_sed.band_mags(sed_mjd, self.imSimBand,
+                                                       images=visible)
+        if write_sn_sed:
+            for i_img in visible:
+                image = system_df.iloc[i_img]
+                sn_name[i_img] = 'specFileGLSN_%i_%i_%.4f.txt' % (image['twinkles_sysno'],
+                                                                  image['imno'], sed_mjd)
+                sed_filename = '%s/%s' % (self.sed_path, sn_name[i_img])
+                self.sed_writer.write(sed_filename, wavelen, flambda[i_img])
+
+        return list(add_to_cat), list(sn_magnorm), sn_name, sn_param_dicts
+
     def update_catsim(self):
         # Remove the catsim object
         # Add lensed images to the catsim given source brightness and magnifications
@@ -557,3 +1298,137 @@ class sprinkler():
     def catsim_to_phosim(self):
         # Pass this catsim to phosim to make images
         return
+
+
+class SprinklerRegistry(object):
+    """
+    Process-wide store of initialized sprinklers, so that the OM10 and SNe
+    catalogs, bandpasses, cache files and defs file are loaded once rather
+    than once per result chunk.
+
+    Sprinklers are keyed by the columns of the catalog they sprinkle, the
+    directory the SN SEDs go to and the keyword arguments passed to the
+    sprinkler constructor.  A sprinkler handed back by get() has its
+    visit_mjd set to the requested visit and its record of used SN systems
+    cleared, which is all the per-chunk state a new instance would have.
+
+    Attributes
+    ----------
+    hits : int
+        number of requests served by an existing sprinkler
+    misses : int
+        number of requests that had to construct a sprinkler
+    init_time : float
+        total time in seconds spent constructing sprinklers
+    """
+    def __init__(self):
+        self._sprinklers = {}
+        self.hits = 0
+        self.misses = 0
+        self.init_time = 0.0
+
+    @staticmethod
+    def key(catsim_cat, specFileMap, sed_path, **kwargs):
+        """
+        Return the registry key of a sprinkler configuration
+        """
+        return (tuple(catsim_cat.dtype.names),
+                specFileMap.subdir_map['(^specFileGLSN)'],
+                sed_path,
+                tuple(sorted(kwargs.items())))
+
+    def get(self, catsim_cat, visit_mjd, specFileMap, sed_path, **kwargs):
+        """
+        Return a sprinkler for this configuration and visit, constructing
+        it only if the registry does not hold one yet.  The arguments are
+        those of the sprinkler constructor.
+        """
+        key = self.key(catsim_cat, specFileMap, sed_path, **kwargs)
+        if key in self._sprinklers:
+            self.hits += 1
+            sp = self._sprinklers[key]
+            sp.visit_mjd = visit_mjd
+            sp.used_systems = []
+            return sp
+
+        t_start = time.time()
+        sp = sprinkler(catsim_cat, visit_mjd, specFileMap, sed_path, **kwargs)
+        self.init_time += time.time() - t_start
+        self.misses += 1
+        self._sprinklers[key] = sp
+        return sp
+
+    def __len__(self):
+        return len(self._sprinklers)
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of requests served by an existing sprinkler
+        """
+        n_requests = self.hits + self.misses
+        if n_requests == 0:
+            return 0.0
+        return self.hits/n_requests
+
+    @property
+    def time_saved(self):
+        """
+        Estimated initialization time in seconds saved by reusing
+        sprinklers, i.e. hits times the mean construction time
+        """
+        if self.misses == 0:
+            return 0.0
+        return self.hits*self.init_time/self.misses
+
+    def stats(self):
+        """
+        Return a dict summarizing the use of the registry
+        """
+        return {'sprinklers': len(self),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+                'init_time': self.init_time,
+                'time_saved': self.time_saved}
+
+    def clear(self):
+        """
+        Close and drop all the sprinklers and reset the counters
+        """
+        sprinklers = self._sprinklers
+        self._sprinklers = {}
+        self.hits = 0
+        self.misses = 0
+        self.init_time = 0.0
+        for sp in sprinklers.values():
+            sp.close()
+
+
+# the registry used by the CatalogDBObjects that deploy the sprinkler;
+# its sprinklers are closed at exit so that no SN SED is left unwritten
+sprinkler_registry = SprinklerRegistry()
+atexit.register(sprinkler_registry.clear)
+
+
+def _peak_rss_bytes():
+    """
+    Peak resident set size of the process since it started, in bytes, or
+    0 where the resource module is not available
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak
+    return peak*1024
+
+
+def get_sprinkler(catsim_cat, visit_mjd, specFileMap, sed_path, **kwargs):
+    """
+    Return a sprinkler from the process-wide sprinkler_registry.  See
+    SprinklerRegistry.get()
+    """
+    return sprinkler_registry.get(catsim_cat, visit_mjd, specFileMap,
+                                  sed_path, **kwargs)
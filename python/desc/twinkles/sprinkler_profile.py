@@ -0,0 +1,197 @@
+"""
+Phase timers and counters for the sprinkler.
+
+The sprinkler wraps each of its phases in SprinklerProfiler.phase() and
+reports what it sees and places with SprinklerProfiler.count().  When the
+profiler is disabled both are no-ops, so the instrumentation can stay in
+the per-row loops.  Phases may nest: the time of a phase excludes that of
+the phases inside it, so the phase times of a chunk add up to (at most)
+its wall time.
+"""
+from __future__ import absolute_import, division
+import timeit
+
+__all__ = ['SprinklerProfiler', 'sprinkler_phases', 'sprinkler_counters']
+
+# the phases timed by the sprinkler
+sprinkler_phases = ('om10_load', 'magnorm_precompute', 'candidate_search',
+                    'cache_join', 'row_construction', 'json', 'sn_sed',
+                    'concatenate')
+
+# the counters kept by the sprinkler
+sprinkler_counters = ('agn_hosts_seen', 'sne_hosts_seen',
+                      'agn_systems_placed', 'sne_systems_placed',
+                      'agn_images', 'sne_images')
+
+
+class _NullPhase(object):
+    """
+    The context manager handed out by a disabled profiler
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class _Phase(object):
+    """
+    Context manager timing one phase of a SprinklerProfiler
+    """
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.child_time = 0.0
+
+    def __enter__(self):
+        self.profiler._stack.append(self)
+        self.t_start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = timeit.default_timer() - self.t_start
+        stack = self.profiler._stack
+        stack.pop()
+        if stack:
+            stack[-1].child_time += elapsed
+        phases = self.profiler._record['phases']
+        phases[self.name] = phases.get(self.name, 0.0) + elapsed - self.child_time
+        return False
+
+
+def _new_record():
+    return {'phases': dict((name, 0.0) for name in sprinkler_phases),
+            'counters': dict((name, 0) for name in sprinkler_counters)}
+
+
+def _add_record(total, record):
+    for key in ('phases', 'counters'):
+        for name, value in record[key].items():
+            total[key][name] = total[key].get(name, 0) + value
+
+
+class SprinklerProfiler(object):
+    """
+    Timers and counters of the phases of a sprinkler, summarized per
+    catalog chunk and per visit.
+
+    Parameters
+    ----------
+    enabled : bool, optional, defaults to False
+        whether anything is recorded
+
+    Attributes
+    ----------
+    init : dict
+        phase times of the sprinkler construction
+    last_chunk : dict or None
+        summary of the last chunk, see chunk_summary()
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._stack = []
+        self.init = _new_record()
+        self._record = self.init
+        self.last_chunk = None
+        self._visits = {}
+        self._visit_order = []
+        self._chunk_start = None
+
+    def phase(self, name):
+        """
+        Return a context manager adding the time spent in it to phase name
+        """
+        if not self.enabled:
+            return _null_phase
+        return _Phase(self, name)
+
+    def count(self, name, n=1):
+        """
+        Add n to counter name
+        """
+        if self.enabled:
+            counters = self._record['counters']
+            counters[name] = counters.get(name, 0) + int(n)
+
+    def start_chunk(self, visit_mjd, rows_in):
+        """
+        Start recording a chunk of rows_in rows sprinkled for visit_mjd
+        """
+        if not self.enabled:
+            return
+        self._record = _new_record()
+        self._record['visit_mjd'] = visit_mjd
+        self._record['rows_in'] = rows_in
+        self._chunk_start = timeit.default_timer()
+
+    def end_chunk(self, rows_out):
+        """
+        Finish the chunk started by start_chunk(), which produced rows_out
+        rows, and add it to the summary of its visit
+        """
+        if not self.enabled or self._chunk_start is None:
+            return
+        record = self._record
+        record['rows_out'] = rows_out
+        record['wall_time'] = timeit.default_timer() - self._chunk_start
+        self._chunk_start = None
+        self.last_chunk = record
+
+        visit_mjd = record['visit_mjd']
+        if visit_mjd not in self._visits:
+            self._visits[visit_mjd] = dict(_new_record(), visit_mjd=visit_mjd,
+                                           chunks=0, rows_in=0, rows_out=0,
+                                           wall_time=0.0)
+            self._visit_order.append(visit_mjd)
+        visit = self._visits[visit_mjd]
+        _add_record(visit, record)
+        visit['chunks'] += 1
+        visit['rows_in'] += record['rows_in']
+        visit['rows_out'] += rows_out
+        visit['wall_time'] += record['wall_time']
+        # anything recorded between chunks is not attributed to one
+        self._record = _new_record()
+
+    def chunk_summary(self):
+        """
+        Return the summary of the last chunk: a dict with its visit_mjd,
+        rows_in, rows_out, wall_time and the dicts of phase times
+        ('phases') and counters ('counters'), or None if no chunk was
+        recorded
+        """
+        return self.last_chunk
+
+    def visit_summary(self, visit_mjd=None):
+        """
+        Return the summary of visit_mjd (defaults to the last visit
+        recorded): the phase times, counters, rows and wall time of its
+        chunks added up, with the number of chunks in 'chunks'
+        """
+        if visit_mjd is None:
+            if not self._visit_order:
+                return None
+            visit_mjd = self._visit_order[-1]
+        return self._visits.get(visit_mjd)
+
+    def summary(self):
+        """
+        Return the construction phase times ('init') and the list of the
+        visit summaries ('visits') in the order the visits were first seen
+        """
+        return {'init': self.init,
+                'visits': [self._visits[mjd] for mjd in self._visit_order]}
+
+    def reset(self):
+        """
+        Forget all the chunks and visits, keeping the construction times
+        """
+        self._stack = []
+        self._record = _new_record()
+        self.last_chunk = None
+        self._visits = {}
+        self._visit_order = []
+        self._chunk_start = None
@@ -0,0 +1,281 @@
+"""
+Precomputed sprinkling plans.
+
+Which galaxies host a lens system, the values the sprinkler writes into
+the hosts and the lensed images it adds only depend on the galaxies, the
+lens catalogs and the band of the visit.  Only the SEDs of the lensed SNe
+(which images are visible, their magNorms and SED files) depend on the
+visit MJD; the AGN time delays are carried by the images' variability
+parameters and applied by the variability mixins.
+
+A SprinklingPlan records the static part once, as columns of the host and
+image rows, and applies it to the chunks of any visit with a join on
+galtileid plus the SN SEDs of that visit.  The result is identical to
+sprinkling the chunk, provided the chunk's galaxies are the ones the plan
+was built from (as is the case for the galaxy cache).
+"""
+from __future__ import absolute_import, division
+import json
+import numpy as np
+from .lens_candidates import SortedKeyIndex
+from .var_params import agn_var_param_fields, var_param_column
+
+__all__ = ['SprinklingPlan']
+
+# bump this if the content of the plan files changes
+_plan_version = 1
+
+# host and image kinds
+_agn = 0
+_sne = 1
+
+# order of the bands of the lens galaxy magNorms
+_bands = 'ugrizy'
+
+
+class SprinklingPlan(object):
+    """
+    The hosts and lensed images a sprinkler adds to a set of galaxies, as
+    built by SprinklingPlan.build() or read by SprinklingPlan.read().
+
+    Attributes
+    ----------
+    columns : list of str
+        the catalog columns the sprinkler writes, which the plan holds
+    host_galtileid : `numpy.ndarray`
+        galtileid of the hosts
+    host_kind : `numpy.ndarray`
+        0 for the hosts of a lensed AGN, 1 for those of a lensed SN
+    host_system : `numpy.ndarray`
+        twinklesId or twinkles_sysno of the system of each host
+    host_n_img : `numpy.ndarray`
+        number of images of each host; the images of host i are
+        host_img_start[i]:host_img_start[i] + host_n_img[i]
+    host_band_mag_norm : `numpy.ndarray`
+        (host, ugrizy) magNorms of the lens galaxies
+    host_columns, image_columns : dict
+        values of columns in the host and image rows
+    image_sne_row : `numpy.ndarray`
+        row of the SNe catalog of each image, -1 for AGN images
+    """
+    def __init__(self, columns, host_galtileid, host_kind, host_system,
+                 host_n_img, host_band_mag_norm, host_columns, image_columns,
+                 image_sne_row, typed_var_params=False):
+        self.columns = list(columns)
+        self.host_galtileid = np.asarray(host_galtileid, dtype=np.int64)
+        self.host_kind = np.asarray(host_kind, dtype=int)
+        self.host_system = np.asarray(host_system, dtype=np.int64)
+        self.host_n_img = np.asarray(host_n_img, dtype=int)
+        self.host_img_start = np.cumsum(self.host_n_img) - self.host_n_img
+        self.host_band_mag_norm = np.asarray(host_band_mag_norm, dtype=float)
+        self.host_columns = host_columns
+        self.image_columns = image_columns
+        self.image_sne_row = np.asarray(image_sne_row, dtype=int)
+        self.typed_var_params = typed_var_params
+        self._host_index = SortedKeyIndex(self.host_galtileid)
+        if len(self._host_index.unique_keys) != len(self.host_galtileid):
+            raise ValueError('a galaxy can only host one lens system')
+
+    def __len__(self):
+        return len(self.host_galtileid)
+
+    @property
+    def n_images(self):
+        return len(self.image_sne_row)
+
+    @staticmethod
+    def plan_columns(sp, dtype):
+        """
+        Return the columns of a catalog with dtype that sprinkler sp can
+        write: those named in its defs file and the typed variability
+        parameters.  The other columns of the images are copies of their
+        hosts'.
+        """
+        defined = set()
+        for key, value in sp.defs_dict.items():
+            if key in ('pars', 'varMethodName'):
+                continue
+            defined.update(value if isinstance(value, tuple) else (value,))
+        var_col = sp.defs_dict['galaxyAgn_varParamStr']
+        defined.update(var_param_column(var_col, field) for field, _ in agn_var_param_fields)
+        return [name for name in dtype.names if name in defined]
+
+    @classmethod
+    def build(cls, sp, chunks, catalog_band='r'):
+        """
+        Build the plan of sprinkler sp for the catalog chunks, assigning
+        the lens systems as sp.sprinkle() would.
+
+        Parameters
+        ----------
+        sp : `desc.twinkles.sprinkler`
+            the sprinkler, configured as it will be when the plan is
+            applied
+        chunks : iterable of `numpy.ndarray`
+            the chunks of the galaxy catalog
+        catalog_band : str
+            band used for the values recorded in the host columns; the
+            magNorms of the lens galaxies are recorded in every band
+        """
+        parts = []
+        columns = None
+        for chunk in chunks:
+            chunk = sp._with_var_param_columns(chunk)
+            if columns is None:
+                columns = cls.plan_columns(sp, chunk.dtype)
+            parts.append(cls._build_chunk(sp, chunk, catalog_band, columns))
+        if len(parts) == 0:
+            raise ValueError('cannot build a sprinkling plan without chunks')
+
+        def concatenate(field):
+            return np.concatenate([part[field] for part in parts])
+
+        host_columns = dict((name, np.concatenate([part['host_columns'][name] for part in parts]))
+                            for name in columns)
+        image_columns = dict((name, np.concatenate([part['image_columns'][name] for part in parts]))
+                             for name in columns)
+        return cls(columns, concatenate('host_galtileid'), concatenate('host_kind'),
+                   concatenate('host_system'), concatenate('host_n_img'),
+                   concatenate('host_band_mag_norm'), host_columns, image_columns,
+                   concatenate('image_sne_row'), typed_var_params=sp.typed_var_params)
+
+    @staticmethod
+    def _build_chunk(sp, chunk, catalog_band, columns):
+        valid_agn, valid_sne = sp._valid_host_rows(chunk)
+        agn_hosts, agn_lenses = sp._assign_agn_hosts(chunk, valid_agn)
+        sne_hosts, sne_systems = sp._assign_sne_hosts(chunk, valid_sne)
+        start, end = sp._sne_system_bounds(sne_systems)
+        n_sne_img = end - start
+        first_rows = sp._sne_system_index.rows[start]
+        img_sne = sp._sne_system_index.rows[np.repeat(start, n_sne_img) +
+                                            sp._image_numbers(n_sne_img)]
+        n_agn_img = sp.lenscat['NIMG'][agn_lenses].astype(int)
+        n_agn_out = n_agn_img.sum()
+
+        images = np.empty(n_agn_out + n_sne_img.sum(), dtype=chunk.dtype)
+        sp._agn_images(chunk, agn_hosts, agn_lenses, n_agn_img, images[:n_agn_out])
+        sp._sne_image_rows(chunk, sne_hosts, sne_systems, img_sne, n_sne_img,
+                           images[n_agn_out:])
+
+        n_agn = len(agn_hosts)
+        hosts = chunk[np.concatenate((agn_hosts, sne_hosts)).astype(int)]
+        sp._overwrite_agn_hosts(hosts, np.arange(n_agn), agn_lenses, catalog_band)
+        sp._overwrite_sne_hosts(hosts, np.arange(n_agn, len(hosts)), first_rows,
+                                catalog_band)
+
+        band_mag_norm = np.zeros((len(hosts), len(_bands)), dtype=float)
+        for band in _bands:
+            band_dex = _bands.index(band)
+            band_mag_norm[:n_agn, band_dex] = sp.lenscat['sed_magNorm'][agn_lenses,
+                                                                         sp.lsst_band_indexes[band]]
+            band_mag_norm[n_agn:, band_dex] = sp.sne_catalog['lensgal_magnorm_%s' % band].values[first_rows]
+
+        return {'host_galtileid': hosts[sp._galid_columns()[0]],
+                'host_kind': np.concatenate((np.full(n_agn, _agn, dtype=int),
+                                             np.full(len(sne_hosts), _sne, dtype=int))),
+                'host_system': np.concatenate((sp.lenscat['twinklesId'][agn_lenses],
+                                               sne_systems)).astype(np.int64),
+                'host_n_img': np.concatenate((n_agn_img, n_sne_img)).astype(int),
+                'host_band_mag_norm': band_mag_norm,
+                'host_columns': dict((name, hosts[name]) for name in columns),
+                'image_columns': dict((name, images[name]) for name in columns),
+                'image_sne_row': np.concatenate((np.full(n_agn_out, -1, dtype=int),
+                                                 img_sne)).astype(int)}
+
+    def apply(self, sp, input_catalog, catalog_band):
+        """
+        Sprinkle input_catalog for the visit of sprinkler sp, which must
+        be configured as the sprinkler the plan was built with: the hosts
+        in the plan are overwritten and their images appended, followed by
+        the SN images visible at sp.visit_mjd.  input_catalog is not
+        modified.
+        """
+        if self.typed_var_params != sp.typed_var_params:
+            raise ValueError('the sprinkling plan was built with typed_var_params=%s '
+                             'but the sprinkler has typed_var_params=%s'
+                             % (self.typed_var_params, sp.typed_var_params))
+        defs = sp.defs_dict
+        profiler = sp.profiler
+        with profiler.phase('cache_join'):
+            plan_rows = self._host_index.first(input_catalog[sp._galid_columns()[0]])
+            in_plan = np.where(plan_rows >= 0)[0]
+            agn = self.host_kind[plan_rows[in_plan]] == _agn
+            host_rows = np.concatenate((in_plan[agn], in_plan[~agn]))
+            plan_hosts = plan_rows[host_rows]
+            n_agn = agn.sum()
+
+            # images of the hosts, in the order sprinkle() appends them
+            n_img = self.host_n_img[plan_hosts]
+            plan_images = (np.repeat(self.host_img_start[plan_hosts], n_img) +
+                           sp._image_numbers(n_img))
+            n_agn_out = n_img[:n_agn].sum()
+        for counter, value in (('agn_hosts_seen', n_agn),
+                               ('sne_hosts_seen', len(host_rows) - n_agn),
+                               ('agn_systems_placed', n_agn),
+                               ('sne_systems_placed', len(host_rows) - n_agn),
+                               ('agn_images', n_agn_out)):
+            profiler.count(counter, value)
+
+        n_in = len(input_catalog)
+        with profiler.phase('concatenate'):
+            output = sp._new_output(input_catalog, n_in + len(plan_images))
+        images = output[n_in:]
+        with profiler.phase('row_construction'):
+            np.take(output[:n_in], np.repeat(host_rows, n_img), out=images)
+            for name in self.columns:
+                images[name] = self.image_columns[name][plan_images]
+        n_sne_out = sp._sne_image_seds(images[n_agn_out:],
+                                       self.image_sne_row[plan_images[n_agn_out:]],
+                                       n_img[n_agn:])
+
+        with profiler.phase('row_construction'):
+            for name in self.columns:
+                output[name][host_rows] = self.host_columns[name][plan_hosts]
+            output[defs['galaxyBulge_magNorm']][host_rows] = \
+                self.host_band_mag_norm[plan_hosts, _bands.index(catalog_band)]
+        if sp.cached_sprinkling:
+            sp.sne_assigner.mark_used(self.host_system[plan_hosts[n_agn:]])
+
+        n_out = n_in + n_agn_out + n_sne_out
+        sp._record_chunk_memory(n_in, int(n_out), output.nbytes)
+        return output[:n_out]
+
+    def write(self, file_name):
+        """
+        Write the plan to the .npz file file_name
+        """
+        meta = {'version': _plan_version, 'columns': self.columns,
+                'typed_var_params': self.typed_var_params}
+        arrays = {'meta': np.array(json.dumps(meta)),
+                  'host_galtileid': self.host_galtileid,
+                  'host_kind': self.host_kind,
+                  'host_system': self.host_system,
+                  'host_n_img': self.host_n_img,
+                  'host_band_mag_norm': self.host_band_mag_norm,
+                  'image_sne_row': self.image_sne_row}
+        for i_col, name in enumerate(self.columns):
+            arrays['host_column_%d' % i_col] = self.host_columns[name]
+            arrays['image_column_%d' % i_col] = self.image_columns[name]
+        with open(file_name, 'wb') as output_file:
+            np.savez(output_file, **arrays)
+
+    @classmethod
+    def read(cls, file_name):
+        """
+        Read a plan written by SprinklingPlan.write()
+        """
+        with np.load(file_name, allow_pickle=False) as plan_file:
+            meta = json.loads(str(plan_file['meta']))
+            if meta['version'] != _plan_version:
+                raise RuntimeError('%s is a version %d sprinkling plan; expected version %d'
+                                   % (file_name, meta['version'], _plan_version))
+            columns = meta['columns']
+            host_columns = dict((name, plan_file['host_column_%d' % i_col])
+                                for i_col, name in enumerate(columns))
+            image_columns = dict((name, plan_file['image_column_%d' % i_col])
+                                 for i_col, name in enumerate(columns))
+            return cls(columns, plan_file['host_galtileid'], plan_file['host_kind'],
+                       plan_file['host_system'], plan_file['host_n_img'],
+                       plan_file['host_band_mag_norm'], host_columns, image_columns,
+                       plan_file['image_sne_row'],
+                       typed_var_params=meta['typed_var_params'])
@@ -6,7 +6,7 @@ from lsst.sims.utils import ObservationMetaData
 from lsst.sims.catalogs.db import fileDBObject
 from lsst.sims.catalogs.db import CatalogDBObject, CompoundCatalogDBObject
 from lsst.sims.catUtils.baseCatalogModels import GalaxyObj, GalaxyTileObj
-from desc.twinkles import sprinkler
+from desc.twinkles import get_sprinkler
 
 __all__ = ["_galaxy_cache_db_name",
            "create_galaxy_cache",
@@ -176,6 +176,23 @@ class GalaxyCacheAgnObj(GalaxyCacheBase):
 class GalaxyCacheSprinklerObj(CompoundCatalogDBObject):
     objid = 'galaxyCacheSprinkler'
     objectTypeId = 66
+    mjd = None
+    catalog_band = None
+    specFileMap = None
+    sed_path = None
+    om10_cat = 'twinkles_lenses_v2.fits'
+    sne_cat = 'dc2_sne_cat.csv'
+    cached_sprinkling = False
+    agn_cache_file = None
+    sne_cache_file = None
+    defs_file = None
+    batch_mode = False
+    sed_processes = 0
+    typed_var_params = False
+    render_var_param_json = False
+    plan_file = None
+    profile_sprinkler = False
+
     def _final_pass(self, results):
 
         # the stored procedure on fatboy that queries the galaxies
@@ -189,8 +206,25 @@ class GalaxyCacheSprinklerObj(CompoundCatalogDBObject):
         # the factor of 10^8, making the uniqueIDs a more manageable size
         results['galtileid'] = results['galtileid']%100000000
 
-        #Use Sprinkler now
-        sp = sprinkler(results, density_param = 1.0)
-        results = sp.sprinkle()
+        #Use Sprinkler now; the same instance is reused for every chunk
+        if self.catalog_band is None:
+            raise AttributeError('Must specify catalog_band, the band (one of ugrizy) '
+                                 'of the lens galaxy magNorms, to sprinkle with %s.'
+                                 % self.objid)
+        sp = get_sprinkler(results, self.mjd, self.specFileMap, self.sed_path,
+                           om10_cat=self.om10_cat,
+                           sne_cat=self.sne_cat,
+                           density_param=1.0,
+                           cached_sprinkling=self.cached_sprinkling,
+                           agn_cache_file=self.agn_cache_file,
+                           sne_cache_file=self.sne_cache_file,
+                           defs_file=self.defs_file,
+                           batch_mode=self.batch_mode,
+                           sed_processes=self.sed_processes,
+                           typed_var_params=self.typed_var_params,
+                           render_var_param_json=self.render_var_param_json,
+                           plan_file=self.plan_file,
+                           profile=self.profile_sprinkler)
+        results = sp.sprinkle(results, self.catalog_band)
 
         return results
@@ -9,11 +9,29 @@ from scipy.interpolate import interp1d
 from lsst.sims.catalogs.decorators import register_class, register_method, compound
 from lsst.sims.catUtils.mixins import Variability, ExtraGalacticVariabilityModels
 from lsst.sims.catUtils.mixins.VariabilityMixin import _VariabilityPointSources
+from .var_params import agn_var_param_fields, var_param_column, find_var_param_column
+from .agn_drw import agn_drw_start_date, agn_drw_dmags, agn_ou_dmags
 
 __all__ = ["TimeDelayVariability", "VariabilityTwinkles"]
 
 
 class TimeDelayVariability(Variability):
+    """
+    Variability of the lensed AGN images: damped random walks delayed by
+    the time delay of each image.
+
+    agn_drw_sampler selects how the walks are drawn: 'grid' steps them on
+    a grid of tau/100 days (desc.twinkles.agn_drw.agn_drw_dmags); 'exact'
+    samples the Ornstein-Uhlenbeck process at the requested epochs only
+    (desc.twinkles.agn_drw.agn_ou_dmags), which does not depend on the
+    length of the baseline but draws a different realization.
+
+    If agn_light_curve_store is set to a desc.twinkles.AgnLightCurveStore,
+    the 'grid' walks are read from it and only extended past the steps it
+    holds, instead of being stepped from the start for each visit.
+    """
+    agn_drw_sampler = 'grid'
+    agn_light_curve_store = None
 
     @register_method("applyAgnTimeDelay")
     def applyAgnTimeDelay(self, valid_dexes, params, expmjd,
@@ -38,13 +56,8 @@ class TimeDelayVariability(Variability):
         t_delay_arr = params['t0Delay'].astype(float)
         tau_arr = params['agn_tau'].astype(float)
         sfu_arr = params['agn_sfu'].astype(float)
-        sfg_arr = params['agn_sfg'].astype(float)
-        sfr_arr = params['agn_sfr'].astype(float)
-        sfi_arr = params['agn_sfi'].astype(float)
-        sfz_arr = params['agn_sfz'].astype(float)
-        sfy_arr = params['agn_sfy'].astype(float)
 
-        start_date = 58580.0
+        start_date = agn_drw_start_date
         duration_observer_frame = expmjd_arr.max() - start_date
 
         if duration_observer_frame < 0 or expmjd_arr.min() < start_date:
@@ -53,66 +66,30 @@ class TimeDelayVariability(Variability):
                                "expmjd: %e should be > start_date: %e  " % (expmjd.min(), start_date) +
                                "in applyAgn variability method")
 
-        for i_obj in valid_dexes[0]:
-
-            seed = seed_arr[i_obj]
-            tau = tau_arr[i_obj]
-            time_dilation = 1.0+redshift_arr[i_obj]
-            t_delay = t_delay_arr[i_obj]
-
-            sfint = {}
-            sfint['u'] = sfu_arr[i_obj]
-            sfint['g'] = sfg_arr[i_obj]
-            sfint['r'] = sfr_arr[i_obj]
-            sfint['i'] = sfi_arr[i_obj]
-            sfint['z'] = sfz_arr[i_obj]
-            sfint['y'] = sfy_arr[i_obj]
-
-            rng = np.random.RandomState(seed)
-
-            dt = tau/100.
-            duration_rest_frame = duration_observer_frame/time_dilation
-            nbins = int(math.ceil(duration_rest_frame/dt))+1
-
-            time_dexes = np.round((expmjd_arr-start_date-t_delay)/(time_dilation*dt)).astype(int)
-            assert time_dexes.min() >= 0
-
-            time_dex_map = {}
-            ct_dex = 0
-            for i_t_dex, t_dex in enumerate(time_dexes):
-                if t_dex in time_dex_map:
-                    time_dex_map[t_dex].append(i_t_dex)
-                else:
-                    time_dex_map[t_dex] = [i_t_dex]
-            time_dexes = set(time_dexes)
-
-            dx2 = 0.0
-            x1 = 0.0
-            x2 = 0.0
-
-            dt_over_tau = dt/tau
-            es = rng.normal(0., 1., nbins)*math.sqrt(dt_over_tau)
-            for i_time in range(nbins):
-                #The second term differs from Zeljko's equation by sqrt(2.)
-                #because he assumes stdev = sfint/sqrt(2)
-                dx1 = dx2
-                dx2 = -dx1*dt_over_tau + sfint['u']*es[i_time] + dx1
-                x1 = x2
-                x2 += dt
-
-                if i_time in time_dexes:
-                    if isinstance(expmjd, numbers.Number):
-                        dm_val = ((expmjd-start_date-t_delay)*(dx1-dx2)/time_dilation+dx2*x1-dx1*x2)/(x1-x2)
-                        dMags[0][i_obj] = dm_val
-                    else:
-                        for i_time_out in time_dex_map[i_time]:
-                            local_end = (expmjd_arr[i_time_out]-start_date-t_delay)/time_dilation
-                            dm_val = (local_end*(dx1-dx2)+dx2*x1-dx1*x2)/(x1-x2)
-                            dMags[0][i_obj][i_time_out] = dm_val
-
-        for i_filter, filter_name in enumerate(('g', 'r', 'i', 'z', 'y')):
-            for i_obj in valid_dexes[0]:
-                dMags[i_filter+1][i_obj] = dMags[0][i_obj]*params['agn_sf%s' % filter_name][i_obj]/params['agn_sfu'][i_obj]
+        sampler_kwargs = {}
+        if self.agn_drw_sampler == 'grid':
+            sampler = agn_drw_dmags
+            sampler_kwargs['store'] = self.agn_light_curve_store
+        elif self.agn_drw_sampler == 'exact':
+            sampler = agn_ou_dmags
+        else:
+            raise ValueError('unknown agn_drw_sampler %s; expected grid or exact'
+                             % self.agn_drw_sampler)
+
+        # the walks of all the objects are drawn together
+        obj_dexes = valid_dexes[0]
+        dMags[0][obj_dexes] = sampler(seed_arr[obj_dexes], tau_arr[obj_dexes],
+                                      np.asarray(redshift_arr)[obj_dexes],
+                                      t_delay_arr[obj_dexes], sfu_arr[obj_dexes],
+                                      expmjd, start_date=start_date, **sampler_kwargs)
+
+        sf_arr = np.array([params['agn_sf%s' % filter_name][obj_dexes].astype(float)
+                           for filter_name in ('g', 'r', 'i', 'z', 'y')])
+        if isinstance(expmjd, numbers.Number):
+            dMags[1:, obj_dexes] = dMags[0][obj_dexes]*sf_arr/sfu_arr[obj_dexes]
+        else:
+            dMags[1:, obj_dexes] = (dMags[0][obj_dexes]*sf_arr[:, :, None] /
+                                    sfu_arr[obj_dexes][:, None])
 
         return dMags
 
@@ -130,6 +107,47 @@ class VariabilityTwinkles(_VariabilityPointSources, TimeDelayVariability):
     Thus: merely including VariabilityTwinkles in the inheritance tree of
     an InstanceCatalog daughter class will activate variability for any column
     for which delta_columnName is defined.
+
+    If the catalog chunk carries the typed variability columns of
+    desc.twinkles.var_params, the objects with applyAgnTimeDelay take their
+    parameters from those columns instead of parsing varParamStr.  The
+    columns are found under the name of the JSON column they were added
+    for, e.g. varParamStr or galaxyAgn_varParamStr as the sprinkler defs
+    name it.
     """
 
-    pass
+    def _typed_var_params(self):
+        """
+        Return the typed variability method and parameters of the current
+        chunk, or None if it only has the JSON variability column.
+        """
+        chunk = getattr(self, '_current_chunk', None)
+        if chunk is None or not hasattr(chunk, 'dtype'):
+            return None
+        var_col = find_var_param_column(chunk)
+        if var_col is None:
+            return None
+        params = dict((field, chunk[var_param_column(var_col, field)])
+                      for field, _ in agn_var_param_fields[1:])
+        return chunk[var_param_column(var_col, 'method')], params
+
+    def applyVariability(self, varParams_arr, expmjd=None, **kwargs):
+        typed = self._typed_var_params()
+        if typed is None or len(typed[0]) != len(varParams_arr):
+            return super(VariabilityTwinkles, self).applyVariability(varParams_arr,
+                                                                     expmjd=expmjd,
+                                                                     **kwargs)
+        method, params = typed
+        time_delay = (method == 'applyAgnTimeDelay')
+
+        # the other objects still go through their JSON parameters
+        var_strings = np.where(time_delay, 'None', np.asarray(varParams_arr).astype(str))
+        dMags = super(VariabilityTwinkles, self).applyVariability(var_strings,
+                                                                  expmjd=expmjd,
+                                                                  **kwargs)
+        if time_delay.any():
+            if expmjd is None:
+                expmjd = self.obs_metadata.mjd.TAI
+            dMags = dMags + self.applyAgnTimeDelay(np.where(time_delay), params, expmjd,
+                                                   variability_cache=kwargs.get('variability_cache'))
+        return dMags
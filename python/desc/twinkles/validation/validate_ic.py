@@ -13,6 +13,7 @@ from lsst.sims.photUtils import Bandpass, BandpassDict, Sed, getImsimFluxNorm
 from lsst.sims.photUtils import calcSNR_m5, PhotometricParameters
 from lsst.sims.catUtils.supernovae import SNObject
 from lsst.sims.catUtils.mixins.VariabilityMixin import ExtraGalacticVariabilityModels as egvar
+from ..sed_cache import sed_cache
 
 
 __all__ = ['validate_ic']
@@ -854,9 +855,8 @@ class validate_ic(object):
                 magnorm_shld = lens['sed_magNorm'][0][bandpass_int]
                 dmag = lens_gal_df['phosimMagNorm'] - magnorm_shld
             elif bandpass_name == 'i':
-                test_sed = Sed()
-                test_sed.readSED_flambda(os.path.join(galDir,
-                                                      lens_gal_df['sedFilepath']))
+                test_sed = sed_cache.get_sed(os.path.join(galDir,
+                                                          lens_gal_df['sedFilepath']))
 
                 fnorm = getImsimFluxNorm(test_sed, lens_gal_df['phosimMagNorm'])
                 test_sed.multiplyFluxNorm(fnorm)
@@ -1117,9 +1117,8 @@ class validate_ic(object):
                                                        spr_sys_df['redshift'].values[0])
 
 
-                test_sed = Sed()
-                test_sed.readSED_flambda('%s/%s' % (agnDir, 'agn.spec.gz'))
-                test_sed.redshiftSED(lens['ZSRC'])
+                test_sed = sed_cache.get_sed('%s/%s' % (agnDir, 'agn.spec.gz'),
+                                             redshift=lens['ZSRC'].data[0])
                 test_f_norm = getImsimFluxNorm(test_sed, lensed_mags.values[i])
                 test_sed.multiplyFluxNorm(test_f_norm)
                 test_mag = test_sed.calcMag(bandpassDict[visit_band])
@@ -0,0 +1,213 @@
+"""
+Typed representation of the AGN variability parameters.
+
+The catalogs store the variability model of every object as a JSON string
+(varParamStr).  This module carries the same parameters as NumPy columns
+appended to a catalog chunk, named like varParamStr_<field>, so that the
+sprinkler can update them with array operations and the variability
+mixins can read them without parsing JSON.  Only the rows that need them
+are parsed (parse_var_params): the others keep an empty method and their
+parameters in the JSON.  JSON is only rendered back (render_var_params)
+for text catalogs that write varParamStr out.
+"""
+from __future__ import absolute_import, division
+import json
+import numpy as np
+
+__all__ = ['agn_var_param_fields', 'var_param_column', 'has_var_param_columns',
+           'find_var_param_column', 'var_param_dtype', 'add_var_param_columns',
+           'parse_var_params', 'clear_var_params', 'render_var_params']
+
+# the variability method and the parameters of applyAgn and
+# applyAgnTimeDelay; objects without variability have an empty method
+agn_var_param_fields = (('method', 'U32'),
+                        ('seed', np.int64),
+                        ('agn_tau', float),
+                        ('agn_sfu', float),
+                        ('agn_sfg', float),
+                        ('agn_sfr', float),
+                        ('agn_sfi', float),
+                        ('agn_sfz', float),
+                        ('agn_sfy', float),
+                        ('t0Delay', float))
+
+
+def var_param_column(var_col, field):
+    """
+    Name of the typed column holding field of the JSON column var_col
+    """
+    return '%s_%s' % (var_col, field)
+
+
+def has_var_param_columns(catalog, var_col):
+    """
+    Whether the structured array catalog carries the typed columns of
+    var_col
+    """
+    names = catalog.dtype.names or ()
+    return all(var_param_column(var_col, field) in names
+               for field, _ in agn_var_param_fields)
+
+
+def find_var_param_column(catalog):
+    """
+    Return the name of the JSON column whose typed columns the structured
+    array catalog carries (the galaxyAgn_varParamStr entry of the
+    sprinkler defs that added them), or None if it carries none
+    """
+    suffix = var_param_column('', 'method')
+    for name in catalog.dtype.names or ():
+        if name.endswith(suffix):
+            var_col = name[:-len(suffix)]
+            if var_col in catalog.dtype.names and has_var_param_columns(catalog, var_col):
+                return var_col
+    return None
+
+
+def var_param_dtype(dtype, var_col):
+    """
+    Return dtype with the typed columns of var_col appended, or dtype
+    itself if it already has them
+    """
+    if all(var_param_column(var_col, field) in (dtype.names or ())
+           for field, _ in agn_var_param_fields):
+        return dtype
+    return np.dtype(dtype.descr +
+                    [(var_param_column(var_col, field), field_type)
+                     for field, field_type in agn_var_param_fields])
+
+
+def add_var_param_columns(catalog, var_col, method_key='m', pars_key='p', rows=None):
+    """
+    Return a copy of the structured array catalog with the typed columns
+    of var_col appended, filled by parsing each distinct JSON string of
+    the selected rows once.
+
+    Parameters
+    ----------
+    catalog : `numpy.ndarray`
+        structured array with a JSON variability column
+    var_col : str
+        name of the JSON column
+    method_key, pars_key : str
+        keys of the method name and of the parameter dict in the JSON
+        (the 'varMethodName' and 'pars' entries of the sprinkler defs)
+    rows : array_like, optional
+        indices of the rows to parse; defaults to all of them.  The other
+        rows get an empty method: their parameters are those of their
+        JSON, as for the rows without variability.
+    """
+    if has_var_param_columns(catalog, var_col):
+        return catalog
+
+    out_catalog = np.empty(len(catalog), dtype=var_param_dtype(catalog.dtype, var_col))
+    for name in catalog.dtype.names:
+        out_catalog[name] = catalog[name]
+    clear_var_params(out_catalog, var_col)
+    if rows is None:
+        rows = np.arange(len(catalog))
+    parse_var_params(out_catalog, var_col, rows, method_key=method_key, pars_key=pars_key)
+    return out_catalog
+
+
+def parse_var_params(catalog, var_col, rows, method_key='m', pars_key='p'):
+    """
+    Fill the typed columns of var_col of the selected rows of catalog by
+    parsing each distinct JSON string among them once.  The parameters
+    missing from a JSON string are set to 'no variability'.
+
+    Parameters
+    ----------
+    catalog : `numpy.ndarray`
+        structured array carrying the typed columns of var_col
+    var_col : str
+        name of the JSON column
+    rows : array_like
+        indices of the rows to parse
+    method_key, pars_key : str
+        keys of the method name and of the parameter dict in the JSON
+    """
+    rows = np.asarray(rows, dtype=int)
+    if len(rows) == 0:
+        return
+    var_strings, inverse = np.unique(catalog[var_col][rows].astype(str), return_inverse=True)
+    values = dict((field, np.full(len(var_strings), _no_variability_value(field),
+                                  dtype=field_type))
+                  for field, field_type in agn_var_param_fields)
+
+    for i_str, var_str in enumerate(var_strings):
+        if var_str == 'None' or len(var_str) == 0:
+            continue
+        var_dict = json.loads(var_str)
+        values['method'][i_str] = var_dict[method_key]
+        pars = var_dict[pars_key]
+        for field, _ in agn_var_param_fields[1:]:
+            if field in pars:
+                values[field][i_str] = pars[field]
+
+    for field, _ in agn_var_param_fields:
+        catalog[var_param_column(var_col, field)][rows] = values[field][inverse.ravel()]
+
+
+def _no_variability_value(field):
+    # missing parameters are nan, except for the time delay of objects
+    # that are not lensed
+    if field == 'method':
+        return ''
+    if field == 'seed':
+        return 0
+    if field == 't0Delay':
+        return 0.0
+    return np.nan
+
+
+def clear_var_params(catalog, var_col, rows=None):
+    """
+    Set the typed columns of var_col to 'no variability' for the selected
+    rows of catalog, or for all of catalog (a structured array or a single
+    record) if rows is None.
+    """
+    for field, _ in agn_var_param_fields:
+        column = var_param_column(var_col, field)
+        if rows is None:
+            catalog[column] = _no_variability_value(field)
+        else:
+            catalog[column][rows] = _no_variability_value(field)
+
+
+def render_var_params(catalog, var_col, rows=None, method_key='m', pars_key='p'):
+    """
+    Write the JSON column var_col of catalog from its typed columns.  Only
+    the typed fields are rendered: parameters of the original JSON that
+    have no typed column are dropped.
+
+    Parameters
+    ----------
+    catalog : `numpy.ndarray`
+        structured array carrying the typed columns of var_col
+    var_col : str
+        name of the JSON column
+    rows : array_like, optional
+        indices of the rows to render; defaults to all of them
+    method_key, pars_key : str
+        keys of the method name and of the parameter dict in the JSON
+    """
+    if rows is None:
+        rows = np.arange(len(catalog))
+    rows = np.asarray(rows, dtype=int)
+    columns = dict((field, catalog[var_param_column(var_col, field)][rows])
+                   for field, _ in agn_var_param_fields)
+    var_strings = []
+    for i_row in range(len(rows)):
+        method = str(columns['method'][i_row])
+        if len(method) == 0:
+            var_strings.append('None')
+            continue
+        pars = {'seed': int(columns['seed'][i_row])}
+        for field, _ in agn_var_param_fields[2:]:
+            value = columns[field][i_row]
+            if np.isfinite(value):
+                pars[field] = float(value)
+        var_strings.append(json.dumps({method_key: method, pars_key: pars}))
+    if len(rows) > 0:
+        catalog[var_col][rows] = var_strings
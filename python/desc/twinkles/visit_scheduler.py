@@ -0,0 +1,188 @@
+"""
+Submission plans of phoSim visits over a fixed number of batch slots.
+
+OpSimOrdering predicts the phoSim run time of every visit of a run
+partition.  schedule_visits() packs the visits of a partition into the
+slots with the longest processing time first (LPT) rule: the visits are
+taken in decreasing order of predicted time and each one goes to the slot
+that becomes free first.  This is what the batch system does when the
+streams are created in that order, so the order of the plan is the order
+in which the visit list should hand the visits out (the stream number of a
+visit is its line in the visit list, see setupVisit.py), and the plan
+estimates when each visit runs, the makespan of the partition and the use
+made of the slots.  Visits predicted to take longer than the wall-clock
+limit of a job are set aside, and write_visit_list() puts them at the end
+of the visit list in sections of their own.
+"""
+from __future__ import absolute_import, division
+import heapq
+import numpy as np
+
+__all__ = ['SubmissionPlan', 'schedule_visits', 'write_visit_list']
+
+
+class SubmissionPlan(object):
+    """
+    Visits of a run partition in submission order, with the slot and
+    predicted start time of each.
+
+    Attributes
+    ----------
+    obsHistID : `numpy.ndarray`
+        obsHistIDs of the scheduled visits, in submission order
+    predicted : `numpy.ndarray`
+        predicted run time of each visit in hours
+    slot : `numpy.ndarray`
+        slot each visit is predicted to run in
+    start : `numpy.ndarray`
+        predicted start time of each visit in hours
+    n_slots : int
+        number of batch slots
+    wall_clock_limit : float or None
+        wall-clock limit of a job in hours
+    too_long : `numpy.ndarray`
+        obsHistIDs of the visits predicted to take longer than the
+        wall-clock limit, which are not scheduled
+    """
+    def __init__(self, obsHistID, predicted, slot, start, n_slots,
+                 wall_clock_limit=None, too_long=()):
+        self.obsHistID = np.asarray(obsHistID)
+        self.predicted = np.asarray(predicted, dtype=float)
+        self.slot = np.asarray(slot, dtype=int)
+        self.start = np.asarray(start, dtype=float)
+        self.n_slots = n_slots
+        self.wall_clock_limit = wall_clock_limit
+        self.too_long = np.asarray(too_long, dtype=self.obsHistID.dtype)
+
+    def __len__(self):
+        return len(self.obsHistID)
+
+    @property
+    def end(self):
+        """
+        predicted end time of each visit in hours
+        """
+        return self.start + self.predicted
+
+    @property
+    def slot_load(self):
+        """
+        predicted busy time of each slot in hours
+        """
+        return np.bincount(self.slot, weights=self.predicted, minlength=self.n_slots)
+
+    @property
+    def makespan(self):
+        """
+        predicted time in hours until the last visit ends
+        """
+        return self.end.max() if len(self) > 0 else 0.0
+
+    @property
+    def utilization(self):
+        """
+        fraction of the slot time up to the makespan spent running visits
+        """
+        makespan = self.makespan
+        if makespan == 0:
+            return 0.0
+        return self.predicted.sum()/(self.n_slots*makespan)
+
+    def summary(self):
+        """
+        Return a dict with the number of visits scheduled and set aside,
+        the number of slots, the total predicted time, the makespan
+        (hours) and the utilization of the slots
+        """
+        return {'visits': len(self), 'too_long': len(self.too_long),
+                'n_slots': self.n_slots, 'total_time': float(self.predicted.sum()),
+                'makespan': float(self.makespan),
+                'utilization': float(self.utilization)}
+
+
+def schedule_visits(obsHistID, predicted, n_slots, wall_clock_limit=None):
+    """
+    Pack visits into batch slots, longest predicted time first.
+
+    Parameters
+    ----------
+    obsHistID : array_like
+        obsHistIDs of the visits, e.g. the obsHistID column of a run
+        partition of `OpSimOrdering`
+    predicted : array_like
+        predicted run time of each visit in hours, e.g. the
+        predictedPhoSimTimes column of the same partition
+    n_slots : int
+        number of batch slots running visits at the same time
+    wall_clock_limit : float, optional
+        wall-clock limit of a job in hours; longer visits are not
+        scheduled
+
+    Returns
+    -------
+    `SubmissionPlan`; visits with the same predicted time keep their
+    order in obsHistID
+    """
+    if n_slots < 1:
+        raise ValueError('need at least one slot; got %d' % n_slots)
+    obsHistID = np.asarray(obsHistID)
+    predicted = np.asarray(predicted, dtype=float)
+    if obsHistID.shape != predicted.shape:
+        raise ValueError('expected one predicted time per visit')
+    if np.isnan(predicted).any():
+        raise ValueError('the predicted times of %d visits are nan'
+                         % np.isnan(predicted).sum())
+
+    if wall_clock_limit is None:
+        fits = np.ones(len(predicted), dtype=bool)
+    else:
+        fits = predicted <= wall_clock_limit
+    order = np.where(fits)[0]
+    order = order[np.argsort(-predicted[order], kind='mergesort')]
+
+    slot = np.zeros(len(order), dtype=int)
+    start = np.zeros(len(order))
+    free_at = [(0.0, i_slot) for i_slot in range(n_slots)]
+    for i_visit, time in enumerate(predicted[order]):
+        start[i_visit], slot[i_visit] = heapq.heappop(free_at)
+        heapq.heappush(free_at, (start[i_visit] + time, slot[i_visit]))
+
+    return SubmissionPlan(obsHistID[order], predicted[order], slot, start,
+                          n_slots, wall_clock_limit=wall_clock_limit,
+                          too_long=obsHistID[~fits])
+
+
+def write_visit_list(file_name, sections, mode='w'):
+    """
+    Write the visit list read by the phoSim workflow (setupVisit.py
+    takes the visit of stream n from the n-th obsHistID line), one
+    section per plan, each in submission order.  The visits of each plan
+    that are over the wall-clock limit follow in a section titled
+    '<title> over the wall-clock limit', after the sections of all the
+    plans.
+
+    Parameters
+    ----------
+    file_name : str
+        the visit list
+    sections : list of (str, `SubmissionPlan`)
+        title and plan of each section
+    mode : str, optional
+        'w' to write a new file, 'a' to append to it
+    """
+    with open(file_name, mode) as output:
+        for title, plan in sections:
+            summary = plan.summary()
+            output.write('# Begin Section %s\n' % title)
+            output.write('# %(visits)d visits in %(n_slots)d slots: makespan %(makespan).2f h, '
+                         'utilization %(utilization).3f\n' % summary)
+            for obsHistID in plan.obsHistID:
+                output.write('%d\n' % obsHistID)
+        for title, plan in sections:
+            if len(plan.too_long) == 0:
+                continue
+            output.write('# Begin Section %s over the wall-clock limit\n' % title)
+            output.write('# %d visits predicted to take longer than %.2f h\n'
+                         % (len(plan.too_long), plan.wall_clock_limit))
+            for obsHistID in plan.too_long:
+                output.write('%d\n' % obsHistID)
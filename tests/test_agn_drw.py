@@ -0,0 +1,166 @@
+"""
+Test code for the damped random walks of the time-delayed AGN.
+"""
+from __future__ import absolute_import, division
+import math
+import unittest
+import numpy as np
+import desc.twinkles.agn_drw as agn_drw
+from desc.twinkles import (agn_drw_dmags, agn_drw_groups, agn_ou_dmags,
+                           agn_drw_start_date)
+
+def scalar_drw_dmags(seed, tau, redshift, t_delay, sfu, expmjd_arr):
+    """
+    Step the walk of a single object the way applyAgnTimeDelay used to.
+    """
+    start_date = agn_drw_start_date
+    time_dilation = 1.0 + redshift
+    rng = np.random.RandomState(seed)
+    dt = tau/100.
+    duration_rest_frame = (expmjd_arr.max() - start_date)/time_dilation
+    nbins = int(math.ceil(duration_rest_frame/dt))+1
+    time_dexes = np.round((expmjd_arr-start_date-t_delay)/(time_dilation*dt)).astype(int)
+    dmags = np.zeros(len(expmjd_arr))
+    dx2 = 0.0
+    x1 = 0.0
+    x2 = 0.0
+    dt_over_tau = dt/tau
+    es = rng.normal(0., 1., nbins)*math.sqrt(dt_over_tau)
+    for i_time in range(nbins):
+        dx1 = dx2
+        dx2 = -dx1*dt_over_tau + sfu*es[i_time] + dx1
+        x1 = x2
+        x2 += dt
+        for i_time_out in np.where(time_dexes == i_time)[0]:
+            local_end = (expmjd_arr[i_time_out]-start_date-t_delay)/time_dilation
+            dmags[i_time_out] = (local_end*(dx1-dx2)+dx2*x1-dx1*x2)/(x1-x2)
+    return dmags
+
+class AgnDrwTestCase(unittest.TestCase):
+    "TestCase class for agn_drw_dmags."
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        n_obj = 40
+        self.seed = rng.randint(0, 2**31, n_obj)
+        self.tau = 10**rng.uniform(1.5, 3.0, n_obj)
+        self.redshift = rng.uniform(0.1, 3.0, n_obj)
+        self.t_delay = rng.uniform(-20.0, 60.0, n_obj)
+        self.sfu = rng.uniform(0.1, 1.0, n_obj)
+        self.expmjd = np.array([58700.0, 59200.5, 58700.0, 59050.25])
+        self.block_elements = agn_drw._block_elements
+
+    def tearDown(self):
+        agn_drw._block_elements = self.block_elements
+
+    def reference(self, expmjd):
+        return np.array([scalar_drw_dmags(*(args + (expmjd,)))
+                         for args in zip(self.seed, self.tau, self.redshift,
+                                         self.t_delay, self.sfu)])
+
+    def test_bit_compatible(self):
+        "Test that the walks match stepping each object in turn."
+        dmags = agn_drw_dmags(self.seed, self.tau, self.redshift,
+                              self.t_delay, self.sfu, self.expmjd)
+        self.assertEqual(dmags.shape, (40, 4))
+        self.assertEqual(dmags.tobytes(), self.reference(self.expmjd).tobytes())
+        self.assertTrue(np.all(dmags[:, 0] == dmags[:, 2]))
+
+    def test_blocks(self):
+        "Test that drawing the random numbers in blocks changes nothing."
+        dmags = agn_drw_dmags(self.seed, self.tau, self.redshift,
+                              self.t_delay, self.sfu, self.expmjd)
+        agn_drw._block_elements = 100
+        np.testing.assert_array_equal(agn_drw_dmags(self.seed, self.tau, self.redshift,
+                                                    self.t_delay, self.sfu, self.expmjd),
+                                      dmags)
+
+    def test_scalar_mjd(self):
+        "Test a single visit."
+        dmags = agn_drw_dmags(self.seed, self.tau, self.redshift,
+                              self.t_delay, self.sfu, 59200.5)
+        self.assertEqual(dmags.shape, (40,))
+        np.testing.assert_allclose(dmags, self.reference(np.array([59200.5]))[:, 0],
+                                   rtol=1.0e-12, atol=1.0e-15)
+        self.assertEqual(agn_drw_dmags([], [], [], [], [], 59200.5).shape, (0,))
+
+    def test_shared_walks(self):
+        "Test that the images of a lensed AGN share its walk."
+        hosts = np.repeat(np.arange(10), 4)
+        self.seed, self.tau, self.redshift, self.sfu = [arr[hosts] for arr in
+                                                        (self.seed, self.tau, self.redshift, self.sfu)]
+        first, group = agn_drw_groups(self.seed, self.tau, self.redshift, self.sfu)
+        self.assertEqual(len(first), 10)
+        np.testing.assert_array_equal(first[group], first[group[hosts*4]])
+        np.testing.assert_array_equal(hosts[first[group]], hosts)
+        dmags = agn_drw_dmags(self.seed, self.tau, self.redshift,
+                              self.t_delay, self.sfu, self.expmjd)
+        self.assertEqual(dmags.tobytes(), self.reference(self.expmjd).tobytes())
+
+class ExactSamplerTestCase(unittest.TestCase):
+    "TestCase class for agn_ou_dmags."
+    def setUp(self):
+        n_obj = 2000
+        self.tau = 100.
+        self.sfu = 0.5
+        self.redshift = 0.5
+        self.args = (np.arange(n_obj) + 17, np.full(n_obj, self.tau),
+                     np.full(n_obj, self.redshift), np.zeros(n_obj),
+                     np.full(n_obj, self.sfu))
+        self.expmjd = np.array([58700., 58900., 59500., 60500.])
+        self.rest_time = (self.expmjd - agn_drw_start_date)/(1.0 + self.redshift)
+
+    def test_structure_function(self):
+        "Test that both samplers have the structure function of the OU process."
+        var = 0.5*self.sfu**2*(1.0 - np.exp(-2.0*self.rest_time/self.tau))
+        grid = agn_drw_dmags(*(self.args + (self.expmjd,)))
+        exact = agn_ou_dmags(*(self.args + (self.expmjd,)))
+        for dmags in (grid, exact):
+            np.testing.assert_allclose(dmags.mean(axis=0), 0., atol=0.03)
+            np.testing.assert_allclose(dmags.var(axis=0)/var, 1., atol=0.1)
+        for i_time in range(len(self.expmjd)):
+            for j_time in range(i_time+1, len(self.expmjd)):
+                lag = self.rest_time[j_time] - self.rest_time[i_time]
+                sf2 = var[i_time] + var[j_time] - 2.0*var[i_time]*np.exp(-lag/self.tau)
+                sf2_grid = np.var(grid[:, j_time] - grid[:, i_time])
+                sf2_exact = np.var(exact[:, j_time] - exact[:, i_time])
+                self.assertAlmostEqual(sf2_grid/sf2, 1., delta=0.1)
+                self.assertAlmostEqual(sf2_exact/sf2, 1., delta=0.1)
+                self.assertAlmostEqual(sf2_exact/sf2_grid, 1., delta=0.15)
+
+    def test_per_visit(self):
+        "Test that a light curve requested one visit at a time is the whole one."
+        expmjd = np.append(self.expmjd, [58710., 58730., 60500.])
+        exact = agn_ou_dmags(*(self.args + (expmjd,)))
+        per_visit = np.column_stack([agn_ou_dmags(*(self.args + (mjd,))) for mjd in expmjd])
+        np.testing.assert_array_equal(per_visit, exact)
+        np.testing.assert_array_equal(per_visit[:, 3], per_visit[:, 6])
+        grid = agn_drw_dmags(*(self.args + (expmjd,)))
+        for i_time in range(len(expmjd) - 1):
+            sf2_grid = np.var(grid[:, i_time+1] - grid[:, i_time])
+            sf2_visit = np.var(per_visit[:, i_time+1] - per_visit[:, i_time])
+            if sf2_grid > 0:
+                self.assertAlmostEqual(sf2_visit/sf2_grid, 1., delta=0.15)
+            else:
+                self.assertEqual(sf2_visit, 0.)
+
+    def test_horizon(self):
+        "Test that the epochs past the horizon of the exact sampler are rejected."
+        end = agn_drw_start_date + agn_drw._ou_horizon*(1.0 + self.redshift)
+        self.assertTrue(np.all(np.isfinite(agn_ou_dmags(*(self.args + (end - 1.,))))))
+        self.assertRaises(ValueError, agn_ou_dmags, *(self.args + (end,)))
+
+    def test_realization(self):
+        "Test that the images of a lensed AGN sample the same realization."
+        seed, tau, redshift, _, sfu = [arr[:3].repeat(2) for arr in self.args]
+        t_delay = np.array([0., 30., 0., 0., 5., 12.])
+        dmags = agn_ou_dmags(seed, tau, redshift, t_delay, sfu, self.expmjd)
+        np.testing.assert_array_equal(dmags[2], dmags[3])
+        self.assertFalse(np.any(dmags[0] == dmags[1]))
+        np.testing.assert_array_equal(agn_ou_dmags(seed, tau, redshift, t_delay, sfu, self.expmjd),
+                                      dmags)
+        scalar = agn_ou_dmags(seed, tau, redshift, t_delay, sfu, 58700.)
+        self.assertEqual(scalar.shape, (6,))
+        self.assertTrue(np.all(np.isfinite(scalar)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Test code for the persistent store of the AGN damped random walks.
+"""
+from __future__ import absolute_import, division
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import desc.twinkles.agn_light_curve_store as agn_light_curve_store
+from desc.twinkles import AgnLightCurveStore, agn_drw_dmags
+
+class AgnLightCurveStoreTestCase(unittest.TestCase):
+    "TestCase class for AgnLightCurveStore."
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(43)
+        n_obj = 24
+        hosts = np.arange(n_obj) % 16
+        self.seed = rng.randint(0, 2**31, n_obj)[hosts]
+        self.tau = 10**rng.uniform(1.5, 3.0, n_obj)[hosts]
+        self.redshift = rng.uniform(0.1, 3.0, n_obj)[hosts]
+        self.t_delay = rng.uniform(0.0, 60.0, n_obj)
+        self.sfu = rng.uniform(0.1, 1.0, n_obj)[hosts]
+        self.batch_elements = agn_light_curve_store._batch_elements
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        agn_light_curve_store._batch_elements = self.batch_elements
+
+    def dmags(self, expmjd, store=None):
+        return agn_drw_dmags(self.seed, self.tau, self.redshift, self.t_delay,
+                             self.sfu, expmjd, store=store)
+
+    def test_bit_compatible(self):
+        "Test that stored and extended walks match the walks stepped from the start."
+        store = AgnLightCurveStore(self.cache_dir)
+        for expmjd in (np.array([58650., 58700.5]), 59200.25,
+                       np.array([58650., 59900., 59000.])):
+            self.assertEqual(self.dmags(expmjd, store).tobytes(),
+                             self.dmags(expmjd).tobytes())
+        self.assertEqual(store.stats['misses'], 16)
+        self.assertEqual(store.stats['extensions'], 32)
+        self.assertEqual(store.stats['hits'], 0)
+
+        agn_light_curve_store._batch_elements = 50
+        expmjd = np.array([58700., 60100.])
+        store = AgnLightCurveStore(self.cache_dir)
+        self.assertEqual(self.dmags(expmjd, store).tobytes(),
+                         self.dmags(expmjd).tobytes())
+
+    def test_other_store(self):
+        "Test that a second store reads the walks of the first without stepping them."
+        self.dmags(np.array([58700., 59500.]), AgnLightCurveStore(self.cache_dir))
+        store = AgnLightCurveStore(self.cache_dir)
+        expmjd = np.array([58800., 59400.])
+        self.assertEqual(self.dmags(expmjd, store).tobytes(), self.dmags(expmjd).tobytes())
+        self.assertEqual(store.stats, dict(hits=16, misses=0, extensions=0, evictions=0))
+        walks = store.walks(self.seed, self.tau, self.redshift, self.sfu, 58580., [10]*24)
+        self.assertIsInstance(walks[0], np.memmap)
+
+    def test_append(self):
+        "Test that extending a walk appends its new steps to its file in place."
+        store = AgnLightCurveStore(self.cache_dir)
+        args = (self.seed[:1], self.tau[:1], self.redshift[:1], self.sfu[:1], 58580.)
+        key = store.walk_key(*([arr[0] for arr in args[:4]] + [args[4]]))
+        first = store.walks(*(args + ([100],)))[0]
+        file_name = os.path.join(self.cache_dir, key + '.drw')
+        inode = os.stat(file_name).st_ino
+        head = np.array(first)
+        # what an append interrupted before its header was left behind
+        with open(file_name, 'ab') as output:
+            output.write(b'\0'*24)
+        self.assertEqual(len(store.read(key)[1]), 100)
+        walk = store.walks(*(args + ([250],)))[0]
+        self.assertEqual(os.stat(file_name).st_ino, inode)
+        self.assertEqual(os.path.getsize(file_name),
+                         agn_light_curve_store._header_dtype.itemsize + 8*250)
+        np.testing.assert_array_equal(first, head)
+        np.testing.assert_array_equal(walk[:100], head)
+        reference = AgnLightCurveStore(tempfile.mkdtemp(dir=self.cache_dir))
+        self.assertEqual(np.array(walk).tobytes(),
+                         np.array(reference.walks(*(args + ([250],)))[0]).tobytes())
+
+        # a torn header is not trusted
+        with open(file_name, 'r+b') as output:
+            output.seek(agn_light_curve_store._header_dtype.fields['n_steps'][1])
+            output.write(np.array([300], dtype='<i8').tobytes())
+        self.assertIsNone(store.read(key))
+
+    def test_eviction(self):
+        "Test that the least recently used walks are evicted past the size bound."
+        store = AgnLightCurveStore(self.cache_dir)
+        self.dmags(np.array([59500.]), store)
+        size = store.size()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 16)
+        store = AgnLightCurveStore(self.cache_dir, max_bytes=size//2)
+        self.seed = self.seed + 1
+        dmags = self.dmags(np.array([59000.]), store)
+        self.assertEqual(dmags.tobytes(), self.dmags(np.array([59000.])).tobytes())
+        self.assertGreater(store.stats['evictions'], 0)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 32 - store.stats['evictions'])
+        for args in zip(self.seed, self.tau, self.redshift, self.sfu):
+            self.assertIsNotNone(store.read(store.walk_key(*args)))
+
+    def test_eviction_bound(self):
+        "Test that the store is only scanned for eviction past its size bound."
+        store = AgnLightCurveStore(self.cache_dir)
+        self.dmags(np.array([59500.]), store)
+        size = store.size()
+        calls = []
+        evict = store.evict
+        def counted_evict(*args, **kwargs):
+            calls.append(store.size())
+            evict(*args, **kwargs)
+        store.evict = counted_evict
+        self.dmags(np.array([59400.]), store)
+        self.dmags(np.array([59600.]), store)
+        self.assertEqual(calls, [])
+        store.max_bytes = store.size() + size//4
+        self.seed = self.seed + 1
+        self.dmags(np.array([59500.]), store)
+        self.assertEqual(len(calls), 1)
+        self.assertLessEqual(store.size(), store.max_bytes)
+
+if __name__ == '__main__':
+    unittest.main()
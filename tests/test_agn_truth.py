@@ -0,0 +1,86 @@
+"""
+Test code for the truth light curves of the time-delayed AGN.
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.twinkles import (agn_truth_dmags, write_agn_truth, read_agn_truth,
+                           agn_drw_dmags, agn_ou_dmags)
+
+class AgnTruthTestCase(unittest.TestCase):
+    "TestCase class for agn_truth_dmags."
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(44)
+        n_hosts = 12
+        self.catalog = np.zeros(4*n_hosts + 2, dtype=[('galtileid', int), ('redshift', float),
+                                                      ('varParamStr', 'U400')])
+        self.catalog['galtileid'] = np.arange(len(self.catalog)) + 1000
+        self.catalog['redshift'] = np.repeat(rng.uniform(0.5, 3.0, n_hosts + 1), 4)[:len(self.catalog)]
+        var_strings = []
+        for i_host in range(n_hosts):
+            pars = {'seed': int(rng.randint(0, 2**30)), 'agn_tau': 10**rng.uniform(1.5, 3.0)}
+            for band in 'ugrizy':
+                pars['agn_sf%s' % band] = rng.uniform(0.1, 1.0)
+            var_strings += [json.dumps({'m': 'applyAgnTimeDelay',
+                                        'p': dict(pars, t0Delay=rng.uniform(0., 60.))})
+                            for _ in range(4)]
+        self.catalog['varParamStr'] = var_strings + ['None', json.dumps({'m': 'applyAgn', 'p': {}})]
+        self.expmjd = np.array([59000., 59580.5, 59000., 59300.25, 60000.])
+        self.bands = np.array(['u', 'r', 'g', 'y', 'u'])
+        self.args = [np.array([json.loads(var_str)['p'][field] for var_str in var_strings])
+                     for field in ('seed', 'agn_tau')]
+        self.args += [self.catalog['redshift'][:4*n_hosts]]
+        self.args += [np.array([json.loads(var_str)['p'][field] for var_str in var_strings])
+                      for field in ('t0Delay', 'agn_sfu')]
+        self.sf = dict((band, np.array([json.loads(var_str)['p']['agn_sf%s' % band]
+                                        for var_str in var_strings]))
+                       for band in 'ugrizy')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_dmags(self):
+        "Test that the truth matches the dMags of applyAgnTimeDelay."
+        rows, dmags = agn_truth_dmags(self.catalog, self.expmjd, self.bands)
+        np.testing.assert_array_equal(rows, np.arange(48))
+        self.assertEqual(dmags.shape, (48, 5))
+        u_dmags = agn_drw_dmags(*(self.args + [self.expmjd]))
+        for i_visit, band in enumerate(self.bands):
+            expected = u_dmags[:, i_visit]
+            if band != 'u':
+                expected = expected*self.sf[band]/self.sf['u']
+            self.assertEqual(dmags[:, i_visit].tobytes(), expected.tobytes())
+        _, exact = agn_truth_dmags(self.catalog, self.expmjd, self.bands, sampler='exact')
+        np.testing.assert_array_equal(exact[:, 0], agn_ou_dmags(*(self.args + [self.expmjd]))[:, 0])
+        self.assertRaises(ValueError, agn_truth_dmags, self.catalog, self.expmjd,
+                          self.bands, sampler='other')
+
+    def test_processes(self):
+        "Test that computing the shards in parallel changes nothing."
+        for sampler in ('grid', 'exact'):
+            serial = agn_truth_dmags(self.catalog, self.expmjd, self.bands, sampler=sampler)[1]
+            parallel = agn_truth_dmags(self.catalog, self.expmjd, self.bands, sampler=sampler,
+                                       processes=2, n_shards=5)[1]
+            self.assertEqual(parallel.tobytes(), serial.tobytes())
+
+    def test_round_trip(self):
+        "Test that the truth is unchanged by writing and reading it."
+        rows, dmags = agn_truth_dmags(self.catalog, self.expmjd, self.bands)
+        truth_file = os.path.join(self.work_dir, 'truth.npz')
+        write_agn_truth(truth_file, self.catalog['galtileid'][rows], self.expmjd,
+                        self.bands, dmags, obsHistIDs=np.arange(5) + 200)
+        truth = read_agn_truth(truth_file)
+        np.testing.assert_array_equal(truth['id'], self.catalog['galtileid'][:48])
+        np.testing.assert_array_equal(truth['filter'], self.bands)
+        np.testing.assert_array_equal(truth['obsHistID'], np.arange(5) + 200)
+        np.testing.assert_array_equal(truth['dmag'], dmags)
+        self.assertRaises(ValueError, write_agn_truth, truth_file, rows[:3],
+                          self.expmjd, self.bands, dmags)
+
+if __name__ == '__main__':
+    unittest.main()
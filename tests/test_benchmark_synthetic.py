@@ -0,0 +1,123 @@
+"""
+Test code for the synthetic inputs of the sprinkler benchmarks.
+"""
+from __future__ import absolute_import
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.twinkles.benchmarks import (read_defs_file, write_defs_file,
+                                      complete_defs, galaxy_chunk_dtype,
+                                      make_om10_catalog, make_sne_catalog,
+                                      SyntheticGalaxyChunks)
+
+_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+class SyntheticInputsTestCase(unittest.TestCase):
+    "TestCase class for the synthetic benchmark inputs."
+    def setUp(self):
+        self.lenscat = make_om10_catalog(200, seed=3)
+        self.sne = make_sne_catalog(100, seed=4)
+        self.src_mag_norm = self.lenscat['MAGI_IN'] + 0.5
+        self.defs = read_defs_file(os.path.join(_data_dir, 'dc2_defs.csv'))
+        self.chunks = SyntheticGalaxyChunks(self.defs, self.lenscat,
+                                            self.src_mag_norm, self.sne,
+                                            chunk_size=1000,
+                                            lens_host_fraction=0.1,
+                                            sne_host_fraction=0.05)
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_defs_round_trip(self):
+        "Test that complete_defs only extends the CatSim layout."
+        self.assertEqual(complete_defs(self.defs), self.defs)
+        catsim_defs = read_defs_file(os.path.join(_data_dir, 'catsim_defs.csv'))
+        completed = dict(complete_defs(catsim_defs))
+        self.assertEqual(completed['raJ2000'], 'galaxyAgn_raJ2000')
+        self.assertIn('galaxyBulge_internalRv', completed)
+        defs_file = os.path.join(self.work_dir, 'defs.csv')
+        write_defs_file(complete_defs(catsim_defs), defs_file)
+        self.assertEqual(read_defs_file(defs_file), complete_defs(catsim_defs))
+
+    def test_chunk_layout(self):
+        "Test that the chunks have the columns of the defs file."
+        names = galaxy_chunk_dtype(self.defs).names
+        for key, value in self.defs:
+            if key not in ('pars', 'varMethodName'):
+                self.assertIn(value, names)
+        self.assertNotIn('sn_truth_params',
+                         galaxy_chunk_dtype(self.defs, has_sn_truth_params=False).names)
+        chunk = self.chunks.chunk(1, 2500)
+        self.assertEqual(chunk.dtype, self.chunks.dtype)
+        self.assertEqual(len(chunk), 1000)
+        self.assertEqual(len(self.chunks.chunk(2, 2500)), 500)
+        self.assertEqual(self.chunks.n_chunks(2500), 3)
+        np.testing.assert_array_equal(chunk['galaxy_id'], np.arange(1001, 2001))
+
+    def test_chunks_are_reproducible(self):
+        "Test that a chunk only depends on the seed and its index."
+        self.assertEqual(self.chunks.chunk(1, 3000).tobytes(),
+                         self.chunks.chunk(1, 3000).tobytes())
+        self.assertNotEqual(self.chunks.chunk(0, 3000).tobytes(),
+                            self.chunks.chunk(1, 3000).tobytes())
+
+    def test_var_param_str(self):
+        "Test that the AGN have JSON variability parameters."
+        chunk = self.chunks.chunk(0, 1000)
+        agn = ~np.isnan(chunk['agnMagNorm'])
+        self.assertGreater(agn.sum(), 0)
+        for var_str in chunk['varParamStr'][agn][:20]:
+            var_dict = json.loads(var_str)
+            self.assertEqual(var_dict['m'], 'applyAgn')
+            self.assertIn('agn_tau', var_dict['p'])
+        self.assertTrue(np.all(chunk['varParamStr'][~agn] == 'None'))
+
+    def test_placed_hosts(self):
+        "Test that the placed hosts, and only them, can be sprinkled."
+        n_rows = 3000
+        agn_cache, sne_cache = self.chunks.cache_tables(n_rows)
+        self.assertGreater(len(agn_cache), 0)
+        self.assertGreater(len(sne_cache), 0)
+        catalog = np.concatenate(list(self.chunks.chunks(n_rows)))
+        self.assertEqual(len(catalog), n_rows)
+        row = dict((gid, i_row) for i_row, gid in enumerate(catalog['galaxy_id']))
+
+        log_z = np.log10(catalog['redshift'])
+        twinkles_id = dict((tid, i_lens) for i_lens, tid in enumerate(self.lenscat['twinklesId']))
+        for gid, tid in zip(agn_cache['galtileid'], agn_cache['twinkles_system']):
+            i_lens = twinkles_id[tid]
+            self.assertLessEqual(abs(log_z[row[gid]] - np.log10(self.lenscat['ZSRC'][i_lens])), 0.1)
+            self.assertLessEqual(abs(catalog['agnMagNorm'][row[gid]] - self.src_mag_norm[i_lens]), 0.25)
+
+        sne_z = self.sne.groupby('twinkles_sysno')['zs'].first()
+        for gid, sysno in zip(sne_cache['galtileid'], sne_cache['twinkles_system']):
+            self.assertTrue(np.isnan(catalog['agnMagNorm'][row[gid]]))
+            self.assertLessEqual(abs(log_z[row[gid]] - np.log10(sne_z[sysno])), 0.1)
+
+        # the other AGN are too faint for any source and the other
+        # galaxies beyond the redshift of any SN
+        others = np.ones(n_rows, dtype=bool)
+        others[[row[gid] for gid in agn_cache['galtileid']]] = False
+        others[[row[gid] for gid in sne_cache['galtileid']]] = False
+        agn = ~np.isnan(catalog['agnMagNorm'])
+        self.assertTrue(np.all(catalog['agnMagNorm'][others & agn] > self.src_mag_norm.max() + 0.25))
+        self.assertTrue(np.all(log_z[others & ~agn] > np.log10(self.sne['zs'].max()) + 0.1))
+
+    def test_stand_in_catalogs(self):
+        "Test the image slots of the OM10 and SNe stand-ins."
+        in_system = np.arange(4) < self.lenscat['NIMG'][:, None]
+        self.assertTrue(np.all(self.lenscat['XIMG'][~in_system] == 0.0))
+        self.assertEqual(len(np.unique(self.lenscat['twinklesId'])), len(self.lenscat))
+        n_img = self.sne.groupby('twinkles_sysno').size()
+        self.assertEqual(len(n_img), 100)
+        self.assertTrue(set(n_img.values) <= set([2, 4]))
+        imno = self.sne.groupby('twinkles_sysno')['imno'].apply(list)
+        for sysno in imno.index:
+            self.assertEqual(imno[sysno], list(range(n_img[sysno])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Test code for the flat-array random forest of the CPU time predictions.
+"""
+from __future__ import absolute_import, division
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.twinkles import ForestModel
+
+try:
+    from sklearn.ensemble import RandomForestRegressor
+    have_sklearn = True
+except ImportError:
+    have_sklearn = False
+
+class FakeTree(object):
+    "The node arrays of a fitted scikit-learn tree, grown at random."
+    def __init__(self, rng, n_features, max_depth):
+        self.children_left = []
+        self.children_right = []
+        self.feature = []
+        self.threshold = []
+        self.value = []
+        self._grow(rng, n_features, max_depth)
+        for name in ('children_left', 'children_right', 'feature'):
+            setattr(self, name, np.array(getattr(self, name)))
+        self.threshold = np.array(self.threshold)
+        self.value = np.array(self.value).reshape(-1, 1, 1)
+        self.node_count = len(self.feature)
+
+    def _grow(self, rng, n_features, depth):
+        node = len(self.feature)
+        for name in ('children_left', 'children_right', 'feature', 'threshold'):
+            getattr(self, name).append(-2 if name in ('feature', 'threshold') else -1)
+        self.value.append(rng.normal())
+        if depth > 0 and rng.uniform() < 0.8:
+            self.feature[node] = rng.randint(n_features)
+            self.threshold[node] = rng.uniform(-1., 1.)
+            self.children_left[node] = self._grow(rng, n_features, depth-1)
+            self.children_right[node] = self._grow(rng, n_features, depth-1)
+        return node
+
+class FakeEstimator(object):
+    def __init__(self, tree):
+        self.tree_ = tree
+
+class FakeForest(object):
+    def __init__(self, seed, n_trees=12, n_features=3, max_depth=8):
+        rng = np.random.RandomState(seed)
+        self.n_features_in_ = n_features
+        self.estimators_ = [FakeEstimator(FakeTree(rng, n_features, max_depth))
+                            for _ in range(n_trees)]
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        total = np.zeros(len(X))
+        for estimator in self.estimators_:
+            tree = estimator.tree_
+            for i_row, row in enumerate(X):
+                node = 0
+                while tree.children_left[node] >= 0:
+                    if row[tree.feature[node]] <= tree.threshold[node]:
+                        node = tree.children_left[node]
+                    else:
+                        node = tree.children_right[node]
+                total[i_row] += tree.value[node, 0, 0]
+        return total/len(self.estimators_)
+
+class ForestModelTestCase(unittest.TestCase):
+    "TestCase class for ForestModel."
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.X = np.random.RandomState(5).uniform(-1.2, 1.2, (500, 3))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_predict(self):
+        "Test that the flat forest predicts what the forest does."
+        forest = FakeForest(7)
+        model = ForestModel.from_forest(forest)
+        np.testing.assert_array_equal(model.predict(self.X), forest.predict(self.X))
+        self.assertEqual(model.predict(self.X[:0]).shape, (0,))
+        self.assertRaises(ValueError, model.predict, self.X[:, :2])
+
+    def test_round_trip(self):
+        "Test that a forest is unchanged by writing and reading it."
+        model = ForestModel.from_forest(FakeForest(8))
+        forest_file = os.path.join(self.work_dir, 'forest.npz')
+        model.write(forest_file)
+        np.testing.assert_array_equal(ForestModel.read(forest_file).predict(self.X),
+                                      model.predict(self.X))
+
+    @unittest.skipIf(not have_sklearn, 'scikit-learn is not installed')
+    def test_sklearn(self):
+        "Test the predictions of a scikit-learn forest."
+        rng = np.random.RandomState(9)
+        y = self.X[:, 0]**2 + self.X[:, 1] + 0.1*rng.normal(size=len(self.X))
+        forest = RandomForestRegressor(n_estimators=16, random_state=9).fit(self.X, y)
+        X = rng.uniform(-1.5, 1.5, (300, 3))
+        np.testing.assert_allclose(ForestModel.from_forest(forest).predict(X),
+                                   forest.predict(X), rtol=1.e-12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+Test code for the sprinkler lens candidate index.
+"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+from desc.twinkles import (LensCandidateIndex, SortedKeyIndex, SNSystemAssigner,
+                           SNReservationTable)
+
+class LensCandidateIndexTestCase(unittest.TestCase):
+    "TestCase class for LensCandidateIndex."
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        n_lens = 500
+        self.zsrc = rng.uniform(0.3, 4.0, n_lens)
+        self.mag_norm = rng.uniform(16.0, 26.0, n_lens)
+        self.twinkles_id = rng.permutation(n_lens)
+        n_host = 300
+        self.galz = rng.uniform(0.2, 4.5, n_host)
+        self.gal_mag = rng.uniform(15.0, 27.0, n_host)
+        # hosts sitting exactly on the edges of the windows
+        self.galz[:50] = 10**(np.log10(self.zsrc[:50]) + 0.1)
+        self.gal_mag[:50] = self.mag_norm[:50] - 0.25
+
+    def brute_force(self, galz, gal_mag, twinkles_id):
+        "The linear scan that the index replaces."
+        w = np.where((np.abs(np.log10(self.zsrc) - np.log10(galz)) <= 0.1) &
+                     (np.abs(self.mag_norm - gal_mag) <= .25))[0]
+        return w[np.argsort(twinkles_id[w])]
+
+    def test_query(self):
+        "Test that the batched query matches the linear scan."
+        index = LensCandidateIndex(self.zsrc, self.mag_norm, self.twinkles_id)
+        offsets, candidates = index.query(self.galz, self.gal_mag)
+        self.assertEqual(len(offsets), len(self.galz) + 1)
+        n_found = 0
+        for i_host, (galz, gal_mag) in enumerate(zip(self.galz, self.gal_mag)):
+            expected = self.brute_force(galz, gal_mag, self.twinkles_id)
+            found = candidates[offsets[i_host]:offsets[i_host+1]]
+            np.testing.assert_array_equal(found, expected)
+            n_found += len(found)
+        self.assertGreater(n_found, 0)
+
+    def test_duplicate_ids(self):
+        "Test the ordering when twinklesId is not unique."
+        twinkles_id = self.twinkles_id % 20
+        index = LensCandidateIndex(self.zsrc, self.mag_norm, twinkles_id)
+        for galz, gal_mag in zip(self.galz, self.gal_mag):
+            np.testing.assert_array_equal(index.candidates(galz, gal_mag),
+                                          self.brute_force(galz, gal_mag,
+                                                           twinkles_id))
+
+    def test_no_candidates(self):
+        "Test hosts that cannot have any candidates."
+        index = LensCandidateIndex(self.zsrc, self.mag_norm, self.twinkles_id)
+        offsets, candidates = index.query([np.nan, 100.0, 1.0], [20.0, 20.0, 99.0])
+        np.testing.assert_array_equal(offsets, [0, 0, 0, 0])
+        self.assertEqual(len(candidates), 0)
+
+class SortedKeyIndexTestCase(unittest.TestCase):
+    "TestCase class for SortedKeyIndex."
+    def test_join(self):
+        "Test joining keys against a table with repeated keys."
+        keys = np.array([7, 3, 7, 11, 3, 7])
+        index = SortedKeyIndex(keys)
+        np.testing.assert_array_equal(index.unique_keys, [3, 7, 11])
+        np.testing.assert_array_equal(index.first([11, 7, 5, 3]), [3, 0, -1, 1])
+        np.testing.assert_array_equal(index.all_rows(7), [0, 2, 5])
+        self.assertEqual(len(index.all_rows(5)), 0)
+        start, end = index.bounds([3, 7, 5])
+        np.testing.assert_array_equal(end - start, [2, 3, 0])
+
+    def test_empty(self):
+        "Test an index of an empty table."
+        index = SortedKeyIndex(np.array([], dtype=int))
+        np.testing.assert_array_equal(index.first([1, 2]), [-1, -1])
+
+class SNSystemAssignerTestCase(unittest.TestCase):
+    "TestCase class for SNSystemAssigner."
+    def setUp(self):
+        rng = np.random.RandomState(43)
+        n_sys = 200
+        n_img = rng.choice([2, 4], n_sys)
+        self.sysno = np.repeat(rng.permutation(n_sys) + 1000, n_img)
+        self.zs = np.repeat(rng.uniform(0.2, 1.2, n_sys), n_img)
+        self.galz = rng.uniform(0.1, 1.5, 300)
+        self.galz[:20] = 10**(np.log10(self.zs[:20]) - 0.1)
+        self.galtileid = rng.randint(0, 10**9, 300)
+
+    def brute_force(self, galtileid, galz, used):
+        "The linear scan of the SNe catalog that the assigner replaces."
+        w = np.where(np.abs(np.log10(self.zs) - np.log10(galz)) <= 0.1)[0]
+        candidate_sysno = np.unique(self.sysno[w])
+        unused_sysno = candidate_sysno[~np.isin(candidate_sysno, used)]
+        if len(unused_sysno) == 0:
+            return None
+        return np.random.RandomState(galtileid % (2**32 -1)).choice(unused_sysno)
+
+    def test_choose(self):
+        "Test that the assigner matches the linear scan as systems are used."
+        assigner = SNSystemAssigner(self.zs, self.sysno)
+        used = []
+        n_placed = 0
+        for galtileid, galz in zip(self.galtileid, self.galz):
+            expected = self.brute_force(galtileid, galz, used)
+            self.assertEqual(assigner.choose(galtileid, galz), expected)
+            if expected is not None:
+                assigner.mark_used(expected)
+                used.append(expected)
+                n_placed += 1
+        self.assertGreater(n_placed, 0)
+        np.testing.assert_array_equal(assigner.used, np.sort(used))
+        assigner.reset()
+        self.assertEqual(len(assigner.used), 0)
+
+    def test_no_candidates(self):
+        "Test hosts without systems in their redshift window."
+        assigner = SNSystemAssigner(self.zs, self.sysno)
+        self.assertIsNone(assigner.choose(1, np.nan))
+        self.assertIsNone(assigner.choose(1, 50.0))
+        assigner.mark_used(np.unique(self.sysno))
+        self.assertIsNone(assigner.choose(1, 0.5))
+
+class SNReservationTableTestCase(unittest.TestCase):
+    "TestCase class for SNReservationTable."
+    def test_lookup(self):
+        "Test looking up and splitting reservations."
+        table = SNReservationTable([40, 10, 30], [1002, 1000, 1001])
+        systems, reserved = table.lookup([30, 20, 40, 10])
+        np.testing.assert_array_equal(reserved, [True, False, True, True])
+        np.testing.assert_array_equal(systems, [1001, 1002, 1000])
+        subset = table.subset([10, 20, 40])
+        self.assertEqual(len(subset), 2)
+        np.testing.assert_array_equal(subset.lookup([40])[0], [1002])
+        merged = SNReservationTable.concatenate([subset, table.subset([30])])
+        np.testing.assert_array_equal(merged.lookup([30, 40, 10])[0], [1001, 1002, 1000])
+
+    def test_invalid(self):
+        "Test that a host cannot reserve two systems."
+        self.assertRaises(ValueError, SNReservationTable, [1, 1], [1000, 1001])
+        self.assertRaises(ValueError, SNReservationTable, [1, 2], [1000])
+        systems, reserved = SNReservationTable([], []).lookup([1, 2])
+        self.assertEqual(len(systems), 0)
+        self.assertFalse(reserved.any())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Test code for the on-disk cache of the OM10 source magNorms.
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from lsst.sims.catUtils.matchSED import matchBase
+from lsst.sims.photUtils import BandpassDict, Sed
+from desc.twinkles import (src_mag_norm_cache_key, compute_src_mag_norm,
+                           load_src_mag_norm)
+
+class MagNormCacheTestCase(unittest.TestCase):
+    "TestCase class for load_src_mag_norm."
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.work_dir, 'cache')
+        self.lens_cat_file = os.path.join(self.work_dir, 'om10.fits')
+        with open(self.lens_cat_file, 'wb') as output:
+            output.write(b'a stand-in for the OM10 catalog')
+        wavelen = np.arange(100., 1500., 1.)
+        self.sed_file = os.path.join(self.work_dir, 'agn.spec')
+        np.savetxt(self.sed_file, np.column_stack((wavelen, 1. + np.exp(-wavelen/300.))))
+        self.bandpassDict = BandpassDict.loadTotalBandpassesFromFiles(bandpassNames=['i'])
+        rng = np.random.RandomState(9)
+        # repeated redshifts share their offsets
+        self.src_z = np.round(rng.uniform(0.5, 4., 50), 1)
+        self.src_mags = rng.uniform(19., 24., 50)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_per_lens(self):
+        "Test that the magNorms are those of a calcMagNorm call per lens."
+        mag_norm = []
+        for src, s_z in zip(self.src_mags, self.src_z):
+            agn_sed = Sed()
+            agn_sed.readSED_flambda(self.sed_file)
+            agn_sed.redshiftSED(s_z, dimming=True)
+            mag_norm.append(matchBase().calcMagNorm([src], agn_sed, self.bandpassDict))
+        np.testing.assert_allclose(compute_src_mag_norm(self.src_mags, self.src_z,
+                                                        self.sed_file, self.bandpassDict),
+                                   mag_norm, rtol=1.e-12)
+
+    def test_cache(self):
+        "Test that the magNorms are cached for the same inputs."
+        mag_norm = load_src_mag_norm(self.lens_cat_file, self.src_mags, self.src_z,
+                                     self.sed_file, self.bandpassDict,
+                                     cache_dir=self.cache_dir)
+        key = src_mag_norm_cache_key(self.lens_cat_file, self.sed_file, self.bandpassDict)
+        self.assertEqual(os.listdir(self.cache_dir), ['om10_src_mag_norm_%s.npy' % key])
+        # a cache hit does not look at the magnitudes
+        np.testing.assert_array_equal(load_src_mag_norm(self.lens_cat_file, self.src_mags + 1.,
+                                                        self.src_z, self.sed_file,
+                                                        self.bandpassDict,
+                                                        cache_dir=self.cache_dir),
+                                      mag_norm)
+        # unless the number of sources differs
+        np.testing.assert_array_equal(load_src_mag_norm(self.lens_cat_file, self.src_mags[:10],
+                                                        self.src_z[:10], self.sed_file,
+                                                        self.bandpassDict,
+                                                        cache_dir=self.cache_dir),
+                                      mag_norm[:10])
+
+    def test_cache_key(self):
+        "Test that the cache key changes with the contents of the inputs."
+        key = src_mag_norm_cache_key(self.lens_cat_file, self.sed_file, self.bandpassDict)
+        self.assertEqual(src_mag_norm_cache_key(self.lens_cat_file, self.sed_file,
+                                                self.bandpassDict), key)
+        for file_name in (self.lens_cat_file, self.sed_file):
+            with open(file_name, 'ab') as output:
+                output.write(b'\n')
+            new_key = src_mag_norm_cache_key(self.lens_cat_file, self.sed_file,
+                                             self.bandpassDict)
+            self.assertNotEqual(new_key, key)
+            key = new_key
+        self.bandpassDict['i'].sb = self.bandpassDict['i'].sb*0.5
+        self.assertNotEqual(src_mag_norm_cache_key(self.lens_cat_file, self.sed_file,
+                                                   self.bandpassDict), key)
+
+        # the cached magNorms of other inputs are not used
+        mag_norm = load_src_mag_norm(self.lens_cat_file, self.src_mags, self.src_z,
+                                     self.sed_file, self.bandpassDict,
+                                     cache_dir=self.cache_dir)
+        with open(self.sed_file, 'w') as output:
+            output.write('100. 1.\n1500. 2.\n')
+        np.testing.assert_array_equal(load_src_mag_norm(self.lens_cat_file, self.src_mags,
+                                                        self.src_z, self.sed_file,
+                                                        self.bandpassDict,
+                                                        cache_dir=self.cache_dir),
+                                      compute_src_mag_norm(self.src_mags, self.src_z,
+                                                           self.sed_file, self.bandpassDict))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.assertFalse(np.array_equal(mag_norm, compute_src_mag_norm(self.src_mags, self.src_z,
+                                                                       self.sed_file,
+                                                                       self.bandpassDict)))
+
+if __name__ == '__main__':
+    unittest.main()
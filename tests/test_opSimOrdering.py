@@ -74,6 +74,47 @@ class TestOpSimOrdering(unittest.TestCase):
         Orig_groups = self.ops.filteredOpSim.groupby(['night', 'filter']).groups.keys()
         self.assertEqual(len(Twink_3p1_Groups), len(Orig_groups))
 
+    def test_predictedTimes(self):
+        """
+        Check that the batch predictions match predicting the obsHistIDs
+        one at a time
+        """
+        obsHistIDs = self.ops.filteredOpSim.obsHistID.values[:20]
+        times = np.array([self.ops.cpuPred(obsHistID)[0] for obsHistID in obsHistIDs])
+        np.testing.assert_array_equal(self.ops.predictedTimes(obsHistIDs),
+                                      times / 3600.0)
+
+    def test_memoizedSubsets(self):
+        """
+        Check that the subsets are computed once, recomputed when timeMax
+        changes and all returned by materialize_all
+        """
+        subsets = self.ops.materialize_all()
+        self.assertTrue(set(['Twinkles_WFD', 'Twinkles_3p1', 'Twinkles_3p1b',
+                             'Twinkles_3p2', 'Twinkles_3p3']) <= set(subsets))
+        cached = self.ops._shared('Twinkles_3p3')
+        self.assertIs(self.ops._shared('Twinkles_3p3'), cached)
+        self.assertTrue(self.ops.Twinkles_3p3.equals(subsets['Twinkles_3p3']))
+        self.ops.timeMax = 1.0
+        self.assertIsNot(self.ops._shared('Twinkles_3p3'), cached)
+        self.assertLessEqual(len(self.ops.filteredOpSim), self.numRecords)
+
+    def test_subsetCopies(self):
+        """
+        Check that modifying a returned subset in place leaves the cached
+        subsets unchanged, also when filteredOpSim is uniqueOpSimRecords
+        """
+        ops = OpSimOrdering(self.opSimDBPath, ignorePredictedTimes=True,
+                            minimizeBy='expMJD')
+        for subsets in (self.ops, ops):
+            numRecords = len(subsets.filteredOpSim)
+            subsets.filteredOpSim.set_index('obsHistID', inplace=True)
+            subsets.uniqueOpSimRecords.drop(columns='obsHistID', inplace=True)
+            self.assertIn('obsHistID', subsets.filteredOpSim.columns)
+            self.assertIn('obsHistID', subsets.uniqueOpSimRecords.columns)
+            self.assertEqual(len(subsets.filteredOpSim), numRecords)
+            self.assertIsNot(subsets.filteredOpSim, subsets.filteredOpSim)
+
 
 if __name__ == '__main__':
     unittest.main()
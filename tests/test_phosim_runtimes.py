@@ -0,0 +1,140 @@
+"""
+Test code for the harvest of the measured phoSim run times.
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from desc.twinkles import (harvest_phosim_runtimes, visit_runtimes,
+                           runtime_training_set, prediction_error_history,
+                           runtime_record_file, fit_cpu_forest, ForestModel,
+                           CpuPred)
+
+try:
+    import sklearn
+    have_sklearn = True
+except ImportError:
+    have_sklearn = False
+
+class FakeCpuPred(object):
+    "CpuPred with the conditions of obsHistID n set to (n % 6, n, 2n)."
+    def conditions_many(self, obsids):
+        obsids = np.ravel(obsids)
+        return obsids % 6, obsids.astype(float), 2.*obsids
+
+    def cputime_many(self, filter_index, moonalt, moonphase):
+        return 100.*moonalt
+
+class FakeDensityCpuPred(FakeCpuPred):
+    "FakeCpuPred predicting from the number of objects as well."
+    uses_n_objects = True
+
+    def cputime_many(self, filter_index, moonalt, moonphase, n_objects=None):
+        return 100.*moonalt + n_objects
+
+class PhosimRuntimesTestCase(unittest.TestCase):
+    "TestCase class for harvest_phosim_runtimes."
+    def setUp(self):
+        self.work_root = tempfile.mkdtemp()
+        day = 86400.
+        # (stream, sensor, obsHistID, start, cpu_time, host, rc)
+        segments = [(0, 'R22_S11', 10, 0., 500., 'fell0001', 0),
+                    (0, 'R22_S11', 10, 1000., 1500., 'hequ0002.slac.stanford.edu', 0),
+                    (0, 'R22_S12', 10, 0., 1000., 'fell0003', 0),
+                    (1, 'R22_S11', 20, day, 4000., 'fell0001', 0),
+                    (2, 'R22_S11', 30, day, 300., 'fell0001', 1)]
+        for i_segment, (stream, sensor, obsHistID, start, cpu_time, host, rc) in enumerate(segments):
+            work_dir = os.path.join(self.work_root, '%06d' % stream, sensor, 'work')
+            if not os.path.isdir(work_dir):
+                os.makedirs(work_dir)
+            record = {'obsHistID': obsHistID, 'sensor': sensor, 'checkpoint': i_segment,
+                      'start': start, 'wall_time': cpu_time + 10., 'cpu_time': cpu_time,
+                      'host': host, 'rc': rc, 'n_objects': 1000*stream}
+            with open(os.path.join(work_dir, runtime_record_file), 'a') as output:
+                output.write(json.dumps(record) + '\n')
+        # a record cut short, and the directories status.py skips
+        with open(os.path.join(work_dir, runtime_record_file), 'a') as output:
+            output.write('{"obsHistID": 3')
+        os.makedirs(os.path.join(self.work_root, '000000', 'archives', 'work'))
+        os.makedirs(os.path.join(self.work_root, 'logs'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_root)
+
+    def test_harvest(self):
+        "Test that the segments of each visit are collected and added up."
+        segments = harvest_phosim_runtimes(self.work_root, host_scale={'hequ': 0.5})
+        self.assertEqual(len(segments), 5)
+        np.testing.assert_array_equal(segments['cpu_time'], [500., 750., 1000., 4000., 300.])
+        visits = visit_runtimes(segments)
+        np.testing.assert_array_equal(visits['obsHistID'], [10, 20, 30])
+        np.testing.assert_array_equal(visits['cpu_time'], [2250., 4000., 300.])
+        np.testing.assert_array_equal(visits['n_segments'], [3, 1, 1])
+        np.testing.assert_array_equal(visits['n_sensors'], [2, 1, 1])
+        np.testing.assert_array_equal(visits['n_failed'], [0, 0, 1])
+        np.testing.assert_array_equal(visits['end'], [2510., 86400. + 4010., 86400. + 310.])
+
+    def test_errors(self):
+        "Test the training set and the history of the prediction errors."
+        visits = visit_runtimes(harvest_phosim_runtimes(self.work_root))
+        training_set = runtime_training_set(visits, FakeCpuPred())
+        np.testing.assert_array_equal(training_set['obsHistID'], [10, 20])
+        np.testing.assert_array_equal(training_set['filter'], [4, 2])
+        np.testing.assert_array_equal(training_set['cputime_fell'], [3000., 4000.])
+        np.testing.assert_array_equal(training_set['predicted'], [1000., 2000.])
+        history = prediction_error_history(training_set)
+        np.testing.assert_array_equal(history['visits'], [1, 1])
+        np.testing.assert_allclose(history['bias'], np.log10([1./3., 0.5]))
+        np.testing.assert_allclose(history['rms'], np.abs(np.log10([1./3., 0.5])))
+        np.testing.assert_array_equal(history['within_2'], [0., 1.])
+        training_set = runtime_training_set(visits, FakeDensityCpuPred())
+        np.testing.assert_array_equal(training_set['predicted'], [1000., 3000.])
+
+    def test_density_forest(self):
+        "Test the predictions of a forest that uses the numbers of objects."
+        # a single tree splitting on the number of objects at 5000
+        forest = ForestModel(feature=[3, 0, 0], threshold=[5000., 0., 0.],
+                             children_left=[1, 1, 2], children_right=[2, 1, 2],
+                             value=[0., 3., 5.], roots=[0], n_features=4)
+        forest_file = os.path.join(self.work_root, 'forest.npz')
+        forest.write(forest_file)
+        opsim_df = pd.DataFrame({'obsHistID': [10, 20], 'filter': ['r', 'i'],
+                                 'moonAlt': [0.1, -0.2], 'moonPhase': [30., 60.]})
+        cpu_pred = CpuPred(rf_pickle_file=forest_file, opsim_df=opsim_df)
+        self.assertTrue(cpu_pred.uses_n_objects)
+        np.testing.assert_array_equal(cpu_pred.predict_many([10, 20, 10],
+                                                            n_objects=[100, 8000, 6000]),
+                                      [1.e3, 1.e5, 1.e5])
+        self.assertRaises(ValueError, cpu_pred.predict_many, [10, 20])
+
+        forest = ForestModel([0], [0.], [0], [0], [3.], [0], 3)
+        forest.write(forest_file)
+        cpu_pred = CpuPred(rf_pickle_file=forest_file, opsim_df=opsim_df)
+        self.assertFalse(cpu_pred.uses_n_objects)
+        np.testing.assert_array_equal(cpu_pred.predict_many([10, 20]), [1.e3, 1.e3])
+        self.assertRaises(ValueError, cpu_pred.predict_many, [10, 20], n_objects=[1, 2])
+
+    @unittest.skipUnless(have_sklearn, 'needs scikit-learn')
+    def test_fit_density_forest(self):
+        "Test that the forest can be fit to the numbers of objects."
+        rng = np.random.RandomState(5)
+        training_set = pd.DataFrame({'filter': rng.randint(6, size=200),
+                                     'moonalt': rng.uniform(-90., 90., 200),
+                                     'moonphase': rng.uniform(0., 100., 200),
+                                     'n_objects': rng.randint(1000, 100000, 200)})
+        training_set['cputime_fell'] = 10.*training_set['n_objects']
+        forest = fit_cpu_forest(training_set, n_estimators=8, use_n_objects=True)
+        self.assertEqual(forest.n_features, 4)
+        self.assertEqual(fit_cpu_forest(training_set, n_estimators=8).n_features, 3)
+        X = training_set[['filter', 'moonalt', 'moonphase', 'n_objects']].values
+        log_ratio = forest.predict(X) - np.log10(training_set['cputime_fell'].values)
+        self.assertLess(np.abs(log_ratio).max(), 0.3)
+        training_set.loc[3, 'n_objects'] = np.nan
+        self.assertRaises(ValueError, fit_cpu_forest, training_set, use_n_objects=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Test code for the SED cache.
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.twinkles import SedCache
+
+class SedCacheTestCase(unittest.TestCase):
+    "TestCase class for SedCache."
+    def setUp(self):
+        self.sed_dir = tempfile.mkdtemp()
+        self.wavelen = np.arange(100., 1500., 1.)
+        self.file_names = []
+        for i_sed in range(3):
+            file_name = os.path.join(self.sed_dir, 'sed_%d.txt' % i_sed)
+            np.savetxt(file_name, np.column_stack((self.wavelen,
+                                                   (i_sed + 1)*np.ones(len(self.wavelen)))))
+            self.file_names.append(file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.sed_dir)
+
+    def test_get(self):
+        "Test that SEDs are read once and shared read-only."
+        cache = SedCache()
+        wavelen, flambda = cache.get(self.file_names[0])
+        np.testing.assert_array_equal(wavelen, self.wavelen)
+        self.assertRaises(ValueError, flambda.__setitem__, 0, 5.)
+        self.assertIs(cache.get(self.file_names[0])[1], flambda)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        sed = cache.get_sed(self.file_names[0])
+        sed.flambda *= 2.
+        np.testing.assert_array_equal(cache.get(self.file_names[0])[1], flambda)
+
+    def test_redshift(self):
+        "Test that redshifted SEDs are keyed by redshift and dimming."
+        cache = SedCache()
+        z_wavelen, _ = cache.get(self.file_names[1], redshift=0.5, dimming=True)
+        np.testing.assert_allclose(z_wavelen, 1.5*self.wavelen)
+        self.assertIsNot(cache.get(self.file_names[1], redshift=0.5)[1],
+                         cache.get(self.file_names[1], redshift=0.5, dimming=True)[1])
+        # the rest frame SED was parsed once for all the redshifts
+        self.assertEqual(len(cache), 3)
+
+    def test_eviction(self):
+        "Test that the least recently used SEDs are dropped."
+        sed_bytes = 2*self.wavelen.nbytes
+        cache = SedCache(max_bytes=2*sed_bytes)
+        cache.get(self.file_names[0])
+        cache.get(self.file_names[1])
+        cache.get(self.file_names[0])
+        cache.get(self.file_names[2])
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        cache.get(self.file_names[0])
+        self.assertEqual(cache.hits, 2)
+        cache.get(self.file_names[1])
+        self.assertEqual(cache.misses, 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Test code for the sharding of catalogs for parallel sprinkling.
+"""
+from __future__ import absolute_import
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from desc.twinkles import shard_by_galtileid, shard_by_sky_tile, ShardedSprinkler
+from desc.twinkles.benchmarks import BenchmarkInputs
+
+class ShardingTestCase(unittest.TestCase):
+    "TestCase class for the sharding functions."
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.galtileid = rng.permutation(10000)*3 + 5
+        self.ra = np.radians(rng.uniform(50.0, 56.0, 10000))
+        self.dec = np.radians(rng.uniform(-30.0, -25.0, 10000))
+
+    def check_partition(self, shards):
+        rows = np.concatenate(shards)
+        np.testing.assert_array_equal(np.sort(rows), np.arange(10000))
+        for shard in shards:
+            self.assertGreater(len(shard), 0)
+            self.assertTrue(np.all(np.diff(shard) > 0))
+
+    def test_galtileid_ranges(self):
+        "Test that the shards are balanced, ordered galtileid ranges."
+        shards = shard_by_galtileid(self.galtileid, 7)
+        self.assertEqual(len(shards), 7)
+        self.check_partition(shards)
+        sizes = [len(shard) for shard in shards]
+        self.assertLessEqual(max(sizes) - min(sizes), 1)
+        for low, high in zip(shards[:-1], shards[1:]):
+            self.assertLess(self.galtileid[low].max(), self.galtileid[high].min())
+        self.assertEqual(len(shard_by_galtileid(self.galtileid[:3], 7)), 3)
+
+    def test_sky_tiles(self):
+        "Test that the tiles cover about tile_size degrees."
+        shards = shard_by_sky_tile(self.ra, self.dec, 1.0)
+        self.check_partition(shards)
+        for shard in shards:
+            self.assertLess(np.degrees(np.ptp(self.dec[shard])), 1.0)
+            self.assertLess(np.degrees(np.ptp(self.ra[shard])), 1.0/np.cos(np.radians(30.0)) + 1.0e-6)
+        # a single tile holds everything
+        self.assertEqual(len(shard_by_sky_tile(self.ra, self.dec, 90.0)), 1)
+
+class ShardedSprinklerTestCase(unittest.TestCase):
+    "TestCase class for ShardedSprinkler."
+    n_rows = 3000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.inputs = BenchmarkInputs(cls.work_dir, n_lenses=200, n_sne_systems=100)
+        chunks = cls.inputs.galaxy_chunks(cls.n_rows, lens_host_fraction=0.05,
+                                          sne_host_fraction=0.02)
+        cls.catalog = chunks.chunk(0, cls.n_rows)
+        cls.cache_files = cls.inputs.write_cache_files(chunks, cls.n_rows)
+        # a few days after the explosion of a SN system in the catalog
+        sne_cache = pd.read_csv(cls.cache_files[1])
+        sne = cls.inputs.sne_catalog
+        cls.visit_mjd = sne['t_start'][sne['twinkles_sysno'] ==
+                                       sne_cache['twinkles_system'][0]].min() + 5.
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def make_sprinkler(self, cached):
+        kwargs = {}
+        if cached:
+            kwargs = {'cached_sprinkling': True, 'agn_cache_file': self.cache_files[0],
+                      'sne_cache_file': self.cache_files[1]}
+        sp = self.inputs.make_sprinkler(self.catalog, **kwargs)
+        sp.visit_mjd = self.visit_mjd
+        return sp
+
+    def test_serial_output(self):
+        "Test that sharded sprinkling gives the output of a serial run."
+        for cached in (False, True):
+            serial = self.make_sprinkler(cached)
+            galtileid = self.catalog[serial._galid_columns()[0]]
+            shards = [self.catalog[rows] for rows in shard_by_galtileid(galtileid, 4)]
+            expected = [serial.sprinkle(shard.copy(), 'r') for shard in shards]
+            self.assertGreater(sum(len(output) for output in expected),
+                               len(self.catalog))
+            for processes in (0, 2):
+                sp = self.make_sprinkler(cached)
+                outputs = ShardedSprinkler(sp, processes=processes).sprinkle(
+                    [shard.copy() for shard in shards], 'r')
+                self.assertEqual(len(outputs), len(expected))
+                for output, expected_output in zip(outputs, expected):
+                    self.assertEqual(output.dtype, expected_output.dtype)
+                    self.assertEqual(output.tobytes(), expected_output.tobytes())
+                self.assertEqual(sp.used_systems, serial.used_systems)
+                if cached:
+                    self.assertGreater(len(sp.used_systems), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Test code for the lensed SN SED writer.
+"""
+from __future__ import absolute_import
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.twinkles import SNSedWriter, sed_checksum, sed_file_checksum
+
+class SNSedWriterTestCase(unittest.TestCase):
+    "TestCase class for SNSedWriter."
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.wavelen = np.arange(30., 1800., 0.1)
+        self.flambda = np.exp(-((self.wavelen - 500.)/200.)**2)*1.e-17
+        self.file_name = os.path.join(self.out_dir, 'specFileGLSN_1_0_60000.0000.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_write(self):
+        "Test that the gzipped SED holds the SED and its checksum."
+        writer = SNSedWriter()
+        gz_name = writer.write(self.file_name, self.wavelen, self.flambda)
+        self.assertEqual(gz_name, self.file_name + '.gz')
+        self.assertFalse(os.path.exists(self.file_name))
+        self.assertEqual(sed_file_checksum(gz_name),
+                         sed_checksum(self.wavelen, self.flambda))
+        with gzip.open(gz_name, 'rb') as input_file:
+            data = np.loadtxt(input_file)
+        np.testing.assert_allclose(data[:, 0], self.wavelen, atol=0.005)
+        np.testing.assert_allclose(data[:, 1], self.flambda, rtol=1.e-6, atol=1.e-30)
+
+    def test_skip(self):
+        "Test that unchanged SEDs are not rewritten and changed ones are."
+        writer = SNSedWriter()
+        gz_name = writer.write(self.file_name, self.wavelen, self.flambda)
+        mtime = os.path.getmtime(gz_name)
+        writer.write(self.file_name, self.wavelen, self.flambda)
+        self.assertEqual((writer.written, writer.skipped), (1, 1))
+        self.assertEqual(os.path.getmtime(gz_name), mtime)
+        writer.write(self.file_name, self.wavelen, 2.*self.flambda)
+        self.assertEqual((writer.written, writer.skipped), (2, 1))
+        self.assertEqual(sed_file_checksum(gz_name),
+                         sed_checksum(self.wavelen, 2.*self.flambda))
+
+    def test_pool(self):
+        "Test that the worker processes write the same files."
+        with SNSedWriter(processes=2) as writer:
+            for i_img in range(4):
+                writer.write(self.file_name.replace('_0_', '_%d_' % i_img),
+                             self.wavelen, (i_img + 1)*self.flambda)
+        for i_img in range(4):
+            gz_name = self.file_name.replace('_0_', '_%d_' % i_img) + '.gz'
+            self.assertEqual(sed_file_checksum(gz_name),
+                             sed_checksum(self.wavelen, (i_img + 1)*self.flambda))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Test code for the SEDs of the lensed SN systems.
+"""
+from __future__ import absolute_import
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.twinkles import SNSystemSED
+from desc.twinkles.benchmarks import BenchmarkInputs
+
+class SNSystemSEDTestCase(unittest.TestCase):
+    "TestCase class for sprinkler.create_sn_system_seds."
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        inputs = BenchmarkInputs(self.work_dir, n_lenses=20, n_sne_systems=20)
+        self.sp = inputs.make_sprinkler(inputs.galaxy_chunks(100).chunk(0, 100))
+        sne = inputs.sne_catalog
+        n_img = sne.groupby('twinkles_sysno').size()
+        self.system_df = sne[sne['twinkles_sysno'] == n_img.idxmax()]
+        rng = np.random.RandomState(3)
+        self.ra = np.radians(53.0 + rng.uniform(-0.5, 0.5, len(self.system_df)))
+        self.dec = np.radians(-27.4 + rng.uniform(-0.5, 0.5, len(self.system_df)))
+        self.sed_dirs = {}
+        for path in ('system', 'image'):
+            self.sed_dirs[path] = os.path.join(self.work_dir, path)
+            os.makedirs(self.sed_dirs[path])
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def read_sed(self, path, sn_name):
+        with gzip.open(os.path.join(self.sed_dirs[path], sn_name + '.gz'), 'rb') as input_file:
+            return np.loadtxt(input_file)
+
+    def test_images(self):
+        "Test that the system SEDs are those of create_sn_sed for each image."
+        t_start = self.system_df['t_start'].values
+        n_added = 0
+        # before, during and after the explosion, with images outside of
+        # the time range of the model
+        for sed_mjd in (t_start.min() - 30., t_start.min() + 3., t_start.max() + 10.,
+                        t_start.max() + 80.):
+            self.sp.sed_path = self.sed_dirs['system']
+            add_to_cat, sn_magnorm, sn_name, sn_param_dicts = \
+                self.sp.create_sn_system_seds(self.system_df, self.ra, self.dec, sed_mjd)
+            self.sp.sed_path = self.sed_dirs['image']
+            for i_img in range(len(self.system_df)):
+                image = self.sp.create_sn_sed(self.system_df.iloc[i_img], self.ra[i_img],
+                                              self.dec[i_img], sed_mjd)
+                self.assertEqual(add_to_cat[i_img], image[0])
+                self.assertEqual(sn_name[i_img], image[2])
+                self.assertEqual(sn_param_dicts[i_img], image[3])
+                if not image[0]:
+                    self.assertTrue(np.isnan(sn_magnorm[i_img]))
+                    continue
+                n_added += 1
+                self.assertTrue(np.isfinite(sn_magnorm[i_img]))
+                self.assertEqual(sn_magnorm[i_img], image[1])
+                system_sed = self.read_sed('system', sn_name[i_img])
+                self.assertTrue(np.all(system_sed[:, 1] >= 0.))
+                np.testing.assert_allclose(system_sed, self.read_sed('image', image[2]),
+                                           rtol=1.e-6, atol=0.)
+        self.assertGreater(n_added, 0)
+
+    def test_positions(self):
+        "Test that the states of the images keep their exact positions."
+        system_sed = SNSystemSED(self.sp.sn_obj, self.system_df)
+        rng = np.random.RandomState(4)
+        for _ in range(20):
+            ra = np.radians(53.0 + rng.uniform(-0.5, 0.5, len(self.system_df)))
+            dec = np.radians(-27.4 + rng.uniform(-0.5, 0.5, len(self.system_df)))
+            states = system_sed.set_positions(ra, dec)
+            self.assertEqual([state['_ra'] for state in states], list(ra))
+            self.assertEqual([state['_dec'] for state in states], list(dec))
+            self.assertEqual([state['t0'] for state in states],
+                             list(self.system_df['t_start'].values))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,322 @@
+"""
+Test code for the sprinkler, run on the synthetic inputs of the sprinkler
+benchmarks.
+"""
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from desc.twinkles import (SprinklerRegistry, sprinkler_registry, get_sprinkler,
+                           sed_file_checksum, VariabilityTwinkles, var_param_column,
+                           sprinklerCompound, GalaxyCacheSprinklerObj)
+from desc.twinkles.benchmarks import BenchmarkInputs
+
+class SprinklerTestCase(unittest.TestCase):
+    "Base class of the sprinkler test cases."
+    n_rows = 3000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.inputs = {}
+        cls.catalogs = {}
+        cls.cache_files = {}
+        cls.visit_mjds = {}
+        for layout in ('dc2', 'catsim'):
+            inputs = BenchmarkInputs(cls.work_dir, layout=layout, n_lenses=200,
+                                     n_sne_systems=100)
+            chunks = inputs.galaxy_chunks(cls.n_rows, lens_host_fraction=0.05,
+                                          sne_host_fraction=0.02)
+            cls.inputs[layout] = inputs
+            cls.catalogs[layout] = chunks.chunk(0, cls.n_rows)
+            cls.cache_files[layout] = inputs.write_cache_files(chunks, cls.n_rows)
+            # a visit with no SN to show and one a few days after the
+            # explosion of a SN system in the catalog
+            sne_cache = pd.read_csv(cls.cache_files[layout][1])
+            t_start = inputs.sne_catalog['t_start'][inputs.sne_catalog['twinkles_sysno'] ==
+                                                    sne_cache['twinkles_system'][0]]
+            cls.visit_mjds[layout] = (50000., t_start.min() + 5.)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def sprinkler_kwargs(self, layout, cached):
+        if not cached:
+            return {}
+        agn_cache_file, sne_cache_file = self.cache_files[layout]
+        return {'cached_sprinkling': True, 'agn_cache_file': agn_cache_file,
+                'sne_cache_file': sne_cache_file}
+
+    def sprinkled(self, layout, visit_mjd, band, **kwargs):
+        "Sprinkle a copy of the catalog of a layout with a new sprinkler."
+        catalog = self.catalogs[layout]
+        sp = self.inputs[layout].make_sprinkler(catalog, **kwargs)
+        sp.visit_mjd = visit_mjd
+        return sp.sprinkle(catalog.copy(), band)
+
+    def image_counts(self, layout, sprinkled):
+        "Return the numbers of lensed AGN and SN images in a sprinkled catalog."
+        defs = dict(self.inputs[layout].defs)
+        images = sprinkled[len(self.catalogs[layout]):]
+        var_params = images[defs['galaxyAgn_varParamStr']]
+        n_agn = sum('applyAgnTimeDelay' in var_str for var_str in var_params)
+        return n_agn, len(images) - n_agn
+
+class BatchModeTestCase(SprinklerTestCase):
+    "TestCase class for the columnar path of sprinkler.sprinkle()."
+    def test_same_output(self):
+        "Test that batch mode gives the catalog of the per-row path."
+        for layout in ('dc2', 'catsim'):
+            for cached in (False, True):
+                kwargs = self.sprinkler_kwargs(layout, cached)
+                n_sne = 0
+                for visit_mjd, band in zip(self.visit_mjds[layout], ('r', 'i')):
+                    rows = self.sprinkled(layout, visit_mjd, band, **kwargs)
+                    batch = self.sprinkled(layout, visit_mjd, band, batch_mode=True, **kwargs)
+                    n_images = self.image_counts(layout, rows)
+                    self.assertGreater(n_images[0], 0)
+                    n_sne += n_images[1]
+                    self.assertEqual(batch.dtype, rows.dtype)
+                    self.assertEqual(len(batch), len(rows))
+                    self.assertEqual(batch.tobytes(), rows.tobytes())
+                self.assertGreater(n_sne, 0)
+
+class TypedVarParamsTestCase(SprinklerTestCase):
+    "TestCase class for the typed variability columns of the sprinkled catalogs."
+    def test_image_var_params(self):
+        "Test that the JSON of the lensed images is rendered from their typed columns."
+        for layout in ('dc2', 'catsim'):
+            defs = dict(self.inputs[layout].defs)
+            var_col = defs['galaxyAgn_varParamStr']
+            n_in = len(self.catalogs[layout])
+            for batch_mode in (False, True):
+                kwargs = dict(self.sprinkler_kwargs(layout, True), batch_mode=batch_mode)
+                visit_mjd = self.visit_mjds[layout][1]
+                expected = self.sprinkled(layout, visit_mjd, 'r', **kwargs)
+                unrendered = self.sprinkled(layout, visit_mjd, 'r', typed_var_params=True,
+                                            **kwargs)
+                typed = self.sprinkled(layout, visit_mjd, 'r', typed_var_params=True,
+                                       render_var_param_json=True, **kwargs)
+                self.assertEqual(unrendered[:n_in].tobytes(), typed[:n_in].tobytes())
+                self.assertEqual(len(typed), len(expected))
+                np.testing.assert_array_equal(typed[var_col][:n_in], expected[var_col][:n_in])
+                delays = typed[var_param_column(var_col, 't0Delay')]
+                n_agn = 0
+                for i_row in range(n_in, len(typed)):
+                    if expected[var_col][i_row] == 'None':
+                        self.assertEqual(typed[var_col][i_row], 'None')
+                        continue
+                    n_agn += 1
+                    var_dict = json.loads(typed[var_col][i_row])
+                    expected_dict = json.loads(expected[var_col][i_row])
+                    self.assertEqual(var_dict[defs['varMethodName']], 'applyAgnTimeDelay')
+                    self.assertEqual(set(var_dict[defs['pars']]), set(expected_dict[defs['pars']]))
+                    for field, value in expected_dict[defs['pars']].items():
+                        self.assertAlmostEqual(var_dict[defs['pars']][field], value)
+                    self.assertEqual(var_dict[defs['pars']]['t0Delay'], delays[i_row])
+                    # without rendering the images keep the JSON of their host
+                    self.assertNotIn('t0Delay', json.loads(unrendered[var_col][i_row])[defs['pars']])
+                self.assertGreater(n_agn, 0)
+
+    def test_hosts_parsed(self):
+        "Test that only the JSON of the lens hosts is parsed."
+        for layout in ('dc2', 'catsim'):
+            rows = self.sprinkled(layout, self.visit_mjds[layout][0], 'r', typed_var_params=True)
+            for batch_mode in (False, True):
+                defs = dict(self.inputs[layout].defs)
+                var_col = defs['galaxyAgn_varParamStr']
+                catalog = self.catalogs[layout]
+                n_in = len(catalog)
+                typed = self.sprinkled(layout, self.visit_mjds[layout][0], 'r',
+                                       typed_var_params=True, batch_mode=batch_mode)
+                self.assertEqual(typed.tobytes(), rows.tobytes())
+                method = typed[var_param_column(var_col, 'method')]
+                parsed = np.where(method[:n_in] != '')[0]
+                self.assertGreater(len(parsed), 0)
+                # the parsed rows are the AGN hosts turned into lens galaxies
+                self.assertTrue(np.all(np.isnan(typed[defs['galaxyAgn_magNorm']][parsed])))
+                self.assertTrue(np.all(method[parsed] == 'applyAgn'))
+                is_agn = np.array([var_str != 'None' for var_str in catalog[var_col]])
+                self.assertLess(len(parsed), is_agn.sum())
+
+    def test_mixin(self):
+        "Test that the variability mixin reads the typed columns of a sprinkled chunk."
+        for layout in ('dc2', 'catsim'):
+            defs = dict(self.inputs[layout].defs)
+            var_col = defs['galaxyAgn_varParamStr']
+            typed = self.sprinkled(layout, self.visit_mjds[layout][0], 'r',
+                                   typed_var_params=True)
+            expected = self.sprinkled(layout, self.visit_mjds[layout][0], 'r')
+            mixin = VariabilityTwinkles()
+            mixin._current_chunk = typed
+            method, params = mixin._typed_var_params()
+            lensed = np.where(method == 'applyAgnTimeDelay')[0]
+            self.assertGreater(len(lensed), 0)
+            for i_row in lensed:
+                pars = json.loads(expected[var_col][i_row])[defs['pars']]
+                self.assertEqual(params['seed'][i_row], pars['seed'])
+                self.assertEqual(params['t0Delay'][i_row], pars['t0Delay'])
+                self.assertEqual(params['agn_tau'][i_row], pars['agn_tau'])
+            mixin._current_chunk = self.catalogs[layout]
+            self.assertIsNone(mixin._typed_var_params())
+
+class FinalPassTestCase(SprinklerTestCase):
+    "TestCase class for the _final_pass of the sprinkling CatalogDBObjects."
+    def final_pass_object(self, dbo_class, layout):
+        # the CatalogDBObjects are not connected to a database: _final_pass
+        # only needs the sprinkler configuration
+        inputs = self.inputs[layout]
+        dbo = dbo_class.__new__(dbo_class)
+        dbo.mjd = self.visit_mjds[layout][1]
+        dbo.specFileMap = inputs.spec_file_map
+        dbo.sed_path = inputs.sed_path
+        dbo.defs_file = inputs.defs_file
+        return dbo
+
+    def test_defaults(self):
+        "Test that the catalog band must be set and is then used."
+        layout = 'catsim'
+        try:
+            for dbo_class in (sprinklerCompound, GalaxyCacheSprinklerObj):
+                dbo = self.final_pass_object(dbo_class, layout)
+                self.assertIsNone(dbo.catalog_band)
+                self.assertRaises(AttributeError, dbo._final_pass, self.catalogs[layout].copy())
+            dbo.om10_cat = self.inputs[layout].om10_cat
+            dbo.sne_cat = self.inputs[layout].sne_cat
+            dbo.catalog_band = 'i'
+            sprinkled = dbo._final_pass(self.catalogs[layout].copy())
+            self.assertGreater(sum(self.image_counts(layout, sprinkled)), 0)
+            dbo.catalog_band = 'v'
+            self.assertRaises(ValueError, dbo._final_pass, self.catalogs[layout].copy())
+        finally:
+            sprinkler_registry.clear()
+
+class MemoryReportTestCase(SprinklerTestCase):
+    "TestCase class for the output buffer of batch mode and its memory report."
+    def test_memory_report(self):
+        "Test the record of the output buffers of the chunks."
+        layout = 'dc2'
+        catalog = self.catalogs[layout]
+        sp = self.inputs[layout].make_sprinkler(catalog, batch_mode=True)
+        self.assertEqual(sp.memory_report(),
+                         'sprinkler: no chunk sprinkled in batch mode yet')
+        max_buffer_bytes = 0
+        for visit_mjd, n_rows in zip(self.visit_mjds[layout], (self.n_rows, self.n_rows//2)):
+            sp.visit_mjd = visit_mjd
+            input_catalog = catalog[:n_rows].copy()
+            sprinkled = sp.sprinkle(input_catalog, 'r')
+            # the input is copied into the buffer, not modified
+            self.assertEqual(input_catalog.tobytes(), catalog[:n_rows].tobytes())
+            mem = sp.chunk_memory
+            self.assertEqual(mem['rows_in'], n_rows)
+            self.assertEqual(mem['rows_out'], len(sprinkled))
+            # the output is the head of the buffer, whose last rows are
+            # left unused by the SN images dropped at the visit
+            self.assertEqual(sprinkled.base.nbytes, mem['buffer_bytes'])
+            self.assertGreaterEqual(mem['buffer_bytes'], sprinkled.nbytes)
+            self.assertGreater(mem['process_peak_rss_bytes'], 0)
+            max_buffer_bytes = max(max_buffer_bytes, mem['buffer_bytes'])
+            self.assertEqual(sp.max_buffer_bytes, max_buffer_bytes)
+            report = sp.memory_report()
+            self.assertTrue(report.startswith('sprinkler: %d rows in, %d rows out, '
+                                              'output buffer %.1f MB (max %.1f MB)' %
+                                              (n_rows, len(sprinkled),
+                                               mem['buffer_bytes']/2.**20,
+                                               max_buffer_bytes/2.**20)))
+            self.assertIn('process peak RSS', report)
+
+class SprinklerRegistryTestCase(SprinklerTestCase):
+    "TestCase class for SprinklerRegistry."
+    def registry_get(self, registry, layout, visit_mjd, sed_path=None, **kwargs):
+        inputs = self.inputs[layout]
+        if sed_path is None:
+            sed_path = inputs.sed_path
+        return registry.get(self.catalogs[layout], visit_mjd, inputs.spec_file_map,
+                            sed_path, **inputs.sprinkler_kwargs(**kwargs))
+
+    def test_reuse(self):
+        "Test that a configuration gets the same sprinkler for every visit."
+        registry = SprinklerRegistry()
+        layout = 'dc2'
+        visit_mjds = self.visit_mjds[layout]
+        sp = self.registry_get(registry, layout, visit_mjds[0])
+        self.assertEqual(sp.visit_mjd, visit_mjds[0])
+        self.assertIs(self.registry_get(registry, layout, visit_mjds[1]), sp)
+        self.assertEqual(sp.visit_mjd, visit_mjds[1])
+        self.assertIsNot(self.registry_get(registry, layout, visit_mjds[1],
+                                           batch_mode=True), sp)
+        self.assertIsNot(self.registry_get(registry, 'catsim', visit_mjds[1]), sp)
+        self.assertEqual(len(registry), 3)
+
+        inputs = self.inputs[layout]
+        try:
+            sp = get_sprinkler(self.catalogs[layout], visit_mjds[0], inputs.spec_file_map,
+                               inputs.sed_path, **inputs.sprinkler_kwargs())
+            self.assertIs(get_sprinkler(self.catalogs[layout], visit_mjds[1],
+                                        inputs.spec_file_map, inputs.sed_path,
+                                        **inputs.sprinkler_kwargs()), sp)
+            self.assertEqual(sprinkler_registry.hits, 1)
+        finally:
+            sprinkler_registry.clear()
+
+    def test_used_systems(self):
+        "Test that a reused sprinkler sprinkles a visit as a new one does."
+        registry = SprinklerRegistry()
+        layout = 'dc2'
+        visit_mjd = self.visit_mjds[layout][1]
+        # only cached sprinkling records the systems it places
+        kwargs = self.sprinkler_kwargs(layout, True)
+        sp = self.registry_get(registry, layout, visit_mjd, **kwargs)
+        first = sp.sprinkle(self.catalogs[layout].copy(), 'r')
+        self.assertGreater(len(sp.used_systems), 0)
+        self.assertIs(self.registry_get(registry, layout, visit_mjd, **kwargs), sp)
+        self.assertEqual(sp.used_systems, [])
+        second = sp.sprinkle(self.catalogs[layout].copy(), 'r')
+        self.assertEqual(second.tobytes(), first.tobytes())
+        self.assertEqual(second.tobytes(),
+                         self.sprinkled(layout, visit_mjd, 'r', **kwargs).tobytes())
+
+    def test_stats(self):
+        "Test the counts of the hits and misses and the time saved."
+        registry = SprinklerRegistry()
+        self.assertEqual(registry.hit_rate, 0.)
+        self.assertEqual(registry.time_saved, 0.)
+        for layout in ('dc2', 'catsim', 'dc2', 'dc2', 'catsim'):
+            self.registry_get(registry, layout, self.visit_mjds[layout][0])
+        stats = registry.stats()
+        self.assertEqual(stats['sprinklers'], 2)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 2)
+        self.assertAlmostEqual(stats['hit_rate'], 0.6)
+        self.assertGreater(stats['init_time'], 0.)
+        self.assertAlmostEqual(stats['time_saved'], 1.5*stats['init_time'])
+        registry.clear()
+        self.assertEqual(registry.stats(), {'sprinklers': 0, 'hits': 0, 'misses': 0,
+                                            'hit_rate': 0., 'init_time': 0.,
+                                            'time_saved': 0.})
+
+    def test_clear(self):
+        "Test that clear() closes the sprinklers once their SEDs are written."
+        registry = SprinklerRegistry()
+        layout = 'dc2'
+        sed_path = tempfile.mkdtemp(dir=self.work_dir)
+        sp = self.registry_get(registry, layout, self.visit_mjds[layout][1],
+                               sed_path=sed_path, sed_processes=1)
+        sp.sprinkle(self.catalogs[layout].copy(), 'r')
+        self.assertIsNotNone(sp.sed_writer._pool)
+        self.assertGreater(sp.sed_writer.written, 0)
+        registry.clear()
+        self.assertEqual(len(registry), 0)
+        self.assertIsNone(sp.sed_writer._pool)
+        sed_files = os.listdir(sed_path)
+        self.assertGreater(len(sed_files), 0)
+        for sed_file in sed_files:
+            self.assertIsNotNone(sed_file_checksum(os.path.join(sed_path, sed_file)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Test code for the phase timers and counters of the sprinkler.
+"""
+from __future__ import absolute_import
+import time
+import unittest
+from desc.twinkles import SprinklerProfiler, sprinkler_phases, sprinkler_counters
+
+class SprinklerProfilerTestCase(unittest.TestCase):
+    "TestCase class for SprinklerProfiler."
+    def sprinkle_chunk(self, profiler, visit_mjd, n_images):
+        profiler.start_chunk(visit_mjd, 100)
+        with profiler.phase('row_construction'):
+            time.sleep(0.02)
+            with profiler.phase('sn_sed'):
+                time.sleep(0.01)
+        profiler.count('agn_images', n_images)
+        profiler.end_chunk(100 + n_images)
+
+    def test_disabled(self):
+        "Test that a disabled profiler records nothing."
+        profiler = SprinklerProfiler()
+        self.sprinkle_chunk(profiler, 60000., 4)
+        self.assertIsNone(profiler.chunk_summary())
+        self.assertIsNone(profiler.visit_summary())
+        self.assertIs(profiler.phase('json'), profiler.phase('sn_sed'))
+
+    def test_nested_phases(self):
+        "Test that the time of a phase excludes the phases inside it."
+        profiler = SprinklerProfiler(enabled=True)
+        self.sprinkle_chunk(profiler, 60000., 4)
+        chunk = profiler.chunk_summary()
+        self.assertEqual(set(chunk['phases']), set(sprinkler_phases))
+        self.assertEqual(set(chunk['counters']), set(sprinkler_counters))
+        self.assertGreaterEqual(chunk['phases']['row_construction'], 0.015)
+        self.assertGreaterEqual(chunk['phases']['sn_sed'], 0.01)
+        self.assertLessEqual(sum(chunk['phases'].values()), chunk['wall_time'])
+        self.assertEqual(chunk['counters']['agn_images'], 4)
+        self.assertEqual(chunk['rows_out'], 104)
+
+    def test_visit_summary(self):
+        "Test that the chunks of a visit add up."
+        profiler = SprinklerProfiler(enabled=True)
+        with profiler.phase('om10_load'):
+            pass
+        self.sprinkle_chunk(profiler, 60000., 4)
+        self.sprinkle_chunk(profiler, 60000., 2)
+        self.sprinkle_chunk(profiler, 60001., 8)
+        visit = profiler.visit_summary(60000.)
+        self.assertEqual(visit['chunks'], 2)
+        self.assertEqual(visit['rows_in'], 200)
+        self.assertEqual(visit['rows_out'], 206)
+        self.assertEqual(visit['counters']['agn_images'], 6)
+        self.assertEqual(profiler.visit_summary()['visit_mjd'], 60001.)
+        summary = profiler.summary()
+        self.assertEqual([v['visit_mjd'] for v in summary['visits']], [60000., 60001.])
+        self.assertGreater(summary['init']['phases']['om10_load'], 0.)
+        self.assertEqual(summary['init']['phases']['sn_sed'], 0.)
+        profiler.reset()
+        self.assertIsNone(profiler.visit_summary())
+        self.assertIs(profiler.summary()['init'], summary['init'])
+
+if __name__ == '__main__':
+    unittest.main()
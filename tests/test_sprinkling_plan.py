@@ -0,0 +1,118 @@
+"""
+Test code for the storage of sprinkling plans.
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from desc.twinkles import SprinklingPlan
+from desc.twinkles.benchmarks import BenchmarkInputs
+
+class SprinklingPlanTestCase(unittest.TestCase):
+    "TestCase class for SprinklingPlan."
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.n_img = np.array([2, 4, 2])
+        n_images = self.n_img.sum()
+        self.plan = SprinklingPlan(['redshift', 'varParamStr'],
+                                   host_galtileid=[30, 10, 20],
+                                   host_kind=[0, 0, 1],
+                                   host_system=[5001, 5002, 1000],
+                                   host_n_img=self.n_img,
+                                   host_band_mag_norm=np.arange(18.).reshape(3, 6),
+                                   host_columns={'redshift': np.array([0.1, 0.2, 0.3]),
+                                                 'varParamStr': np.array(['a', 'b', 'None'])},
+                                   image_columns={'redshift': np.linspace(1., 2., n_images),
+                                                  'varParamStr': np.array(['x%d' % i for i in range(n_images)])},
+                                   image_sne_row=[-1]*6 + [7, 8])
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_layout(self):
+        "Test the image ranges of the hosts."
+        self.assertEqual(len(self.plan), 3)
+        self.assertEqual(self.plan.n_images, 8)
+        np.testing.assert_array_equal(self.plan.host_img_start, [0, 2, 6])
+
+    def test_round_trip(self):
+        "Test that a plan is unchanged by writing and reading it."
+        plan_file = os.path.join(self.work_dir, 'plan.npz')
+        self.plan.write(plan_file)
+        plan = SprinklingPlan.read(plan_file)
+        self.assertEqual(plan.columns, self.plan.columns)
+        self.assertEqual(plan.typed_var_params, self.plan.typed_var_params)
+        for attr in ('host_galtileid', 'host_kind', 'host_system', 'host_n_img',
+                     'host_band_mag_norm', 'image_sne_row'):
+            np.testing.assert_array_equal(getattr(plan, attr), getattr(self.plan, attr))
+        for name in self.plan.columns:
+            np.testing.assert_array_equal(plan.host_columns[name], self.plan.host_columns[name])
+            np.testing.assert_array_equal(plan.image_columns[name], self.plan.image_columns[name])
+
+    def test_duplicate_hosts(self):
+        "Test that a galaxy cannot host two systems."
+        self.assertRaises(ValueError, SprinklingPlan, [], [1, 1], [0, 1], [5, 6],
+                          [2, 2], np.zeros((2, 6)), {}, {}, [-1]*4)
+
+class SprinklingPlanApplyTestCase(unittest.TestCase):
+    "TestCase class for sprinkling with a plan."
+    n_rows = 3000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.inputs = BenchmarkInputs(cls.work_dir, n_lenses=200, n_sne_systems=100)
+        chunks = cls.inputs.galaxy_chunks(cls.n_rows, lens_host_fraction=0.05,
+                                          sne_host_fraction=0.02)
+        cls.catalog = chunks.chunk(0, cls.n_rows)
+        cls.cache_files = cls.inputs.write_cache_files(chunks, cls.n_rows)
+        # a visit with no SN to show and one a few days after the
+        # explosion of a SN system in the catalog
+        sne_cache = pd.read_csv(cls.cache_files[1])
+        sne = cls.inputs.sne_catalog
+        cls.visit_mjds = (50000., sne['t_start'][sne['twinkles_sysno'] ==
+                                                 sne_cache['twinkles_system'][0]].min() + 5.)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def sprinkler_kwargs(self, cached, **kwargs):
+        if cached:
+            kwargs.update({'cached_sprinkling': True, 'agn_cache_file': self.cache_files[0],
+                           'sne_cache_file': self.cache_files[1]})
+        return kwargs
+
+    def test_sprinkle(self):
+        "Test that applying a plan gives the output of sprinkle()."
+        for cached in (False, True):
+            for typed_var_params in (False, True):
+                kwargs = self.sprinkler_kwargs(cached, typed_var_params=typed_var_params)
+                plan = SprinklingPlan.build(self.inputs.make_sprinkler(self.catalog, **kwargs),
+                                            [self.catalog])
+                self.assertGreater(len(plan), 0)
+                plan_file = os.path.join(self.work_dir, 'plan.npz')
+                plan.write(plan_file)
+                for visit_mjd, band in zip(self.visit_mjds, ('r', 'i')):
+                    sp = self.inputs.make_sprinkler(self.catalog, **kwargs)
+                    sp.visit_mjd = visit_mjd
+                    expected = sp.sprinkle(self.catalog.copy(), band)
+                    sp = self.inputs.make_sprinkler(self.catalog, plan_file=plan_file,
+                                                    **kwargs)
+                    sp.visit_mjd = visit_mjd
+                    sprinkled = sp.sprinkle(self.catalog.copy(), band)
+                    self.assertEqual(sprinkled.dtype, expected.dtype)
+                    self.assertEqual(len(sprinkled), len(expected))
+                    self.assertEqual(sprinkled.tobytes(), expected.tobytes())
+
+    def test_typed_var_params(self):
+        "Test that a plan is only applied with its typed_var_params."
+        plan = SprinklingPlan.build(self.inputs.make_sprinkler(self.catalog), [self.catalog])
+        sp = self.inputs.make_sprinkler(self.catalog, typed_var_params=True)
+        self.assertRaises(ValueError, plan.apply, sp, self.catalog, 'r')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Test code for the typed variability parameter columns.
+"""
+from __future__ import absolute_import
+import json
+import unittest
+import numpy as np
+from desc.twinkles import (add_var_param_columns, parse_var_params, render_var_params,
+                           clear_var_params, var_param_column, find_var_param_column)
+
+class VarParamsTestCase(unittest.TestCase):
+    "TestCase class for the typed variability parameters."
+    def setUp(self):
+        pars = {'seed': 17, 'agn_tau': 120.5, 'agn_sfu': 0.4, 'agn_sfg': 0.3,
+                'agn_sfr': 0.25, 'agn_sfi': 0.2, 'agn_sfz': 0.18, 'agn_sfy': 0.15}
+        lensed = dict(pars, t0Delay=-12.25)
+        self.catalog = np.zeros(3, dtype=[('galaxy_id', int), ('varParamStr', 'U300')])
+        self.catalog['galaxy_id'] = [1, 2, 3]
+        self.catalog['varParamStr'] = [json.dumps({'m': 'applyAgn', 'p': pars}),
+                                       'None',
+                                       json.dumps({'m': 'applyAgnTimeDelay', 'p': lensed})]
+
+    def test_columns(self):
+        "Test that the typed columns hold the JSON parameters."
+        typed = add_var_param_columns(self.catalog, 'varParamStr')
+        np.testing.assert_array_equal(typed['galaxy_id'], self.catalog['galaxy_id'])
+        np.testing.assert_array_equal(typed[var_param_column('varParamStr', 'method')],
+                                      ['applyAgn', '', 'applyAgnTimeDelay'])
+        np.testing.assert_array_equal(typed['varParamStr_seed'], [17, 0, 17])
+        np.testing.assert_array_equal(typed['varParamStr_t0Delay'], [0., 0., -12.25])
+        self.assertTrue(np.isnan(typed['varParamStr_agn_tau'][1]))
+        self.assertEqual(typed['varParamStr_agn_sfr'][2], 0.25)
+        self.assertIs(add_var_param_columns(typed, 'varParamStr'), typed)
+
+    def test_parse_rows(self):
+        "Test that only the selected rows are parsed."
+        typed = add_var_param_columns(self.catalog, 'varParamStr', rows=[2])
+        np.testing.assert_array_equal(typed['varParamStr_method'], ['', '', 'applyAgnTimeDelay'])
+        self.assertTrue(np.isnan(typed['varParamStr_agn_tau'][0]))
+        parse_var_params(typed, 'varParamStr', [0])
+        np.testing.assert_array_equal(typed['varParamStr_method'],
+                                      ['applyAgn', '', 'applyAgnTimeDelay'])
+        self.assertEqual(typed['varParamStr_agn_tau'][0], 120.5)
+        self.assertEqual(typed['varParamStr_t0Delay'][0], 0.)
+
+    def test_find_column(self):
+        "Test that the JSON column of the typed columns is found by its name."
+        self.assertIsNone(find_var_param_column(self.catalog))
+        self.assertEqual(find_var_param_column(add_var_param_columns(self.catalog, 'varParamStr')),
+                         'varParamStr')
+        catalog = self.catalog.astype([('galaxy_id', int), ('galaxyAgn_varParamStr', 'U300')])
+        self.assertEqual(find_var_param_column(add_var_param_columns(catalog,
+                                                                     'galaxyAgn_varParamStr')),
+                         'galaxyAgn_varParamStr')
+
+    def test_render(self):
+        "Test that rendering the typed columns gives back the parameters."
+        typed = add_var_param_columns(self.catalog, 'varParamStr')
+        typed['varParamStr_t0Delay'][0] = 3.5
+        typed['varParamStr_method'][0] = 'applyAgnTimeDelay'
+        clear_var_params(typed, 'varParamStr', [2])
+        render_var_params(typed, 'varParamStr')
+        self.assertEqual(typed['varParamStr'][1], 'None')
+        self.assertEqual(typed['varParamStr'][2], 'None')
+        var_dict = json.loads(typed['varParamStr'][0])
+        self.assertEqual(var_dict['m'], 'applyAgnTimeDelay')
+        self.assertEqual(var_dict['p']['t0Delay'], 3.5)
+        self.assertEqual(var_dict['p']['agn_tau'], 120.5)
+        self.assertEqual(var_dict['p']['seed'], 17)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Test code for the submission plans of phoSim visits.
+"""
+from __future__ import absolute_import, division
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.twinkles import schedule_visits, write_visit_list
+
+class VisitSchedulerTestCase(unittest.TestCase):
+    "TestCase class for schedule_visits."
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(12)
+        self.obsHistID = np.arange(200) + 1000
+        self.predicted = rng.lognormal(2., 1., 200)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_lpt(self):
+        "Test that the longest visits go first, each to the slot free first."
+        plan = schedule_visits([1, 2, 3, 4, 5], [3., 5., 2., 2., 4.], 2)
+        np.testing.assert_array_equal(plan.obsHistID, [2, 5, 1, 3, 4])
+        np.testing.assert_array_equal(plan.slot, [0, 1, 1, 0, 0])
+        np.testing.assert_array_equal(plan.start, [0., 0., 4., 5., 7.])
+        self.assertEqual(plan.makespan, 9.)
+        np.testing.assert_array_equal(plan.slot_load, [9., 7.])
+        self.assertAlmostEqual(plan.utilization, 16./18.)
+
+    def test_plan(self):
+        "Test that the plan keeps the slots busy and within the bounds of LPT."
+        n_slots = 16
+        plan = schedule_visits(self.obsHistID, self.predicted, n_slots)
+        self.assertEqual(sorted(plan.obsHistID), sorted(self.obsHistID))
+        for i_slot in range(n_slots):
+            visits = np.where(plan.slot == i_slot)[0]
+            np.testing.assert_allclose(plan.start[visits[1:]], plan.end[visits[:-1]])
+        lower_bound = max(self.predicted.max(), self.predicted.sum()/n_slots)
+        self.assertGreaterEqual(plan.makespan, lower_bound)
+        self.assertLessEqual(plan.makespan, lower_bound*(4./3. - 1./(3.*n_slots)))
+        self.assertAlmostEqual(plan.utilization,
+                               self.predicted.sum()/(n_slots*plan.makespan))
+
+    def test_wall_clock_limit(self):
+        "Test that visits over the wall-clock limit are set aside."
+        plan = schedule_visits(self.obsHistID, self.predicted, 8, wall_clock_limit=20.)
+        self.assertTrue(np.all(plan.predicted <= 20.))
+        np.testing.assert_array_equal(plan.too_long, self.obsHistID[self.predicted > 20.])
+        self.assertEqual(plan.summary()['visits'] + plan.summary()['too_long'], 200)
+        self.assertRaises(ValueError, schedule_visits, [1], [1.], 0)
+        self.assertEqual(schedule_visits([], [], 4).makespan, 0.)
+
+    def test_visit_list(self):
+        "Test that the visit list holds the visits of each section in plan order."
+        plans = [('Twinkles 3.1', schedule_visits(self.obsHistID[:50], self.predicted[:50], 4)),
+                 ('Twinkles 3.2', schedule_visits(self.obsHistID[50:], self.predicted[50:], 4))]
+        visit_list = os.path.join(self.work_dir, 'visits.txt')
+        write_visit_list(visit_list, plans)
+        with open(visit_list) as input_file:
+            lines = input_file.read().splitlines()
+        self.assertEqual(lines[0], '# Begin Section Twinkles 3.1')
+        visits = [int(line) for line in lines if line.strip().isdigit()]
+        np.testing.assert_array_equal(visits, np.concatenate([plan.obsHistID for _, plan in plans]))
+
+    def test_too_long_sections(self):
+        "Test that the visits over the wall-clock limit follow in their own sections."
+        plans = [('Twinkles 3.1', schedule_visits(self.obsHistID[:50], self.predicted[:50],
+                                                  4, wall_clock_limit=20.)),
+                 ('Twinkles 3.2', schedule_visits(self.obsHistID[50:], self.predicted[50:],
+                                                  4, wall_clock_limit=20.))]
+        self.assertTrue(all(len(plan.too_long) > 0 for _, plan in plans))
+        visit_list = os.path.join(self.work_dir, 'visits.txt')
+        write_visit_list(visit_list, plans)
+        sections = {}
+        with open(visit_list) as input_file:
+            for line in input_file:
+                if line.startswith('# Begin Section '):
+                    title = line[len('# Begin Section '):].strip()
+                    sections[title] = []
+                elif not line.startswith('#'):
+                    sections[title].append(int(line))
+        self.assertEqual(list(sections), ['Twinkles 3.1', 'Twinkles 3.2',
+                                          'Twinkles 3.1 over the wall-clock limit',
+                                          'Twinkles 3.2 over the wall-clock limit'])
+        for title, plan in plans:
+            np.testing.assert_array_equal(sections[title], plan.obsHistID)
+            np.testing.assert_array_equal(sections[title + ' over the wall-clock limit'],
+                                          plan.too_long)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ import GCRCatalogs
 import pandas as pd
 from GCR import GCRQuery
 from lsst.sims.photUtils import Sed, Bandpass, BandpassDict
+from desc.twinkles import sed_cache
 sys.path.append('/global/homes/b/brycek/DC2/sims_GCRCatSimInterface/workspace/sed_cache/')
 from SedFitter import sed_from_galacticus_mags
 
@@ -238,8 +239,7 @@ if __name__ == "__main__":
     for i, idx in list(enumerate(keep_rows)):
         if i % 10000 == 0:
             print(i, idx)
-        test_sed = Sed()
-        test_sed.readSED_flambda(os.path.join(str(os.environ['SIMS_SED_LIBRARY_DIR']), sed_name_array[i]))
+        test_sed = sed_cache.get_sed(os.path.join(str(os.environ['SIMS_SED_LIBRARY_DIR']), sed_name_array[i]))
         fnorm = test_sed.calcFluxNorm(dc2_df_system['lensgal_mi'].iloc[idx], test_bandpassDict['i'])
         test_sed.multiplyFluxNorm(fnorm)
         magNorm_diff = magNorm_array[3, i] - test_sed.calcMag(imsimband)
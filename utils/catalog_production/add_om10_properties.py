@@ -13,6 +13,7 @@ from GCR import GCRQuery
 sys.path.append('/global/homes/b/brycek/DC2/sims_GCRCatSimInterface/workspace/sed_cache/')
 from SedFitter import sed_from_galacticus_mags
 from lsst.sims.photUtils import Sed, Bandpass, BandpassDict
+from desc.twinkles import sed_cache
 
 
 def get_sl2s_data():
@@ -374,8 +375,7 @@ if __name__ == "__main__":
     for i, idx in list(enumerate(keep_rows)):
         if i % 10000 == 0:
             print(i, idx)
-        test_sed = Sed()
-        test_sed.readSED_flambda(os.path.join(str(os.environ['SIMS_SED_LIBRARY_DIR']), sed_name_array[i]))
+        test_sed = sed_cache.get_sed(os.path.join(str(os.environ['SIMS_SED_LIBRARY_DIR']), sed_name_array[i]))
         fnorm = test_sed.calcFluxNorm(twinkles_lenses['APMAG_I'][idx], test_bandpassDict['i'])
         test_sed.multiplyFluxNorm(fnorm)
         magNorm_diff = magNorm_array[3, i] - test_sed.calcMag(imsimband)
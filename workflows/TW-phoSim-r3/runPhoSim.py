@@ -4,6 +4,7 @@
 
 import os,sys
 import subprocess,shlex
+import time,json,socket,resource,gzip
 
 print '\n\n=====================================================================\n Entering runPhoSim.py\n=====================================================================\n'
 sys.stdout.flush()
@@ -133,9 +134,41 @@ sys.stdout.flush()
 
 ## New way to execute phoSim, buffers stderr in case phosim does not adjust the return code properly
 cmdList = shlex.split(cmd)
+startTime = time.time()
+startUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
 xphosim = subprocess.Popen(cmdList, stderr=subprocess.PIPE)
 yak = xphosim.communicate()
 rc = xphosim.returncode
+endUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+## Record the run time of this phoSim segment in the permanent work
+## directory, where desc.twinkles.harvest_phosim_runtimes() finds it
+nObjects = 0
+if ic.endswith('.gz'):
+    icFile = gzip.open(ic)
+else:
+    icFile = open(ic)
+    pass
+for line in icFile:
+    if line.startswith('object'): nObjects += 1
+    pass
+icFile.close()
+runtime = {'obsHistID':int(os.getenv('TW_OBSHISTID','-1')),
+           'sensor':sensor,
+           'checkpoint':int(prep.nextCP) if prep.checkpoint else -1,
+           'start':startTime,
+           'wall_time':time.time()-startTime,
+           'cpu_time':(endUsage.ru_utime-startUsage.ru_utime)+(endUsage.ru_stime-startUsage.ru_stime),
+           'host':socket.gethostname(),
+           'rc':rc,
+           'n_objects':nObjects}
+try:
+    rfd = open(os.path.join(work2,'phosim_runtimes.txt'),'a')
+    rfd.write(json.dumps(runtime)+'\n')
+    rfd.close()
+except IOError:
+    log.warning('Unable to record the phoSim run time in '+work2)
+    pass
 print 'phoSim rc = ',rc,', type(rc) = ',type(rc)
 if len(yak[1]) > 0:
     print '\n\n$WARNING: phoSim stderr output:\n',yak[1]
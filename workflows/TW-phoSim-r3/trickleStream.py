@@ -123,6 +123,29 @@ trickleParms['maxStreamsPerCycle'] = 50
 trickleParms['timePerCycle'] = 60
 
 
+## Visit list planned for a number of batch slots (written by
+## get_twinkles_visits.py --nSlots, see desc.twinkles.visit_scheduler):
+## one stream per obsHistID line, as setupVisit.py counts them, and no
+## more running phoSim jobs than there are slots in the plan.
+visitList = os.getenv('TW_VISIT_LIST')
+if visitList is not None:
+    nVisits = 0
+    nSlots = None
+    for line in open(visitList):
+        if line.strip().isdigit():
+            nVisits += 1
+        elif ' visits in ' in line and nSlots is None:
+            nSlots = int(line.split(' visits in ')[1].split()[0])
+            pass
+        pass
+    trickleParms['maxRuns'] = nVisits
+    if nSlots is not None:
+        trickleParms['steps'] = [['/singleSensor phoSim',nSlots,1]]
+        pass
+    print 'Visit list ',visitList,': ',nVisits,' visits, ',nSlots,' slots'
+    pass
+
+
 ## ## Flat-out running configuration
 ## step1 = ['mergeClumps',2500,1]
 ## trickleParms['steps'] = [step1]
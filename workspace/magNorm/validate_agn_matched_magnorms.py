@@ -1,6 +1,7 @@
 #import GCRCatalogs
 import astropy.io.fits as fits
 import lsst.sims.photUtils as sims_photUtils
+from desc.twinkles import sed_cache
 import numpy as np
 import os
 
@@ -53,9 +54,8 @@ with open('i_mag_validation.txt', 'w') as out_file:
         #valid = np.where(galaxy_id==g_id)[0]
         zz = twinkles_data['ZLENS'][idx]
 
-        spec = sims_photUtils.Sed()
         full_file_name = os.path.join(sed_dir, sed_name)
-        spec.readSED_flambda(full_file_name)
+        spec = sed_cache.get_sed(full_file_name)
         fnorm = sims_photUtils.getImsimFluxNorm(spec, i_magnorm)
         spec.multiplyFluxNorm(fnorm)
         if dust_wav is None or not np.array_equal(spec.wavelen, dust_wav):